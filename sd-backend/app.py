@@ -1,37 +1,47 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
-import torch
-from diffusers import (
-    AutoPipelineForImage2Image,
-    AutoPipelineForText2Image,
-    StableDiffusionPipeline,
-    StableDiffusionImg2ImgPipeline,
-    StableDiffusionXLPipeline,
-    StableDiffusionXLImg2ImgPipeline,
-    DPMSolverMultistepScheduler,
-    EulerAncestralDiscreteScheduler,
-    EulerDiscreteScheduler,
-    T2IAdapter,
-    StableDiffusionAdapterPipeline,
-    ControlNetModel,
-    StableDiffusionControlNetPipeline,
-    StableDiffusionXLControlNetPipeline,
-    StableDiffusionControlNetImg2ImgPipeline,
-    StableDiffusionXLControlNetImg2ImgPipeline,
-)
+# torch / diffusers sa importujú až pri prvom použití (lazy_imports.py) —
+# import app.py a /health tak nečakajú sekundy na CUDA a pipeline triedy.
+from lazy_imports import lazy_import, is_loaded, import_report
+torch = lazy_import('torch')
+diffusers = lazy_import('diffusers')
 from PIL import Image, ImageFilter
-import io
-import base64
 import numpy as np
 import os
 import inspect
+import itertools
+import functools
+import re
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from remove_background import remove_black_background
-from color_transform import shift_hue, adjust_saturation, apply_color_tint
+from color_transform import shift_hue, adjust_saturation, apply_color_tint, HsvImage, pack_atlas
+from gpu_queue import GpuJobQueue, JobCancelled, QueueFull
+from progress import StepReporter, stream_events
+from model_cache import VramManager
+from lora_index import LoraIndex, LoraIncompatible
+from caches import LRUCache, SpillCache, content_hash
+from result_cache import ResultCache
+from image_transport import parse_request, encode_response, open_image
+from service import (
+    GenerationService, GenerateRequest, ControlNetRequest, AdapterRequest, CharacterRequest,
+    ClearGpuRequest, RemoveBackgroundRequest, AdjustHueRequest, RecolorBatchRequest,
+)
 
 app = Flask(__name__)
 CORS(app)
 
+# Byte-accounted LRU over every cached pipeline / ControlNet / adapter /
+# preprocessor, evicting against a VRAM budget — see model_cache.py.
+vram = VramManager()
+
+# All GPU work (generate routes, /clear-gpu) runs on this queue's single
+# worker thread — see gpu_queue.py.
+gpu_queue = GpuJobQueue(on_job_start=vram.begin_job)
+
 # Priečinok pre LoRA modely
 LORA_DIR = "./lora_models"
 
@@ -39,81 +49,351 @@ LORA_DIR = "./lora_models"
 LORA_DIR = "./lora_models"
 
 # Pipelines map to support multiple models (loaded on demand)
-pipelines = {
-    # key -> { 'pipe': pipeline_obj, 'img2img': img2img_obj, 'version': str }
+# key -> { 'pipe': pipeline_obj, 'img2img': img2img_obj, 'version': str }
+pipelines = vram.cache('pipelines')
+
+# Rough fp16 footprint per model family, used to make room in the VRAM
+# budget BEFORE a model is loaded for the first time. Once a model has been
+# loaded its measured size is used instead.
+VRAM_ESTIMATE_MB = {
+    'sd15': 2200,
+    'sd21': 2700,
+    'xl': 7000,
+    'controlnet_sd15': 750,
+    'controlnet_sd21': 750,
+    'controlnet_xl': 2500,
+    'adapter': 160,
+    'tiny_vae': 20,
+    'lightning_lora': 400,  # Lightning entry whose SDXL UNet is already resident
 }
 
-# Aktuálne načítaná LoRA (aby sme vedeli či treba unfuse)
-current_lora = {
-    'name': None,
-    'scale': None
-}
+
+def _with_vram_retry(label: str, load_fn):
+    """Run `load_fn`; on CUDA OOM evict everything the current job isn't using and retry once."""
+    try:
+        return load_fn()
+    except torch.cuda.OutOfMemoryError:
+        print(f"⚠️  CUDA OOM pri načítaní {label} — uvoľňujem nepoužívané modely a skúšam znova")
+        vram.evict_unused()
+        return load_fn()
+
+# mtime-invalidovaný index LoRA súborov + RAM cache ich váh — viď lora_index.py
+lora_index = LoraIndex(LORA_DIR)
+
 
 def get_available_loras():
     """Vráti zoznam dostupných LoRA modelov (aj v podpriečinkoch)"""
-    if not os.path.exists(LORA_DIR):
-        os.makedirs(LORA_DIR, exist_ok=True)
-        return []
-    
-    loras = []
-    for file in Path(LORA_DIR).rglob('*'):
-        if file.suffix in ['.safetensors', '.pt', '.bin']:
-            loras.append(file.stem)
-    return loras
+    return lora_index.names()
 
 def find_lora_path(lora_name):
     """Nájde cestu k LoRA súboru podľa názvu (aj v podpriečinkoch)"""
-    for ext in ['.safetensors', '.pt', '.bin']:
-        for file in Path(LORA_DIR).rglob(f'{lora_name}{ext}'):
-            return str(file)
-    return None
+    info = lora_index.get(lora_name)
+    return info.path if info else None
 
-def load_lora_to_pipeline(pipe_entry, lora_name, lora_scale=0.9):
+# ─── Per-request LoRA: unfused named adapters ───
+#
+# LoRAs are loaded once per UNet as named PEFT adapters and stay resident
+# (unfused). Each request just activates its own adapter + scale with
+# `set_adapters`, so switching styles between requests costs no
+# unfuse/load/fuse cycle and interleaved requests can't corrupt each other.
+# The img2img / ControlNet / adapter pipelines share the UNet and text
+# encoders with the base pipe, so activating on the base pipe covers them.
+LORA_MAX_RESIDENT = int(os.environ.get('LORA_MAX_RESIDENT', '4'))
+
+# UNet module -> OrderedDict(adapter_name -> lora_name), LRU first. Weak keys:
+# when a pipeline is evicted its adapters are gone with it.
+_resident_loras = weakref.WeakKeyDictionary()
+# UNet module -> names of the SDXL Lightning adapters loaded on it. Not
+# counted against LORA_MAX_RESIDENT and never LRU-deleted.
+_lightning_adapters = weakref.WeakKeyDictionary()
+
+
+def _lora_adapter_name(lora_name: str, pipe) -> str:
+    # PEFT adapter names end up in module keys (no dots). Text encoders can be
+    # shared between SDXL entries with different UNets (see
+    # _shared_components), so the name is made unique per UNet.
+    safe = re.sub(r'[^0-9A-Za-z_]', '_', lora_name)
+    return f"{safe}_{id(pipe.unet):x}"
+
+
+def apply_lora(pipe_entry, lora_name, lora_scale=0.9, lightning=True):
     """
-    Načíta LoRA do pipeline.
-    Ak už je nejaká LoRA načítaná, najprv ju unfuse.
+    Aktivuje LoRA `lora_name` so `lora_scale` pre nasledujúce volanie pipeline.
+    Prázdny `lora_name` LoRA vypne. Nová LoRA sa načíta ako adapter (bez fuse);
+    najdlhšie nepoužitá sa zmaže pri prekročení LORA_MAX_RESIDENT.
+    Lightning záznamy majú navyše aktívny svoj few-step adapter (scale 1.0);
+    `lightning=False` ho vypne — UNet potom beží ako čisté SDXL base.
     """
-    global current_lora
-    
+    pipe = pipe_entry['pipe']
+    resident = _resident_loras.setdefault(pipe.unet, OrderedDict())
+    base = [pipe_entry['lightning_adapter']] if lightning and pipe_entry.get('lightning_adapter') else []
+
     if not lora_name:
-        # Ak je lora_name prázdny, unfuse aktuálnu LoRA
-        if current_lora['name']:
-            print(f"🔄 Unfusing aktuálnu LoRA: {current_lora['name']}")
-            try:
-                pipe_entry['pipe'].unfuse_lora()
-                pipe_entry['img2img'].unfuse_lora()
-            except:
-                pass  # Možno nie je načítaná
-            current_lora['name'] = None
-            current_lora['scale'] = None
+        if base:
+            pipe.enable_lora()
+            pipe.set_adapters(base, adapter_weights=[1.0] * len(base))
+        elif (resident or _lightning_adapters.get(pipe.unet)
+              or any(_te_lora_state.get(te) for te in _text_encoders(pipe))):
+            pipe.disable_lora()
+        _set_text_encoder_lora(pipe, None)
         return
-    
-    lora_path = find_lora_path(lora_name)
-    if not lora_path:
-        raise FileNotFoundError(f"LoRA súbor nenájdený: {lora_name}")
-    
-    print(f"🎨 Načítavam LoRA: {lora_name} (scale={lora_scale})")
-    
-    # Unfuse predchádzajúcu LoRA ak existuje
-    if current_lora['name']:
-        print(f"🔄 Unfusing predchádzajúcu LoRA: {current_lora['name']}")
-        try:
-            pipe_entry['pipe'].unfuse_lora()
-            pipe_entry['img2img'].unfuse_lora()
-        except:
-            pass
-    
-    # Načítaj novú LoRA (zostane na tom istom device kde je pipeline)
-    pipe_entry['pipe'].load_lora_weights(lora_path)
-    pipe_entry['pipe'].fuse_lora(lora_scale=lora_scale)
-    
-    pipe_entry['img2img'].load_lora_weights(lora_path)
-    pipe_entry['img2img'].fuse_lora(lora_scale=lora_scale)
-    
-    current_lora['name'] = lora_name
-    current_lora['scale'] = lora_scale
-    
-    print(f"✅ LoRA načítaná a fused s scale={lora_scale}")
+
+    adapter_name = _lora_adapter_name(lora_name, pipe)
+    if adapter_name in resident:
+        resident.move_to_end(adapter_name)
+    else:
+        # Nekompatibilná LoRA (podľa hlavičky safetensors) sa odmietne skôr,
+        # než sa akékoľvek váhy dotknú pipeline.
+        model_key = pipe_entry['version']
+        lora_index.check_compatible(lora_name, _model_family(model_key), model_key)
+        state_dict = lora_index.load_state_dict(lora_name)
+        while len(resident) >= max(1, LORA_MAX_RESIDENT):
+            old_adapter, old_name = resident.popitem(last=False)
+            print(f"🔄 Uvoľňujem LoRA adapter: {old_name}")
+            pipe.delete_adapters(old_adapter)
+        print(f"🎨 Načítavam LoRA: {lora_name} (adapter '{adapter_name}')")
+        pipe.load_lora_weights(state_dict, adapter_name=adapter_name)
+        resident[adapter_name] = lora_name
+
+    pipe.enable_lora()
+    pipe.set_adapters(base + [adapter_name], adapter_weights=[1.0] * len(base) + [float(lora_scale)])
+    # LoRA len pre UNet nemení text embeddingy — cache promptov ostáva platná.
+    info = lora_index.get(lora_name)
+    unet_only = info is not None and info.targets and not any(
+        t.startswith('text_encoder') for t in info.targets
+    )
+    _set_text_encoder_lora(pipe, None if unet_only else (lora_name, float(lora_scale)))
+    print(f"✅ LoRA aktívna: {lora_name} (scale={lora_scale})")
+
+
+def _resident_lora_names():
+    return sorted({name for loaded in _resident_loras.values() for name in loaded.values()})
+
+
+# ─── Prompt-embedding cache ───
+#
+# Editor users re-send the same prompt with a new seed / strength / noise
+# mask, so the text-encoder pass (two encoders on SDXL) is repeated for
+# nothing — a large share of the time on the 1–4 step models. Embeddings
+# are cached per text-encoder instance (shared encoders → shared entries),
+# active text-encoder LoRA, prompt, negative prompt and CFG on/off, and
+# passed to the pipelines via `prompt_embeds` & co.
+PROMPT_EMBED_CACHE_MB = float(os.environ.get('PROMPT_EMBED_CACHE_MB', '64'))
+prompt_embed_cache = LRUCache(max_bytes=int(PROMPT_EMBED_CACHE_MB * 1024 ** 2), name='prompt_embeds')
+
+# Text encoder module -> (lora_name, scale) active on it, or None.
+_te_lora_state = weakref.WeakKeyDictionary()
+# Module (text encoder, VAE) -> stable token (id() can be reused after eviction).
+_module_tokens = weakref.WeakKeyDictionary()
+_module_counter = itertools.count(1)
+
+_PROMPT_EMBED_NAMES = (
+    'prompt_embeds', 'negative_prompt_embeds',
+    'pooled_prompt_embeds', 'negative_pooled_prompt_embeds',
+)
+
+
+def _text_encoders(pipe):
+    return [te for te in (getattr(pipe, 'text_encoder', None), getattr(pipe, 'text_encoder_2', None)) if te is not None]
+
+
+def _set_text_encoder_lora(pipe, state):
+    for te in _text_encoders(pipe):
+        _te_lora_state[te] = state
+
+
+def _module_token(module):
+    token = _module_tokens.get(module)
+    if token is None:
+        token = _module_tokens[module] = next(_module_counter)
+    return token
+
+
+def _encode_prompt_cached(pipe, prompt, negative_prompt, do_cfg):
+    encoders = _text_encoders(pipe)
+    key = (
+        tuple(_module_token(te) for te in encoders),
+        tuple(_te_lora_state.get(te) for te in encoders),
+        prompt, negative_prompt, do_cfg,
+    )
+    embeds = prompt_embed_cache.get(key)
+    if embeds is None:
+        with torch.no_grad():
+            out = pipe.encode_prompt(
+                prompt=prompt,
+                device=pipe._execution_device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=do_cfg,
+                negative_prompt=negative_prompt,
+            )
+        embeds = {name: t for name, t in zip(_PROMPT_EMBED_NAMES, out) if t is not None}
+        prompt_embed_cache.put(key, embeds)
+    return embeds
+
+
+def prompt_embed_kwargs(pipe, prompt, negative_prompt, guidance_scale):
+    """
+    Nahradí `prompt` / `negative_prompt` pre volanie `pipe(...)` embeddingami
+    z cache. `prompt` môže byť aj zoznam (batch) — potom aj `negative_prompt`.
+    `negative_prompt` sa odovzdá tak, ako by ho dostala pipeline (None vs ''
+    sa pri SDXL líši).
+    """
+    do_cfg = float(guidance_scale) > 1.0
+    if not isinstance(prompt, list):
+        return dict(_encode_prompt_cached(pipe, prompt, negative_prompt, do_cfg))
+    parts = [_encode_prompt_cached(pipe, p, n, do_cfg) for p, n in zip(prompt, negative_prompt)]
+    return {name: torch.cat([part[name] for part in parts]) for name in parts[0]}
+
+
+# ─── Step progress / cancel ───
+#
+# Every diffusion call of a job reports its steps to the job (progress.py):
+# `GET /jobs/<id>/stream` shows them with cheap latent previews and
+# `POST /jobs/<id>/cancel` stops the job at the next step.
+def _step_reporter(pipe):
+    jobs = gpu_queue.running_jobs()
+    if not jobs:
+        return None
+    family = 'xl' if getattr(pipe, 'text_encoder_2', None) is not None else 'sd'
+    return StepReporter(jobs, pipe=pipe, family=family)
+
+
+def progress_kwargs(pipe):
+    """Step-callback kwargs pre `pipe(...)`, ktoré hlásia priebeh bežiaceho jobu."""
+    reporter = _step_reporter(pipe)
+    if reporter is None:
+        return {}
+    params = inspect.signature(pipe.__call__).parameters
+    if 'callback_on_step_end' in params:
+        return {'callback_on_step_end': reporter.on_step_end}
+    if 'callback' in params:
+        return {'callback': reporter.legacy_callback, 'callback_steps': 1}
+    return {}
+
+
+# ─── Init-image latent cache ───
+#
+# Users iterating on one building vary only seed / strength, yet every
+# img2img call re-runs the VAE encoder on the same init image (at 1024² on
+# SDXL about as costly as a Lightning step). Latents are cached by image
+# hash + resolution + VAE instance + dtype, so routes sharing a VAE (see
+# _shared_components) share entries too. Diffusers img2img pipelines accept
+# 4-channel latents directly as `image`.
+#
+# Cached latents are the latent-distribution MEAN (like the WebGPU loop),
+# whereas diffusers samples it with the request generator — results of the
+# diffusers img2img paths therefore differ slightly from before for a seed.
+LATENT_CACHE_MB = float(os.environ.get('LATENT_CACHE_MB', '128'))
+latent_cache = LRUCache(max_bytes=int(LATENT_CACHE_MB * 1024 ** 2), name='init_latents')
+
+
+def _encode_init_latents(vae, image: Image.Image, dtype, sdxl: bool):
+    img_np = np.asarray(image.convert('RGB'), dtype=np.float32) / 255.0
+    img_t = torch.from_numpy(img_np * 2.0 - 1.0).permute(2, 0, 1).unsqueeze(0)
+    if isinstance(vae, diffusers.AutoencoderTiny):
+        # TAESD kóduje priamo do škálovaných latentov (scaling_factor = 1.0)
+        with torch.no_grad():
+            return vae.encode(img_t.to(device=vae.device, dtype=vae.dtype)).latents.to(dtype)
+    # SDXL VAE overflows in fp16 — upcast for the encode like the SDXL
+    # pipelines do (the SD 1.x / 2.x pipelines encode in fp16).
+    upcast = sdxl and vae.dtype == torch.float16 and getattr(vae.config, 'force_upcast', False)
+    if upcast:
+        vae.to(dtype=torch.float32)
+    try:
+        with torch.no_grad():
+            latents = vae.encode(img_t.to(device=vae.device, dtype=vae.dtype)).latent_dist.mean
+    finally:
+        if upcast:
+            vae.to(dtype=torch.float16)
+    latents_mean = getattr(vae.config, 'latents_mean', None)
+    latents_std = getattr(vae.config, 'latents_std', None)
+    if sdxl and latents_mean is not None and latents_std is not None:
+        mean = torch.tensor(latents_mean, device=latents.device).view(1, -1, 1, 1)
+        std = torch.tensor(latents_std, device=latents.device).view(1, -1, 1, 1)
+        latents = (latents - mean) * vae.config.scaling_factor / std
+    else:
+        latents = latents * vae.config.scaling_factor
+    return latents.to(dtype)
+
+
+def init_latents_cached(pipe, image: Image.Image, fast_decode: bool = False):
+    """
+    Škálované VAE latenty init obrázka pre `pipe` (z cache). Pri pipeline s
+    CPU offloadom vráti pôvodný obrázok — VAE tam nie je na GPU mimo forward.
+    S `fast_decode` kóduje malý TAESD autoencoder (vlastné položky v cache).
+    """
+    if hasattr(pipe.vae, '_hf_hook'):
+        return image
+    vae = load_tiny_vae(_pipe_vae_family(pipe)) if fast_decode else pipe.vae
+    dtype = pipe.unet.dtype
+    key = (content_hash(image), image.size, _module_token(vae), str(vae.dtype), str(dtype))
+    latents = latent_cache.get(key)
+    if latents is None:
+        sdxl = getattr(pipe, 'text_encoder_2', None) is not None
+        latents = _encode_init_latents(vae, image, dtype, sdxl)
+        latent_cache.put(key, latents)
+    return latents
+
+
+# ─── Tiny VAE (TAESD) fast decode ───
+#
+# On 1-step SD-Turbo and 4-step Lightning the full VAE decode is a large
+# share of the request. `fast_decode` (per request, or per model via the
+# registry flag / FAST_DECODE_MODELS) decodes with the distilled TAESD /
+# TAESDXL autoencoder instead — a few MB of weights, several times faster,
+# slightly softer detail; meant for previews and drafts. The tiny VAEs live
+# in the VRAM cache next to the pipelines; `bench_vae.py` compares them
+# with the full VAE.
+TINY_VAE_REGISTRY = {
+    'sd': 'madebyollin/taesd',      # SD 1.x / 2.x (vrátane SD-Turbo)
+    'xl': 'madebyollin/taesdxl',    # SDXL (vrátane Lightning)
+}
+FAST_DECODE_MODELS = {k.strip() for k in os.environ.get('FAST_DECODE_MODELS', '').split(',') if k.strip()}
+tiny_vaes = vram.cache('tiny_vaes')  # 'sd' | 'xl' -> AutoencoderTiny
+
+
+def _pipe_vae_family(pipe) -> str:
+    return 'xl' if getattr(pipe, 'text_encoder_2', None) is not None else 'sd'
+
+
+def load_tiny_vae(family: str):
+    if family in tiny_vaes:
+        return tiny_vaes[family]
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dtype = torch.float16 if device == 'cuda' else torch.float32
+    print(f"⬇️  Loading tiny VAE {TINY_VAE_REGISTRY[family]} ...")
+    vram.make_room(vram.estimate(('tiny_vaes', family), VRAM_ESTIMATE_MB['tiny_vae'] * 1024 ** 2))
+    vae = _with_vram_retry(
+        f"tiny VAE '{family}'",
+        lambda: diffusers.AutoencoderTiny.from_pretrained(TINY_VAE_REGISTRY[family], torch_dtype=dtype).to(device),
+    )
+    tiny_vaes[family] = vae
+    return vae
+
+
+def fast_decode_enabled(model_key: str, data: dict) -> bool:
+    """Per-request `fast_decode` má prednosť pred nastavením modelu."""
+    if data.get('fast_decode') is not None:
+        return bool(data['fast_decode'])
+    return model_key in FAST_DECODE_MODELS or bool(MODEL_REGISTRY.get(model_key, {}).get('fast_decode'))
+
+
+def decode_latents(vae, latents) -> list:
+    """Škálované latenty → PIL obrázky (plný VAE aj TAESD)."""
+    with torch.no_grad():
+        decoded = vae.decode(latents.to(device=vae.device, dtype=vae.dtype) / vae.config.scaling_factor).sample
+    decoded = (decoded.clamp(-1, 1).float() + 1.0) / 2.0
+    arr = (decoded.permute(0, 2, 3, 1).cpu().numpy() * 255.0).round().astype(np.uint8)
+    return [Image.fromarray(a) for a in arr]
+
+
+def pipe_images(pipe, fast_decode: bool = False, **kwargs) -> list:
+    """`pipe(**kwargs).images`; s `fast_decode` pipeline vráti latenty a dekóduje ich TAESD."""
+    if not fast_decode or hasattr(pipe.vae, '_hf_hook'):
+        return pipe(**kwargs).images
+    latents = pipe(**kwargs, output_type='latent').images
+    return decode_latents(load_tiny_vae(_pipe_vae_family(pipe)), latents)
+
 
 MODEL_REGISTRY = {
     'lite': {
@@ -182,72 +462,135 @@ MODEL_REGISTRY = {
 
 def load_pipeline(key: str):
     """Načíta a vráti pipeline pre daný kľúč (lite/full). Nahráva sa on-demand."""
-    global pipelines
-
     if key in pipelines:
         return pipelines[key]
 
     if key not in MODEL_REGISTRY:
         raise ValueError(f"Unknown model key: {key}")
 
+    family = MODEL_REGISTRY[key].get('type', 'sd15')
+    estimate_mb = VRAM_ESTIMATE_MB[family]
+    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    if MODEL_REGISTRY[key].get('lightning') and 'unet' in _shared_components_for(key, dtype):
+        estimate_mb = VRAM_ESTIMATE_MB['lightning_lora']  # len adapter na zdieľanom UNet
+    vram.make_room(vram.estimate(('pipelines', key), estimate_mb * 1024 ** 2))
+    return _with_vram_retry(f"modelu '{key}'", lambda: _load_pipeline(key))
+
+
+# ─── Component sharing between MODEL_REGISTRY entries ───
+#
+# Several registry entries point at the same checkpoint (`sdxl`,
+# `sdxl-lightning-4`, `sdxl-lightning-8` all use SDXL base 1.0). Components
+# are pooled by (checkpoint, subfolder, dtype) so a second entry reuses the
+# VAE / text encoders / tokenizers / UNet already in memory and only loads
+# what really differs. The Lightning LoRAs stay unfused named adapters on
+# the shared UNet (see _load_pipeline / apply_lora), so all three entries
+# run on ONE resident SDXL backbone. The pool holds weak references: once
+# the last pipeline using a component is evicted, the component goes with it.
+SHAREABLE_COMPONENTS = ('vae', 'text_encoder', 'text_encoder_2', 'tokenizer', 'tokenizer_2', 'unet')
+_shared_components = weakref.WeakValueDictionary()  # (model_id, name, dtype) -> component
+
+
+def _shared_components_for(key: str, dtype):
+    model_id = MODEL_REGISTRY[key]['id']
+    found = {}
+    for name in SHAREABLE_COMPONENTS:
+        component = _shared_components.get((model_id, name, str(dtype)))
+        if component is not None:
+            found[name] = component
+    return found
+
+
+def _register_shared_components(key: str, pipe, dtype):
+    model_id = MODEL_REGISTRY[key]['id']
+    for name in SHAREABLE_COMPONENTS:
+        component = getattr(pipe, name, None)
+        if component is None:
+            continue
+        try:
+            _shared_components[(model_id, name, str(dtype))] = component
+        except TypeError:
+            pass  # not weak-referenceable — just don't share it
+
+
+def _scheduler_for(key: str, config):
+    """Scheduler záznamu `key` z pôvodnej konfigurácie scheduleru checkpointu."""
+    cfg = MODEL_REGISTRY[key]
+    # Scheduler nastavenie - pre Realistic Vision použiť Euler
+    if cfg.get('turbo') or key == 'realistic':
+        return diffusers.EulerAncestralDiscreteScheduler.from_config(config)
+    if key in ['dreamshaper', 'absolutereality', 'epicrealism', 'majicmix']:
+        # Pre concept art modely použiť DDIM alebo Euler
+        return diffusers.EulerDiscreteScheduler.from_config(config)
+    scheduler = diffusers.DPMSolverMultistepScheduler.from_config(config)
+    if cfg.get('lightning'):
+        # Euler with `timestep_spacing="trailing"` is required by ByteDance's LoRA.
+        scheduler = diffusers.EulerDiscreteScheduler.from_config(scheduler.config, timestep_spacing="trailing")
+    return scheduler
+
+
+def _load_pipeline(key: str):
     model_id = MODEL_REGISTRY[key]['id']
     model_type = MODEL_REGISTRY[key].get('type', 'sd15')  # default SD 1.5
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dtype = torch.float16 if device == 'cuda' else torch.float32
     print(f"🚀 Načítavam model '{key}' -> {model_id} na zariadenie: {device}")
 
+    # Components already loaded for the same checkpoint by another registry
+    # entry are passed in, so from_pretrained skips loading them again.
+    shared = _shared_components_for(key, dtype)
+    if shared:
+        print(f"♻️  Zdieľam komponenty z už načítaného {model_id}: {', '.join(sorted(shared))}")
+
     try:
         # SDXL and Turbo models use different pipeline classes
         if MODEL_REGISTRY[key].get('turbo'):
             print("⚡ Používam SD Turbo PyTorch pipeline...")
-            pipe = AutoPipelineForText2Image.from_pretrained(
+            pipe = diffusers.AutoPipelineForText2Image.from_pretrained(
                 model_id,
-                torch_dtype=torch.float16 if device == 'cuda' else torch.float32,
+                torch_dtype=dtype,
                 variant="fp16" if device == 'cuda' else None,
                 use_safetensors=True,
+                **shared,
             )
         elif model_type == 'xl':
             print("🌟 Používam SDXL pipeline...")
-            pipe = StableDiffusionXLPipeline.from_pretrained(
+            pipe = diffusers.StableDiffusionXLPipeline.from_pretrained(
                 model_id,
-                torch_dtype=torch.float16 if device == 'cuda' else torch.float32,
+                torch_dtype=dtype,
                 use_safetensors=True,
                 variant="fp16" if device == 'cuda' else None,
+                **shared,
             )
         else:
-            pipe = StableDiffusionPipeline.from_pretrained(
+            pipe = diffusers.StableDiffusionPipeline.from_pretrained(
                 model_id,
-                torch_dtype=torch.float16 if device == 'cuda' else torch.float32,
+                torch_dtype=dtype,
                 safety_checker=None,
                 requires_safety_checker=False,
+                **shared,
             )
 
-        # Scheduler nastavenie - pre Realistic Vision použiť Euler
-        if MODEL_REGISTRY[key].get('turbo'):
-            pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(pipe.scheduler.config)
-        elif key == 'realistic':
-            pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(pipe.scheduler.config)
-        elif key in ['dreamshaper', 'absolutereality', 'epicrealism', 'majicmix']:
-            # Pre concept art modely použiť DDIM alebo Euler
-            pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
-        else:
-            pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+        # Pôvodná konfigurácia scheduleru checkpointu — z nej sa dá postaviť
+        # scheduler iného záznamu s rovnakým UNet (two-pass explore).
+        scheduler_config = pipe.scheduler.config
+        pipe.scheduler = _scheduler_for(key, scheduler_config)
 
-        # SDXL Lightning: fuse the few-step LoRA into the UNet and switch to
-        # Euler with `timestep_spacing="trailing"` (required by ByteDance's LoRA).
-        # The LoRA is fused permanently — we cache 4-step and 8-step variants
-        # under separate model_keys so they don't clash.
+        # SDXL Lightning: the few-step LoRA is a named adapter on the (shared)
+        # SDXL UNet, activated per request by apply_lora. The 4-step and
+        # 8-step LoRAs are separate adapters, so both entries coexist.
+        lightning_adapter = None
         if MODEL_REGISTRY[key].get('lightning'):
             cfg = MODEL_REGISTRY[key]
-            print(f"⚡ Loading SDXL Lightning LoRA: {cfg['lightning_repo']}/{cfg['lightning_weight']}")
-            pipe.load_lora_weights(cfg['lightning_repo'], weight_name=cfg['lightning_weight'])
-            pipe.fuse_lora()
-            try:
-                pipe.unload_lora_weights()
-            except Exception:
-                pass
-            pipe.scheduler = EulerDiscreteScheduler.from_config(
-                pipe.scheduler.config, timestep_spacing="trailing"
-            )
+            lightning_adapter = f"lightning_{cfg['lightning_steps']}step"
+            loaded = _lightning_adapters.setdefault(pipe.unet, set())
+            if lightning_adapter not in loaded:
+                print(f"⚡ Loading SDXL Lightning LoRA: {cfg['lightning_repo']}/{cfg['lightning_weight']}")
+                # UNet-only weights — the text encoders stay untouched.
+                pipe.load_lora_weights(
+                    cfg['lightning_repo'], weight_name=cfg['lightning_weight'], adapter_name=lightning_adapter
+                )
+                loaded.add(lightning_adapter)
             print(f"✅ SDXL Lightning ready ({cfg['lightning_steps']} steps, trailing schedule)")
 
         pipe = pipe.to(device)
@@ -262,9 +605,9 @@ def load_pipeline(key: str):
 
         # Create img2img pipeline sharing components
         if MODEL_REGISTRY[key].get('turbo'):
-            img2img = AutoPipelineForImage2Image.from_pipe(pipe)
+            img2img = diffusers.AutoPipelineForImage2Image.from_pipe(pipe)
         elif model_type == 'xl':
-            img2img = StableDiffusionXLImg2ImgPipeline(
+            img2img = diffusers.StableDiffusionXLImg2ImgPipeline(
                 vae=pipe.vae,
                 text_encoder=pipe.text_encoder,
                 text_encoder_2=pipe.text_encoder_2,
@@ -274,7 +617,7 @@ def load_pipeline(key: str):
                 scheduler=pipe.scheduler,
             )
         else:
-            img2img = StableDiffusionImg2ImgPipeline(
+            img2img = diffusers.StableDiffusionImg2ImgPipeline(
                 vae=pipe.vae,
                 text_encoder=pipe.text_encoder,
                 tokenizer=pipe.tokenizer,
@@ -284,12 +627,15 @@ def load_pipeline(key: str):
                 feature_extractor=pipe.feature_extractor,
             )
         img2img = img2img.to(device)
+        _register_shared_components(key, pipe, dtype)
 
-        pipelines[key] = {
+        pipelines.put(key, {
             'pipe': pipe,
             'img2img': img2img,
             'version': key,
-        }
+            'lightning_adapter': lightning_adapter,
+            'scheduler_config': scheduler_config,
+        })
 
         print(f"✅ Model '{key}' načítaný")
         return pipelines[key]
@@ -306,15 +652,22 @@ def load_pipeline(key: str):
 # T2I-Adapter integration
 # =====================================================================
 # Lazy caches — adapters and adapter-pipelines are loaded on first use.
-adapters = {}              # key -> T2IAdapter
-adapter_pipelines = {}     # f"{model_key}__{adapter_kind}" -> StableDiffusionAdapterPipeline
-controlnets = {}           # key -> ControlNetModel
-controlnet_pipelines = {}  # f"{model_key}__{controlnet_kind}" -> StableDiffusionControlNetPipeline
-preprocessors = {}         # 'depth' | 'canny' | 'lineart' | 'sketch' -> detector
+# All of them are VRAM-managed (LRU-evicted against the budget); derived
+# pipelines are registered with the base pipeline / model they share weights
+# with, so evicting a base also drops everything built on it.
+adapters = vram.cache('adapters')                  # key -> T2IAdapter
+adapter_pipelines = vram.cache('adapter_pipelines')  # f"{model_key}__{adapter_kind}" -> StableDiffusionAdapterPipeline
+controlnets = vram.cache('controlnets')            # f"{family}__{kind}" -> ControlNetModel
+preprocessors = vram.cache('preprocessors')        # 'depth' | 'canny' | 'lineart' | 'sketch' -> detector
 # Pipelines that already have IP-Adapter weights loaded. The diffusers pipeline
 # objects themselves carry the weights; this set is just a fast guard so we
 # don't re-download / re-attach on every request.
 ip_adapter_loaded_pipelines = set()  # set of id(pipe)
+# f"{model_key}__{controlnet_kind}__{i2i|t2i}" -> StableDiffusionControlNet(Img2Img)Pipeline
+controlnet_pipelines = vram.cache(
+    'controlnet_pipelines',
+    on_evict=lambda key, pipe: ip_adapter_loaded_pipelines.discard(id(pipe)),
+)
 
 
 # IP-Adapter weights per base-model family. Only SD1.5 and SDXL have official
@@ -391,8 +744,11 @@ def load_adapter(kind: str):
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     dtype = torch.float16 if device == 'cuda' else torch.float32
     print(f"⬇️  Loading T2I-Adapter '{kind}' ({ADAPTER_REGISTRY[kind]}) ...")
-    a = T2IAdapter.from_pretrained(ADAPTER_REGISTRY[kind], torch_dtype=dtype)
-    a = a.to(device)
+    vram.make_room(vram.estimate(('adapters', kind), VRAM_ESTIMATE_MB['adapter'] * 1024 ** 2))
+    a = _with_vram_retry(
+        f"adaptéra '{kind}'",
+        lambda: diffusers.T2IAdapter.from_pretrained(ADAPTER_REGISTRY[kind], torch_dtype=dtype).to(device),
+    )
     adapters[kind] = a
     print(f"✅ Adapter '{kind}' loaded on {device}")
     return a
@@ -408,10 +764,10 @@ def load_adapter_pipeline(model_key: str, adapter_kind: str):
         return adapter_pipelines[cache_key]
     base_entry = load_pipeline(model_key)
     base = base_entry['pipe']
-    if isinstance(base, StableDiffusionXLPipeline):
+    if isinstance(base, diffusers.StableDiffusionXLPipeline):
         raise ValueError(f"Adapter pipeline currently supports SD1.5 base only; '{model_key}' is SDXL.")
     adapter = load_adapter(adapter_kind)
-    pipe = StableDiffusionAdapterPipeline(
+    pipe = diffusers.StableDiffusionAdapterPipeline(
         vae=base.vae,
         text_encoder=base.text_encoder,
         tokenizer=base.tokenizer,
@@ -424,7 +780,7 @@ def load_adapter_pipeline(model_key: str, adapter_kind: str):
     )
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     pipe = pipe.to(device)
-    adapter_pipelines[cache_key] = pipe
+    adapter_pipelines.put(cache_key, pipe, depends_on=[('pipelines', model_key), ('adapters', adapter_kind)])
     return pipe
 
 
@@ -443,8 +799,13 @@ def load_controlnet(kind: str, model_key: str):
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     dtype = torch.float16 if device == 'cuda' else torch.float32
     print(f"⬇️  Loading ControlNet '{kind}' for {family} ({registry[kind]}) ...")
-    controlnet = ControlNetModel.from_pretrained(registry[kind], torch_dtype=dtype)
-    controlnet = controlnet.to(device)
+    vram.make_room(vram.estimate(
+        ('controlnets', cache_key), VRAM_ESTIMATE_MB[f'controlnet_{family}'] * 1024 ** 2
+    ))
+    controlnet = _with_vram_retry(
+        f"ControlNet '{kind}'",
+        lambda: diffusers.ControlNetModel.from_pretrained(registry[kind], torch_dtype=dtype).to(device),
+    )
     controlnets[cache_key] = controlnet
     print(f"✅ ControlNet '{kind}' loaded on {device}")
     return controlnet
@@ -456,9 +817,9 @@ def load_controlnet_pipeline(model_key: str, controlnet_kind: str, img2img: bool
         return controlnet_pipelines[cache_key]
     base_entry = load_pipeline(model_key)
     base = base_entry['pipe']
-    if isinstance(base, StableDiffusionXLPipeline):
+    if isinstance(base, diffusers.StableDiffusionXLPipeline):
         controlnet = load_controlnet(controlnet_kind, model_key)
-        pipe_cls = StableDiffusionXLControlNetImg2ImgPipeline if img2img else StableDiffusionXLControlNetPipeline
+        pipe_cls = diffusers.StableDiffusionXLControlNetImg2ImgPipeline if img2img else diffusers.StableDiffusionXLControlNetPipeline
         pipe = pipe_cls(
             vae=base.vae,
             text_encoder=base.text_encoder,
@@ -471,7 +832,7 @@ def load_controlnet_pipeline(model_key: str, controlnet_kind: str, img2img: bool
         )
     else:
         controlnet = load_controlnet(controlnet_kind, model_key)
-        pipe_cls = StableDiffusionControlNetImg2ImgPipeline if img2img else StableDiffusionControlNetPipeline
+        pipe_cls = diffusers.StableDiffusionControlNetImg2ImgPipeline if img2img else diffusers.StableDiffusionControlNetPipeline
         pipe = pipe_cls(
             vae=base.vae,
             text_encoder=base.text_encoder,
@@ -485,7 +846,10 @@ def load_controlnet_pipeline(model_key: str, controlnet_kind: str, img2img: bool
         )
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     pipe = pipe.to(device)
-    controlnet_pipelines[cache_key] = pipe
+    controlnet_pipelines.put(cache_key, pipe, depends_on=[
+        ('pipelines', model_key),
+        ('controlnets', f"{_model_family(model_key)}__{controlnet_kind}"),
+    ])
     return pipe
 
 
@@ -510,16 +874,56 @@ def get_preprocessor(kind: str):
     return preprocessors[kind]
 
 
-def _b64_to_pil(b64_str: str) -> Image.Image:
-    if ',' in b64_str:
-        b64_str = b64_str.split(',', 1)[1]  # strip data URL prefix
-    return Image.open(io.BytesIO(base64.b64decode(b64_str))).convert('RGB')
+# ─── Conditioning-map cache ───
+#
+# The 3D editor usually re-sends the same screenshot while only the prompt
+# changes, so depth / lineart / sketch maps are cached by a hash of the
+# source pixels + preprocessor kind + target size. RAM tier spills to disk.
+CONDITIONING_CACHE_MB = float(os.environ.get('CONDITIONING_CACHE_MB', '256'))
+CONDITIONING_DISK_CACHE_MB = float(os.environ.get('CONDITIONING_DISK_CACHE_MB', '1024'))
+CONDITIONING_CACHE_DIR = os.environ.get('CONDITIONING_CACHE_DIR', './cache/conditioning')
+
+
+def _load_png(path):
+    with Image.open(path) as img:
+        img.load()
+        return img
+
+
+conditioning_cache = SpillCache(
+    max_bytes=int(CONDITIONING_CACHE_MB * 1024 ** 2),
+    directory=CONDITIONING_CACHE_DIR,
+    max_disk_bytes=int(CONDITIONING_DISK_CACHE_MB * 1024 ** 2),
+    dump=lambda img, path: img.save(path, format='PNG', compress_level=1),
+    load=_load_png,
+    suffix='.png',
+    name='conditioning',
+)
 
 
-def _b64_to_pil_preserve_alpha(b64_str: str) -> Image.Image:
-    if ',' in b64_str:
-        b64_str = b64_str.split(',', 1)[1]
-    image = Image.open(io.BytesIO(base64.b64decode(b64_str)))
+def preprocess_cached(kind_root: str, source_image: Image.Image, width: int, height: int) -> Image.Image:
+    """Spustí preprocesor `kind_root` na `source_image` (výsledok width×height), s cache."""
+    key = (content_hash(source_image), kind_root, width, height)
+    cached = conditioning_cache.get(key)
+    if cached is not None:
+        print(f"♻️  Conditioning '{kind_root}' z cache")
+        return cached.copy()
+    proc = get_preprocessor(kind_root)
+    conditioning_image = proc(source_image)
+    if not isinstance(conditioning_image, Image.Image):
+        conditioning_image = Image.fromarray(np.array(conditioning_image))
+    conditioning_image = conditioning_image.resize((width, height), Image.LANCZOS)
+    conditioning_cache.put(key, conditioning_image)
+    return conditioning_image.copy()
+
+
+def _b64_to_pil(b64_str) -> Image.Image:
+    # base64 / data URL, or raw bytes from a binary request (image_transport)
+    return open_image(b64_str).convert('RGB')
+
+
+def _b64_to_pil_preserve_alpha(b64_str) -> Image.Image:
+    image = open_image(b64_str)
     if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
         return image.convert('RGBA')
     return image.convert('RGB')
@@ -558,12 +962,6 @@ def _with_background_constraints(prompt: str, negative_prompt: str):
     return constrained_prompt, constrained_negative
 
 
-def _pil_to_b64_png(img: Image.Image) -> str:
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    return base64.b64encode(buf.getvalue()).decode()
-
-
 def _decode_noise_mask(noise_mask_b64: str, target_size) -> np.ndarray | None:
     """Decode mask PNG → float32 array [H, W] in 0..1, resized to target_size.
 
@@ -572,9 +970,7 @@ def _decode_noise_mask(noise_mask_b64: str, target_size) -> np.ndarray | None:
     if not noise_mask_b64:
         return None
     try:
-        if ',' in noise_mask_b64:
-            noise_mask_b64 = noise_mask_b64.split(',', 1)[1]
-        mask_img = Image.open(io.BytesIO(base64.b64decode(noise_mask_b64))).convert('L')
+        mask_img = open_image(noise_mask_b64).convert('L')
         mask_img = mask_img.resize(target_size, Image.LANCZOS)
         mask_arr = np.asarray(mask_img, dtype=np.float32) / 255.0
         if mask_arr.max() <= 0.03:
@@ -728,11 +1124,7 @@ def _make_conditioning_image(data, source_image, kind: str, width: int, height:
         )
         return small.resize((width, height), Image.BILINEAR)
 
-    proc = get_preprocessor(kind_root)
-    conditioning_image = proc(source_image)
-    if not isinstance(conditioning_image, Image.Image):
-        conditioning_image = Image.fromarray(np.array(conditioning_image))
-    return conditioning_image.resize((width, height), Image.LANCZOS)
+    return preprocess_cached(kind_root, source_image, width, height)
 
 
 # ─── WebGPU-compatible img2img loop (1:1 mirror of webgpuDiffusion.js generateImg2Img) ───
@@ -774,7 +1166,103 @@ def _sigma_for_timestep(t: int) -> float:
     return float(((1.0 - a) / a) ** 0.5)
 
 
-@torch.inference_mode()
+def _env_sizes(name: str, default: str = '') -> list:
+    """"WxH,..." → [(w, h), ...]; invalid entries are skipped with a warning."""
+    sizes = []
+    for item in os.environ.get(name, default).split(','):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.lower().split('x')
+        try:
+            width, height = (int(v) for v in parts)
+        except ValueError:
+            width = height = 0
+        if width <= 0 or height <= 0 or width % 8 or height % 8:
+            print(f"⚠️  {name}: neplatná veľkosť '{item}' preskočená (očakávam WxH, násobky 8)")
+            continue
+        sizes.append((width, height))
+    return sizes
+
+
+# ─── Compiled UNet for the WebGPU-compatible loop ───
+#
+# The turbo loop always runs the same shapes (batch 1 or 2 with CFG,
+# 4×H/8×W/8 latents, 77-token context), so the UNet can be compiled once per
+# resolution bucket: `torch.compile` with mode "reduce-overhead" captures
+# CUDA graphs on a GPU (no per-kernel launch / Python overhead per step),
+# "default" on CPU (inductor C++ kernels). Opt-in via TURBO_COMPILE=1 or
+# per request `"compiled": true`; only sizes in TURBO_COMPILE_SIZES use the
+# compiled graph, everything else stays eager. Inductor's FX-graph cache is
+# kept in TORCH_COMPILE_CACHE_DIR so a restarted worker skips most of the
+# (minutes long) first compilation. A compile failure falls back to eager.
+TURBO_COMPILE = os.environ.get('TURBO_COMPILE', '0') == '1'
+TURBO_COMPILE_MODE = os.environ.get('TURBO_COMPILE_MODE') or None
+TURBO_COMPILE_SIZES = set(_env_sizes('TURBO_COMPILE_SIZES', '512x512,768x768'))
+TORCH_COMPILE_CACHE_DIR = os.environ.get('TORCH_COMPILE_CACHE_DIR', './cache/torch_compile')
+# The compiled wrapper is stored on the UNet itself (plain attribute, not a
+# registered submodule) so it is dropped together with an evicted UNet — a
+# weak-keyed dict would keep the UNet alive through the wrapper's reference.
+_COMPILED_ATTR = '_turbo_compiled'  # (compiled module, weights ptr) | False (compile failed)
+
+
+def _enable_compile_cache():
+    cache_dir = os.path.abspath(TORCH_COMPILE_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except Exception as e:
+        print(f"⚠️  Inductor FX-graph cache nedostupná: {e}")
+
+
+def compiled_unet(pipe, width: int, height: int, enabled=None):
+    """UNet pre turbo loop — skompilovaný pre podporované rozlíšenia, inak eager."""
+    if enabled is None:
+        enabled = TURBO_COMPILE
+    unet = pipe.unet
+    if not enabled or (width, height) not in TURBO_COMPILE_SIZES:
+        return unet
+    # Weights restored from the host RAM tier (model_cache.py) live at new
+    # addresses — CUDA graphs captured against the old ones must not replay.
+    weights = next(unet.parameters()).data_ptr()
+    cached = unet.__dict__.get(_COMPILED_ATTR)
+    if cached is None or (cached and cached[1] != weights):
+        mode = TURBO_COMPILE_MODE or ('reduce-overhead' if torch.cuda.is_available() else 'default')
+        print(f"🛠️  torch.compile UNet (mode={mode}) — prvý beh pre každé rozlíšenie trvá dlhšie")
+        _enable_compile_cache()
+        try:
+            cached = (torch.compile(unet, mode=mode, dynamic=False), weights)
+        except Exception as e:
+            print(f"⚠️  torch.compile zlyhal, pokračujem eager: {e}")
+            cached = False
+        object.__setattr__(unet, _COMPILED_ATTR, cached)
+    return cached[0] if cached else unet
+
+
+def _unet_eps(pipe, unet, sample, timestep, hidden):
+    if unet is not pipe.unet:
+        try:
+            return unet(sample, timestep, encoder_hidden_states=hidden).sample
+        except Exception as e:
+            # Compilation happens lazily on the first call — fall back for good.
+            print(f"⚠️  Skompilovaný UNet zlyhal, pokračujem eager: {e}")
+            object.__setattr__(pipe.unet, _COMPILED_ATTR, False)
+    return pipe.unet(sample, timestep, encoder_hidden_states=hidden).sample
+
+
+def _inference_mode(fn):
+    """`@torch.inference_mode()` bez importu torch pri definícii funkcie."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with torch.inference_mode():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@_inference_mode
 def webgpu_compatible_img2img(
     pipe,
     prompt: str,
@@ -786,41 +1274,29 @@ def webgpu_compatible_img2img(
     height: int,
     generator,
     guidance_scale: float = 0.0,
+    fast_decode: bool = False,
+    compiled=None,
 ):
     """Run img2img using the same Euler-discrete (epsilon) loop as WebGPU pipeline.
 
     Designed for SD-Turbo (guidance_scale=0, 1–4 steps). Mirrors webgpuDiffusion.js exactly.
+    With `fast_decode` the image is encoded / decoded by TAESD instead of the full VAE;
+    `compiled` (default TURBO_COMPILE) runs the UNet through `compiled_unet`.
     """
     device = pipe.device
     dtype = pipe.unet.dtype
 
-    # ── 1. Encode image → latents (×0.18215) ────────────────────────────────
-    img_np = np.asarray(init_image.convert('RGB'), dtype=np.float32) / 255.0
-    img_np = img_np * 2.0 - 1.0  # [-1, 1]
-    img_t = torch.from_numpy(img_np).permute(2, 0, 1).unsqueeze(0).to(device=device, dtype=dtype)
-    image_latents = pipe.vae.encode(img_t).latent_dist.mean * 0.18215  # use mean (not sample) for determinism — matches webgpu
-
-    # ── 2. Text embeddings ──────────────────────────────────────────────────
-    tok = pipe.tokenizer(
-        prompt,
-        padding='max_length',
-        max_length=pipe.tokenizer.model_max_length,
-        truncation=True,
-        return_tensors='pt',
-    )
-    hidden = pipe.text_encoder(tok.input_ids.to(device))[0].to(dtype)
+    # ── 1. Encode image → latents (×0.18215, cached) ────────────────────────
+    # use mean (not sample) for determinism — matches webgpu
+    image_latents = init_latents_cached(pipe, init_image, fast_decode)
+    vae = load_tiny_vae(_pipe_vae_family(pipe)) if fast_decode else pipe.vae
 
+    # ── 2. Text embeddings (cached per prompt) ──────────────────────────────
     do_cfg = guidance_scale > 1.0
+    embeds = _encode_prompt_cached(pipe, prompt, negative_prompt or '', do_cfg)
+    hidden = embeds['prompt_embeds'].to(dtype)
     if do_cfg:
-        ntok = pipe.tokenizer(
-            negative_prompt or '',
-            padding='max_length',
-            max_length=pipe.tokenizer.model_max_length,
-            truncation=True,
-            return_tensors='pt',
-        )
-        neg_hidden = pipe.text_encoder(ntok.input_ids.to(device))[0].to(dtype)
-        hidden = torch.cat([neg_hidden, hidden], dim=0)
+        hidden = torch.cat([embeds['negative_prompt_embeds'].to(dtype), hidden], dim=0)
 
     # ── 3. Build timesteps (matches webgpu) ─────────────────────────────────
     max_t = _NUM_TRAIN_TIMESTEPS - 1
@@ -829,10 +1305,7 @@ def webgpu_compatible_img2img(
     timesteps = [start_t - i * step_size for i in range(num_steps) if (start_t - i * step_size) > 0]
     if not timesteps:
         # strength too low → just decode original latents
-        decoded = pipe.vae.decode(image_latents / 0.18215).sample
-        decoded = (decoded.clamp(-1, 1).float() + 1.0) / 2.0
-        arr = (decoded[0].permute(1, 2, 0).cpu().numpy() * 255.0).round().astype(np.uint8)
-        return Image.fromarray(arr)
+        return decode_latents(vae, image_latents)[0]
 
     sigmas = [_sigma_for_timestep(t) for t in timesteps] + [0.0]
     print(f"   └─ webgpu-compat: start_t={start_t}, ts={timesteps}, sigmas={[f'{s:.3f}' for s in sigmas]}")
@@ -843,6 +1316,8 @@ def webgpu_compatible_img2img(
     latents = image_latents + init_sigma * noise
 
     # ── 5. Denoising loop (Euler discrete, epsilon prediction) ──────────────
+    reporter = _step_reporter(pipe)
+    unet = compiled_unet(pipe, latents.shape[-1] * 8, latents.shape[-2] * 8, compiled)
     for i, t in enumerate(timesteps):
         sigma = sigmas[i]
         sigma_next = sigmas[i + 1]
@@ -852,19 +1327,18 @@ def webgpu_compatible_img2img(
         ts_tensor = torch.tensor([int(t)], device=device, dtype=torch.long)
         if do_cfg:
             inp = torch.cat([scaled, scaled], dim=0)
-            eps = pipe.unet(inp, ts_tensor.expand(2), encoder_hidden_states=hidden).sample
+            eps = _unet_eps(pipe, unet, inp, ts_tensor.expand(2), hidden)
             eps_uncond, eps_text = eps.chunk(2)
             eps = eps_uncond + guidance_scale * (eps_text - eps_uncond)
         else:
-            eps = pipe.unet(scaled, ts_tensor, encoder_hidden_states=hidden).sample
+            eps = _unet_eps(pipe, unet, scaled, ts_tensor, hidden)
 
         latents = latents + eps * (sigma_next - sigma)
+        if reporter is not None:
+            reporter.step(i + 1, len(timesteps), latents)
 
-    # ── 6. VAE decode ───────────────────────────────────────────────────────
-    decoded = pipe.vae.decode(latents / 0.18215).sample
-    decoded = (decoded.clamp(-1, 1).float() + 1.0) / 2.0
-    arr = (decoded[0].permute(1, 2, 0).cpu().numpy() * 255.0).round().astype(np.uint8)
-    return Image.fromarray(arr)
+    # ── 6. VAE decode (full VAE or TAESD) ───────────────────────────────────
+    return decode_latents(vae, latents)[0]
 
 
 @app.route('/generate-with-adapter', methods=['POST'])
@@ -876,7 +1350,8 @@ def generate_with_adapter():
       negative_prompt: str (optional)
       model: str (key from MODEL_REGISTRY, SD1.5 only) — default 'lite'
       adapter: str (key from ADAPTER_REGISTRY) — default 'depth_sd15'
-      image: base64 PNG/JPEG — source/structure image (e.g. 3D editor screenshot)
+      image: base64 PNG/JPEG — source/structure image (e.g. 3D editor screenshot);
+             or a multipart file part / raw image body (see image_transport.py)
       adapter_image: base64 (optional) — pre-computed depth/canny map. If absent, derived from `image`.
       width / height: int (default 512)
       steps: int (default 30)
@@ -884,17 +1359,23 @@ def generate_with_adapter():
       adapter_conditioning_scale: float (default 1.0)
       adapter_conditioning_factor: float (0–1, default 1.0) — fraction of denoising steps adapter is active.
       seed: int (optional)
+      return_control_image: bool (default false) — also return the conditioning map
+      response_format: 'json' | 'image' | 'multipart' (default from Accept, else json)
+      output_format: 'png' | 'webp' | 'jpeg' (+ output_quality / png_compress_level)
 
     Response JSON:
       image: base64 PNG (final result)
-      adapter_image: base64 PNG (computed/used conditioning map — useful for debugging)
+      adapter_image: base64 PNG (computed/used conditioning map — only with return_control_image)
     """
-    data = request.get_json(silent=True) or {}
+    return _run_job('/generate-with-adapter', parse_request(request, 'image'))
+
+
+def _generate_with_adapter_job(data):
     prompt = data.get('prompt', '').strip()
     if not prompt:
-        return jsonify({'error': "'prompt' is required"}), 400
+        return {'error': "'prompt' is required"}, 400
     if 'image' not in data:
-        return jsonify({'error': "'image' (base64) is required"}), 400
+        return {'error': "'image' (base64) is required"}, 400
 
     negative_prompt = data.get('negative_prompt', '')
     model_key = data.get('model', 'lite')
@@ -918,14 +1399,13 @@ def generate_with_adapter():
         base_entry = load_pipeline(model_key)
 
         try:
-            if lora_name and (lora_name != current_lora['name'] or lora_scale != current_lora['scale']):
-                load_lora_to_pipeline(base_entry, lora_name, lora_scale)
-            elif not lora_name and current_lora['name']:
-                load_lora_to_pipeline(base_entry, '', 0.0)
+            apply_lora(base_entry, lora_name, lora_scale)
+        except LoraIncompatible as lora_err:
+            return {'error': str(lora_err)}, 400
         except Exception as lora_err:
             error_msg = str(lora_err)
             print(f"⚠️  Chyba pri načítaní LoRA pre adapter: {error_msg}")
-            return jsonify({'error': f'Chyba pri načítaní LoRA: {error_msg}'}), 500
+            return {'error': f'Chyba pri načítaní LoRA: {error_msg}'}, 500
 
         src_image = _b64_to_pil(data['image']).resize((width, height), Image.LANCZOS)
 
@@ -933,11 +1413,7 @@ def generate_with_adapter():
             adapter_image = _b64_to_pil(data['adapter_image']).resize((width, height), Image.LANCZOS)
         else:
             kind_root = adapter_kind.split('_')[0]   # depth_sd15 -> depth
-            proc = get_preprocessor(kind_root)
-            adapter_image = proc(src_image)
-            if not isinstance(adapter_image, Image.Image):
-                adapter_image = Image.fromarray(np.array(adapter_image))
-            adapter_image = adapter_image.resize((width, height), Image.LANCZOS)
+            adapter_image = preprocess_cached(kind_root, src_image, width, height)
 
         pipe = load_adapter_pipeline(model_key, adapter_kind)
         adapter_image = adapter_image.convert(_adapter_conditioning_mode(pipe))
@@ -945,8 +1421,8 @@ def generate_with_adapter():
         generator = torch.Generator(device=pipe.device).manual_seed(int(seed))
 
         pipe_kwargs = {
-            'prompt': prompt,
-            'negative_prompt': negative_prompt or None,
+            **prompt_embed_kwargs(pipe, prompt, negative_prompt or None, guidance),
+            **progress_kwargs(pipe),
             'image': adapter_image,
             'width': width,
             'height': height,
@@ -958,29 +1434,37 @@ def generate_with_adapter():
         if 'adapter_conditioning_factor' in inspect.signature(pipe.__call__).parameters:
             pipe_kwargs['adapter_conditioning_factor'] = cond_factor
 
-        result = pipe(**pipe_kwargs).images[0]
+        result = pipe_images(pipe, fast_decode_enabled(model_key, data), **pipe_kwargs)[0]
 
-        return jsonify({
-            'image': f"data:image/png;base64,{_pil_to_b64_png(result)}",
-            'adapter_image': f"data:image/png;base64,{_pil_to_b64_png(adapter_image)}",
+        payload = {
+            'image': result,
             'prompt': prompt,
             'seed': int(seed) if seed is not None else None,
-        })
+        }
+        # Debug artefact — only on request (saves an extra PNG encode + transfer).
+        if data.get('return_control_image'):
+            payload['adapter_image'] = adapter_image
+        return payload, 200
+    except JobCancelled:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 
 @app.route('/generate-with-controlnet', methods=['POST'])
 def generate_with_controlnet():
     """Generate an image conditioned with ControlNet (depth/canny/sketch/lineart)."""
-    data = request.get_json(silent=True) or {}
+    return _run_job('/generate-with-controlnet', parse_request(request, 'image'))
+
+
+def _generate_with_controlnet_job(data):
     prompt = data.get('prompt', '').strip()
     if not prompt:
-        return jsonify({'error': "'prompt' is required"}), 400
+        return {'error': "'prompt' is required"}, 400
     if 'image' not in data:
-        return jsonify({'error': "'image' (base64) is required"}), 400
+        return {'error': "'image' (base64) is required"}, 400
 
     negative_prompt = data.get('negative_prompt', '')
     model_key = data.get('model', 'lite')
@@ -1004,19 +1488,21 @@ def generate_with_controlnet():
         seed = torch.randint(0, 2**32, (1,)).item()
     lora_name = data.get('lora', '')
     lora_scale = data.get('lora_scale', 0.9)
+    # TAESD decode only for the final image — the two-pass explore result
+    # feeds pass 2 and keeps the full VAE.
+    fast_decode = fast_decode_enabled(model_key, data)
 
     try:
         base_entry = load_pipeline(model_key)
 
         try:
-            if lora_name and (lora_name != current_lora['name'] or lora_scale != current_lora['scale']):
-                load_lora_to_pipeline(base_entry, lora_name, lora_scale)
-            elif not lora_name and current_lora['name']:
-                load_lora_to_pipeline(base_entry, '', 0.0)
+            apply_lora(base_entry, lora_name, lora_scale)
+        except LoraIncompatible as lora_err:
+            return {'error': str(lora_err)}, 400
         except Exception as lora_err:
             error_msg = str(lora_err)
             print(f"⚠️  Chyba pri načítaní LoRA pre ControlNet: {error_msg}")
-            return jsonify({'error': f'Chyba pri načítaní LoRA: {error_msg}'}), 500
+            return {'error': f'Chyba pri načítaní LoRA: {error_msg}'}, 500
 
         source_with_alpha = _b64_to_pil_preserve_alpha(data['image']).resize((width, height), Image.LANCZOS)
         src_image = _composite_on_background(source_with_alpha, (255, 255, 255))
@@ -1103,6 +1589,12 @@ def generate_with_controlnet():
         # composition/variability, pass 2 hands off to Lightning at low strength
         # for crisp final detail. Only meaningful when current model is Lightning
         # and we're on the img2img path.
+        #
+        # Lightning is an unfused adapter on the shared SDXL UNet, so both
+        # passes run on the ControlNet pipe that is already loaded: pass 1
+        # switches the Lightning adapter off and swaps in the explore model's
+        # scheduler, pass 2 switches it back on. Two denoising runs, no
+        # evictions and no model reloads.
         two_pass_active = (
             bool(data.get('two_pass', False))
             and use_img2img
@@ -1119,83 +1611,25 @@ def generate_with_controlnet():
                       f"non-distilled SDXL model — falling back to 'sdxl'")
                 explore_key = 'sdxl'
 
-            # Helper: evict a model + all its controlnet/img2img pipes from
-            # VRAM. Both pipes share UNet/VAE refs, so we MUST drop the base
-            # entry too, otherwise the weights stay alive via shared refs.
-            import gc
-            def _evict_pipeline(victim_key):
-                cn_keys_to_drop = [
-                    k for k in list(controlnet_pipelines.keys())
-                    if k.startswith(f"{victim_key}__")
-                ]
-                for k in cn_keys_to_drop:
-                    controlnet_pipelines.pop(k, None)
-                pipelines.pop(victim_key, None)
-                gc.collect()
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-
-            def _vram_report(tag):
-                if not torch.cuda.is_available():
-                    return
-                try:
-                    free, total = torch.cuda.mem_get_info()
-                    print(f"💾 {tag}: VRAM free {free/(1024**2):.0f} / "
-                          f"{total/(1024**2):.0f} MB")
-                except Exception:
-                    pass
-
-            # Snapshot IP-Adapter intent (we lose pipe state when we evict it).
-            saved_ip_adapter = None
-            if ip_adapter_active and ip_adapter_image_pil is not None:
-                saved_ip_adapter = {
-                    'family': _model_family(model_key),
-                    'scale': ip_adapter_scale,
-                    'image': ip_adapter_image_pil,
-                }
-
-            # ── Free EVERYTHING evictable BEFORE pass 1 ──────────────────────
-            # On 8 GB GPUs we can't hold two SDXL backbones at once. Evict
-            # Lightning AND any other cached models (e.g. 'lite' preloaded at
-            # startup) so the explore pipe has maximum headroom.
-            # base_entry (line ~1009) is a local Python ref to the same dict
-            # that's in pipelines[model_key] — popping the global dict alone
-            # leaves base_entry holding the weights alive. del it explicitly.
-            del pipe
-            try:
-                del base_entry
-            except NameError:
-                pass
-            for victim in [k for k in list(pipelines.keys()) if k != explore_key]:
-                _evict_pipeline(victim)
-            _vram_report("After full evict (pre pass-1)")
-
             # ── Pass 1: explore on plain SDXL base ───────────────────────────
-            explore_pipe = load_controlnet_pipeline(
-                explore_key, controlnet_kind, img2img=True
-            )
-            # 8 GB GPUs can't fit SDXL base UNet+VAE+TE (~7 GB) + ControlNet
-            # (~2.5 GB) resident at once. CPU offload keeps weights on CPU and
-            # streams them in per-module — peak VRAM drops to ~3-4 GB. Slows
-            # pass 1 ~2-3× but actually fits. Toggle off via low_vram=False.
-            low_vram = bool(data.get('low_vram', True))
-            if low_vram and torch.cuda.is_available():
-                try:
-                    free_b, total_b = torch.cuda.mem_get_info()
-                    free_gb = free_b / (1024 ** 3)
-                    if free_gb < 12.0:
-                        explore_pipe.enable_model_cpu_offload()
-                        print(f"💡 CPU offload enabled on explore pipe "
-                              f"(free VRAM {free_gb:.1f} GB < 12 GB threshold)")
-                except Exception as e:
-                    print(f"⚠️  cpu_offload setup failed: {e}")
+            shared_backbone = MODEL_REGISTRY[explore_key]['id'] == _model_cfg['id']
+            if shared_backbone:
+                explore_pipe = pipe
+                explore_scheduler = _scheduler_for(explore_key, base_entry['scheduler_config'])
+                # LoRA adapters are per-UNet — user LoRA stays, Lightning goes off.
+                apply_lora(base_entry, lora_name, lora_scale, lightning=False)
+            else:
+                # Iný checkpoint — vlastná pipeline, miesto uvoľní VRAM manager.
+                explore_pipe = load_controlnet_pipeline(explore_key, controlnet_kind, img2img=True)
+                explore_scheduler = explore_pipe.scheduler
+                apply_lora(load_pipeline(explore_key), lora_name, lora_scale)
             explore_steps = int(data.get('explore_steps', 25))
             explore_guidance = float(data.get('explore_guidance', 6.5))
             explore_cn_end = max(cn_guidance_end, float(data.get('explore_cn_end', 0.7)))
             explore_kwargs = dict(
-                prompt=prompt,
-                negative_prompt=negative_prompt or None,
-                image=src_image,
+                **prompt_embed_kwargs(explore_pipe, prompt, negative_prompt or None, explore_guidance),
+                **progress_kwargs(explore_pipe),
+                image=init_latents_cached(explore_pipe, src_image),
                 control_image=control_image,
                 strength=strength,
                 width=width,
@@ -1207,31 +1641,28 @@ def generate_with_controlnet():
                 control_guidance_end=explore_cn_end,
                 generator=torch.Generator(device=explore_pipe.device).manual_seed(int(seed)),
             )
+            # The style reference is only for the refine pass. IP-Adapter lives in
+            # the shared UNet's attention, so pass 1 gets the image at scale 0.
+            explore_ip_adapter = shared_backbone and ip_adapter_active and ip_adapter_image_pil is not None
+            if explore_ip_adapter:
+                explore_kwargs['ip_adapter_image'] = ip_adapter_image_pil
+                pipe.set_ip_adapter_scale(0.0)
             print(f"🧭 Two-pass · explore: model={explore_key}, steps={explore_steps}, "
                   f"strength={strength:.2f}, guidance={explore_guidance}, "
                   f"cn_scale={cond_scale}, cn_end={explore_cn_end:.2f}")
-            pass1_image = explore_pipe(**explore_kwargs).images[0]
-
-            # ── Free explore pipe BEFORE pass 2 ──────────────────────────────
+            refine_scheduler = explore_pipe.scheduler
+            explore_pipe.scheduler = explore_scheduler
+            try:
+                pass1_image = explore_pipe(**explore_kwargs).images[0]
+            finally:
+                # The pipe is cached — never leave the explore scheduler on it.
+                explore_pipe.scheduler = refine_scheduler
             del explore_pipe
-            _evict_pipeline(explore_key)
-            _vram_report("After explore evict (pre pass-2)")
 
-            # ── Reload Lightning pipe for pass 2 ─────────────────────────────
-            pipe = load_controlnet_pipeline(model_key, controlnet_kind, img2img=use_img2img)
-
-            # Re-apply IP-Adapter on the freshly loaded pipe if it was active.
-            if saved_ip_adapter is not None:
-                try:
-                    if ensure_ip_adapter(pipe, saved_ip_adapter['family']):
-                        pipe.set_ip_adapter_scale(saved_ip_adapter['scale'])
-                        ip_adapter_image_pil = saved_ip_adapter['image']
-                        ip_adapter_active = True
-                        print(f"🎨 IP-Adapter re-applied on pass-2 pipe "
-                              f"(scale={saved_ip_adapter['scale']:.2f})")
-                except Exception as e:
-                    print(f"⚠️  IP-Adapter re-apply failed, continuing without: {e}")
-                    ip_adapter_active = False
+            # ── Pass 2: Lightning back on ────────────────────────────────────
+            apply_lora(base_entry, lora_name, lora_scale)
+            if explore_ip_adapter:
+                pipe.set_ip_adapter_scale(ip_adapter_scale)
 
             # Hand off to the existing Lightning refine path. Replace the init
             # image, drop strength way down (Lightning just polishes), and ease
@@ -1240,7 +1671,7 @@ def generate_with_controlnet():
             strength = float(data.get('refine_strength', 0.35))
             cond_scale = min(cond_scale, float(data.get('refine_cn_scale', 0.4)))
             cn_guidance_end = min(cn_guidance_end, float(data.get('refine_cn_end', 0.5)))
-            # Fresh generator for pass 2 — also pinned to the *new* pipe.device.
+            # Fresh generator for pass 2.
             generator = torch.Generator(device=pipe.device).manual_seed(
                 (int(seed) ^ 0xA1B2C3D4) & 0xFFFFFFFF
             )
@@ -1262,9 +1693,9 @@ def generate_with_controlnet():
             print(f"⚙️  ControlNet+img2img: steps={i2i_steps}, strength={strength:.2f}, "
                   f"cn_scale={cond_scale}, cn_window={cn_guidance_start:.2f}..{cn_guidance_end:.2f}")
             i2i_kwargs = dict(
-                prompt=prompt,
-                negative_prompt=negative_prompt or None,
-                image=src_image,
+                **prompt_embed_kwargs(pipe, prompt, negative_prompt or None, guidance),
+                **progress_kwargs(pipe),
+                image=init_latents_cached(pipe, src_image, fast_decode),
                 control_image=control_image,
                 strength=strength,
                 width=width,
@@ -1278,11 +1709,11 @@ def generate_with_controlnet():
             )
             if ip_adapter_active and ip_adapter_image_pil is not None:
                 i2i_kwargs['ip_adapter_image'] = ip_adapter_image_pil
-            result = pipe(**i2i_kwargs).images[0]
+            result = pipe_images(pipe, fast_decode, **i2i_kwargs)[0]
         else:
             t2i_kwargs = dict(
-                prompt=prompt,
-                negative_prompt=negative_prompt or None,
+                **prompt_embed_kwargs(pipe, prompt, negative_prompt or None, guidance),
+                **progress_kwargs(pipe),
                 image=control_image,
                 width=width,
                 height=height,
@@ -1295,22 +1726,26 @@ def generate_with_controlnet():
             )
             if ip_adapter_active and ip_adapter_image_pil is not None:
                 t2i_kwargs['ip_adapter_image'] = ip_adapter_image_pil
-            result = pipe(**t2i_kwargs).images[0]
+            result = pipe_images(pipe, fast_decode, **t2i_kwargs)[0]
 
         if data.get('transparent_background', False):
             result = _apply_source_alpha(result, source_with_alpha)
 
-        return jsonify({
-            'image': f"data:image/png;base64,{_pil_to_b64_png(result)}",
-            'control_image': f"data:image/png;base64,{_pil_to_b64_png(control_image)}",
-            'adapter_image': f"data:image/png;base64,{_pil_to_b64_png(control_image)}",
+        payload = {
+            'image': result,
             'prompt': prompt,
             'seed': int(seed),
-        })
+        }
+        # Debug artefact — only on request (saves an extra PNG encode + transfer).
+        if data.get('return_control_image'):
+            payload['control_image'] = control_image
+        return payload, 200
+    except JobCancelled:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 
 @app.route('/list-adapters', methods=['GET'])
@@ -1398,14 +1833,28 @@ def download_merged_fp16_unet():
 def health():
     loaded = list(pipelines.keys())
     available_loras = get_available_loras()
+    # Kým torch nie je načítaný (štart, warm start ešte beží), /health ho
+    # neimportuje — odpovedá hneď, bez device / VRAM údajov.
+    torch_loaded = is_loaded(torch)
     info = {
         'status': 'ok',
+        'ready': warm_state['ready'],
+        'warm_start': warm_state,
         'models_loaded': loaded,
-        'device': 'cuda' if torch.cuda.is_available() else 'cpu',
+        'device': ('cuda' if torch.cuda.is_available() else 'cpu') if torch_loaded else None,
         'loras_available': available_loras,
-        'current_lora': current_lora['name'],
+        'loras_resident': _resident_lora_names(),
+        'loras_info': lora_index.describe(),
+        'lora_index': lora_index.stats(),
+        'prompt_embed_cache': prompt_embed_cache.stats(),
+        'latent_cache': latent_cache.stats(),
+        'conditioning_cache': conditioning_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'queue': gpu_queue.stats(),
+        'vram_cache': vram.report() if torch_loaded else None,
+        'imports': import_report(),
     }
-    if torch.cuda.is_available():
+    if torch_loaded and torch.cuda.is_available():
         try:
             free, total = torch.cuda.mem_get_info()
             info['vram_free_mb'] = round(free / (1024 ** 2), 1)
@@ -1427,11 +1876,18 @@ def clear_gpu():
 
     Optional JSON body: {"keep": ["lite", "sdxl-lightning-4"]} — preserves
     those model_keys and only drops the rest.
+
+    Dropped models go to the host RAM tier (model_cache.py) when it is
+    enabled, so using them again is one host-to-device copy instead of a
+    reload from disk. {"host": false} drops the host tier as well.
     """
+    return _run_job('/clear-gpu', request.get_json(silent=True) or {})
+
+
+def _clear_gpu_job(data):
     global pipelines, controlnets, controlnet_pipelines, adapters, adapter_pipelines
-    global preprocessors, ip_adapter_loaded_pipelines, current_lora
+    global preprocessors, ip_adapter_loaded_pipelines
 
-    data = request.get_json(silent=True) or {}
     keep = set(data.get('keep') or [])
 
     before = None
@@ -1447,7 +1903,8 @@ def clear_gpu():
     dropped_cn = list(controlnet_pipelines.keys())
     dropped_adapters = list(adapter_pipelines.keys())
 
-    # 1. Drop full pipelines (except `keep`). ControlNet / adapter pipelines
+    # 1. Drop full pipelines (except `keep`) — into the host RAM tier if it
+    #    is enabled (see model_cache.py). ControlNet / adapter pipelines
     #    share UNet/VAE refs with these, so they MUST go too — otherwise the
     #    model weights stay alive in VRAM via the shared references.
     for k in list(pipelines.keys()):
@@ -1469,17 +1926,21 @@ def clear_gpu():
     controlnets.clear()
     adapters.clear()
 
-    # 3. IP-Adapter tracking set is now stale.
-    ip_adapter_loaded_pipelines.clear()
+    # 3. IP-Adapter tracking: the controlnet_pipelines on_evict hook forgets
+    #    pipes that are really dropped; staged ones keep their weights.
 
-    # 4. Preprocessors (Midas/Canny/etc) hold model weights too.
+    # 4. Preprocessors (Midas/Canny/etc) and tiny VAEs hold model weights too.
     preprocessors.clear()
+    tiny_vaes.clear()
+
+    # 5. Cached prompt embeddings / init latents live on the GPU as well.
+    prompt_embed_cache.clear()
+    latent_cache.clear()
 
-    # 5. Reset LoRA bookkeeping (we just nuked the pipelines that had it loaded).
-    current_lora['name'] = None
-    current_lora['scale'] = None
+    # 6. Optionally release the host RAM tier too.
+    dropped_host = vram.drop_host_tier() if data.get('host', True) is False else []
 
-    # 6. Force Python GC + CUDA empty cache.
+    # 7. Force Python GC + CUDA empty cache.
     import gc
     gc.collect()
     after = None
@@ -1497,78 +1958,50 @@ def clear_gpu():
           f"{len(dropped_adapters)} adapter pipelines. "
           f"VRAM {before}→{after} MB used.")
 
-    return jsonify({
+    return {
         'ok': True,
         'kept': sorted(list(keep & set(pipelines.keys()))),
         'dropped_models': dropped_models,
         'dropped_controlnet_pipelines': dropped_cn,
         'dropped_adapter_pipelines': dropped_adapters,
+        'staged_in_host_ram': sorted(e['key'] for e in vram.report()['staged'] if e['cache'] == 'pipelines'),
+        'dropped_from_host_ram': len(dropped_host),
         'vram_used_mb_before': before,
         'vram_used_mb_after': after,
-    })
+    }, 200
 
 @app.route('/generate', methods=['POST'])
 def generate():
+    return _run_job('/generate', parse_request(request, 'input_image'))
+
+
+def _generate_job(data):
     # model selection: 'lite' or 'full' (default: lite)
-    model_key = (request.json or {}).get('model', 'lite')
+    model_key = data.get('model', 'lite')
 
     try:
         model_entry = load_pipeline(model_key)
+    except JobCancelled:
+        raise
     except Exception as e:
-        return jsonify({'error': f'Nepodarilo sa načítať požadovaný model: {e}'}), 500
+        return {'error': f'Nepodarilo sa načítať požadovaný model: {e}'}, 500
     
     try:
-        data = request.json
         prompt = data.get('prompt', '')
         negative_prompt = data.get('negative_prompt', '')
         input_image = data.get('input_image', '')  # Base64 obrázok
-        target_color = data.get('target_color', '')  # Hexadecimálna farba (napr. #FF0000)
         
         # LoRA podpora
         lora_name = data.get('lora', '')  # Názov LoRA (bez prípony)
         lora_scale = data.get('lora_scale', 0.9)  # 0.0 - 1.0
         
         # Načítaj LoRA ak je zadaná
-        try:
-            if lora_name and lora_name != current_lora['name']:
-                load_lora_to_pipeline(model_entry, lora_name, lora_scale)
-            elif not lora_name and current_lora['name']:
-                # Unfuse ak už nie je potrebná
-                load_lora_to_pipeline(model_entry, '', 0.0)
-        except Exception as lora_err:
-            error_msg = str(lora_err)
-            print(f"⚠️  Chyba pri načítaní LoRA: {error_msg}")
-            
-            # Špecifická správa pre nekompatibilné target modules
-            if 'not found in the base model' in error_msg or 'Target modules' in error_msg:
-                return jsonify({
-                    'error': f'LoRA model "{lora_name}" nie je kompatibilný s modelom "{model_key}". Tento LoRA je pravdepodobne pre SDXL alebo inú architektúru. Skúste iný LoRA model alebo zmeňte základný model.'
-                }), 400
-            
-            # Size mismatch chyby - LoRA má inú architektúru než base model
-            if 'size mismatch' in error_msg:
-                # Detekuj či je to SD 1.5 LoRA s inym modelom
-                if '768' in error_msg and '1024' in error_msg:
-                    return jsonify({
-                        'error': f'LoRA model "{lora_name}" je pre SD 1.5 (text encoder 768), ale model "{model_key}" používa inú architektúru (1024). Použite tento LoRA s modelmi: lite, full, dreamshaper, realistic. Alebo vypnite LoRA pre texture model.'
-                    }), 400
-                else:
-                    return jsonify({
-                        'error': f'LoRA model "{lora_name}" nie je kompatibilný s modelom "{model_key}". Architektúra LoRA nezodpovedá základnému modelu.'
-                    }), 400
-            
-            return jsonify({'error': f'Chyba pri načítaní LoRA: {error_msg}'}), 500
+        lora_error = _load_generate_lora(model_entry, model_key, lora_name, lora_scale)
+        if lora_error is not None:
+            return lora_error
         
-        # Limit steps for lite by default, but allow full to use higher default
-        if MODEL_REGISTRY.get(model_key, {}).get('turbo'):
-            num_inference_steps = max(1, min(data.get('num_inference_steps', 4), 4))
-            guidance_scale = data.get('guidance_scale', 0.0)
-        elif model_key == 'lite':
-            num_inference_steps = min(data.get('num_inference_steps', 30), 30)
-            guidance_scale = data.get('guidance_scale', 7.5)
-        else:
-            num_inference_steps = data.get('num_inference_steps', 50)
-            guidance_scale = data.get('guidance_scale', 7.5)
+        num_inference_steps, guidance_scale = _generate_sampling_params(model_key, data)
+        fast_decode = fast_decode_enabled(model_key, data)  # TAESD namiesto plného VAE
         strength = float(data.get('strength', 0.75))  # Pre img2img - ako moc zmeniť obrázok
         # Pre SD-Turbo PyTorch img2img používame webgpu_compatible_img2img,
         # ktorá podporuje ľubovoľné `steps * strength` (rovnako ako WebGPU).
@@ -1598,18 +2031,14 @@ def generate():
         print(f"🎲 Seed: {seed}")
         
         if not prompt:
-            return jsonify({'error': 'Prompt je povinný'}), 400
+            return {'error': 'Prompt je povinný'}, 400
         
         # Image-to-Image ak je nahratý obrázok
         if input_image:
             print(f"🖼️ Image-to-Image ({model_key}): {prompt[:50]}...")
 
-            # Dekóduj base64 obrázok
-            if ',' in input_image:
-                input_image = input_image.split(',')[1]
-
-            image_data = base64.b64decode(input_image)
-            init_image = Image.open(io.BytesIO(image_data))
+            # Dekóduj obrázok (base64 alebo binárne telo požiadavky)
+            init_image = open_image(input_image)
             
             # Zachovaj alpha kanál pre neskoršie použitie
             has_alpha = False
@@ -1643,7 +2072,7 @@ def generate():
             # Use the requested img2img pipeline
             img2img_pipe = model_entry.get('img2img')
             if img2img_pipe is None:
-                return jsonify({'error': 'Img2Img pipeline nie je dostupná pre požadovaný model'}), 500
+                return {'error': 'Img2Img pipeline nie je dostupná pre požadovaný model'}, 500
 
             is_turbo = bool(MODEL_REGISTRY.get(model_key, {}).get('turbo'))
             if is_turbo:
@@ -1664,24 +2093,28 @@ def generate():
                     height=height,
                     generator=generator,
                     guidance_scale=guidance_scale,
+                    fast_decode=fast_decode,
+                    compiled=data.get('compiled'),
                 )
             else:
                 with torch.inference_mode():
-                    image = img2img_pipe(
-                        prompt=prompt,
-                        negative_prompt=negative_prompt,
-                        image=init_image,
+                    image = pipe_images(
+                        img2img_pipe,
+                        fast_decode,
+                        **prompt_embed_kwargs(img2img_pipe, prompt, negative_prompt, guidance_scale),
+                        **progress_kwargs(img2img_pipe),
+                        image=init_latents_cached(img2img_pipe, init_image, fast_decode),
                         strength=strength,
                         num_inference_steps=num_inference_steps,
                         guidance_scale=guidance_scale,
                         generator=generator,
-                    ).images[0]
+                    )[0]
             
             # Automaticky odstráň čierne pozadie a vytvor priehľadnosť
             if has_alpha:
                 print("🔄 Odstraňujem čierne pozadie a vytvárám priehľadnosť...")
                 # Odstráň čierne pozadie z vygenerovaného RGB obrázka
-                image = remove_black_background(image, threshold=30)
+                image = remove_black_background(image, threshold=30, soft_edge=data.get('soft_edge', 0))
             else:
                 print("💡 Tip: Pre priehľadné pozadie nahrajte PNG s priehľadnosťou")
         
@@ -1690,57 +2123,201 @@ def generate():
             print(f"🎨 Text-to-Image ({model_key}): {prompt[:50]}... [{width}x{height}]")
             pipe = model_entry.get('pipe')
             if pipe is None:
-                return jsonify({'error': 'Text-to-Image pipeline nie je dostupná pre požadovaný model'}), 500
+                return {'error': 'Text-to-Image pipeline nie je dostupná pre požadovaný model'}, 500
 
             with torch.inference_mode():
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
+                image = pipe_images(
+                    pipe,
+                    fast_decode,
+                    **prompt_embed_kwargs(pipe, prompt, negative_prompt, guidance_scale),
+                    **progress_kwargs(pipe),
                     num_inference_steps=num_inference_steps,
                     guidance_scale=guidance_scale,
                     width=width,
                     height=height,
                     generator=generator,
-                ).images[0]
+                )[0]
         
-        # Aplikuj farebný tint ak je zadaný
-        if target_color:
-            print(f"🎨 Aplikujem farebný tint: {target_color}")
-            image = apply_color_tint(image, target_color, intensity=0.5)
+        return _generate_response(image, data, seed)
         
-        buffer = io.BytesIO()
-        image.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"❌ Chyba: {e}")
+        return {'error': str(e)}, 500
+
+
+def _load_generate_lora(model_entry, model_key, lora_name, lora_scale):
+    """Aktivuje LoRA pre /generate. Vráti (payload, status) pri chybe, inak None."""
+    try:
+        apply_lora(model_entry, lora_name, lora_scale)
+    except LoraIncompatible as lora_err:
+        print(f"⚠️  {lora_err}")
+        return {'error': str(lora_err)}, 400
+    except Exception as lora_err:
+        error_msg = str(lora_err)
+        print(f"⚠️  Chyba pri načítaní LoRA: {error_msg}")
         
-        print("✅ Hotovo!")
+        # .pt/.bin súbory (bez hlavičky) sa stále môžu ukázať ako nekompatibilné až tu.
+        # Špecifická správa pre nekompatibilné target modules
+        if 'not found in the base model' in error_msg or 'Target modules' in error_msg:
+            return {
+                'error': f'LoRA model "{lora_name}" nie je kompatibilný s modelom "{model_key}". Tento LoRA je pravdepodobne pre SDXL alebo inú architektúru. Skúste iný LoRA model alebo zmeňte základný model.'
+            }, 400
         
-        return jsonify({
-            'image': f'data:image/png;base64,{img_base64}',
-            'prompt': prompt,
-            'seed': int(seed)  # Vráť použitý seed
-        })
+        # Size mismatch chyby - LoRA má inú architektúru než base model
+        if 'size mismatch' in error_msg:
+            # Detekuj či je to SD 1.5 LoRA s inym modelom
+            if '768' in error_msg and '1024' in error_msg:
+                return {
+                    'error': f'LoRA model "{lora_name}" je pre SD 1.5 (text encoder 768), ale model "{model_key}" používa inú architektúru (1024). Použite tento LoRA s modelmi: lite, full, dreamshaper, realistic. Alebo vypnite LoRA pre texture model.'
+                }, 400
+            else:
+                return {
+                    'error': f'LoRA model "{lora_name}" nie je kompatibilný s modelom "{model_key}". Architektúra LoRA nezodpovedá základnému modelu.'
+                }, 400
         
+        return {'error': f'Chyba pri načítaní LoRA: {error_msg}'}, 500
+    return None
+
+
+def _generate_sampling_params(model_key, data):
+    """(num_inference_steps, guidance_scale) pre /generate podľa modelu."""
+    # Limit steps for lite by default, but allow full to use higher default
+    if MODEL_REGISTRY.get(model_key, {}).get('turbo'):
+        num_inference_steps = max(1, min(data.get('num_inference_steps', 4), 4))
+        guidance_scale = data.get('guidance_scale', 0.0)
+    elif model_key == 'lite':
+        num_inference_steps = min(data.get('num_inference_steps', 30), 30)
+        guidance_scale = data.get('guidance_scale', 7.5)
+    else:
+        num_inference_steps = data.get('num_inference_steps', 50)
+        guidance_scale = data.get('guidance_scale', 7.5)
+    return num_inference_steps, guidance_scale
+
+
+def _generate_response(image, data, seed):
+    """Dokončí /generate výsledok: voliteľný farebný tint (obrázok kóduje route)."""
+    target_color = data.get('target_color', '')  # Hexadecimálna farba (napr. #FF0000)
+    # Aplikuj farebný tint ak je zadaný
+    if target_color:
+        print(f"🎨 Aplikujem farebný tint: {target_color}")
+        image = apply_color_tint(image, target_color, intensity=0.5)
+    
+    print("✅ Hotovo!")
+    
+    return {
+        'image': image,
+        'prompt': data.get('prompt', ''),
+        'seed': int(seed)  # Vráť použitý seed
+    }, 200
+
+
+# ─── Dynamic micro-batching of compatible txt2img /generate requests ───
+#
+# Requests that agree on everything except prompt / negative prompt / seed /
+# target_color are merged by the GPU queue into ONE pipeline call with a
+# per-request torch.Generator list — each image is still reproducible from
+# its own seed. See GpuJobQueue for the collection window.
+
+def _generate_batch_key(data):
+    """Key under which /generate requests may share one pipeline call.
+
+    Returns None for requests that must run alone (img2img, missing prompt,
+    unknown model, malformed numbers — the single path reports the error).
+    """
+    if data.get('input_image') or not data.get('prompt'):
+        return None
+    model_key = data.get('model', 'lite')
+    if model_key not in MODEL_REGISTRY:
+        return None
+    try:
+        steps, guidance = _generate_sampling_params(model_key, data)
+        width = int(data.get('width', 512) // 8 * 8)
+        height = int(data.get('height', 512) // 8 * 8)
+        return (
+            model_key, width, height, int(steps), float(guidance),
+            data.get('lora', ''), float(data.get('lora_scale', 0.9)),
+            fast_decode_enabled(model_key, data),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def _generate_batch_job(batch):
+    """Run several compatible txt2img /generate requests as one batched call.
+
+    `batch` is a list of request bodies sharing `_generate_batch_key`.
+    Returns one `(payload, status)` per request, in order.
+    """
+    first = batch[0]
+    model_key = first.get('model', 'lite')
+    try:
+        model_entry = load_pipeline(model_key)
+    except JobCancelled:
+        raise
     except Exception as e:
-        print(f"❌ Chyba: {e}")
-        return jsonify({'error': str(e)}), 500
+        return [({'error': f'Nepodarilo sa načítať požadovaný model: {e}'}, 500)] * len(batch)
+
+    lora_error = _load_generate_lora(model_entry, model_key, first.get('lora', ''), first.get('lora_scale', 0.9))
+    if lora_error is not None:
+        return [lora_error] * len(batch)
+
+    num_inference_steps, guidance_scale = _generate_sampling_params(model_key, first)
+    width = int(first.get('width', 512) // 8 * 8)
+    height = int(first.get('height', 512) // 8 * 8)
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    seeds = []
+    for data in batch:
+        seed = data.get('seed', None)
+        if seed is None:
+            seed = torch.randint(0, 2**32, (1,)).item()
+        seeds.append(int(seed))
+    generators = [torch.Generator(device=device).manual_seed(s) for s in seeds]
+
+    print(f"🎨 Text-to-Image batch ({model_key}) ×{len(batch)} [{width}x{height}], seeds={seeds}")
+    pipe = model_entry['pipe']
+    with torch.inference_mode():
+        images = pipe_images(
+            pipe,
+            fast_decode_enabled(model_key, first),
+            **prompt_embed_kwargs(
+                pipe,
+                [data['prompt'] for data in batch],
+                [data.get('negative_prompt', '') for data in batch],
+                guidance_scale,
+            ),
+            **progress_kwargs(pipe),
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            width=width,
+            height=height,
+            generator=generators,
+        )
+
+    return [
+        _generate_response(image, data, seed)
+        for data, seed, image in zip(batch, seeds, images)
+    ]
 
 @app.route('/remove-background', methods=['POST'])
 def remove_background_endpoint():
     """Odstráni pozadie z obrázka pomocou remove_black_background metódy"""
+    return _run_job('/remove-background', parse_request(request))
+
+
+def _remove_background_job(data):
     try:
-        data = request.json
         image_data = data.get('image')
         threshold = data.get('threshold', 30)  # Pre remove_black_background metódu
+        soft_edge = data.get('soft_edge', 0)  # Šírka mäkkého okraja alfy v pixeloch
         
         if not image_data:
-            return jsonify({'error': 'Chýba obrázok'}), 400
+            return {'error': 'Chýba obrázok'}, 400
         
-        # Dekóduj base64 obrázok
-        if 'base64,' in image_data:
-            image_data = image_data.split('base64,')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
+        # Dekóduj obrázok (base64 alebo binárne telo požiadavky)
+        image = open_image(image_data)
         
         # Konvertuj na RGB ak je potrebné
         if image.mode == 'RGBA':
@@ -1751,86 +2328,240 @@ def remove_background_endpoint():
             image = image.convert('RGB')
         
         print(f"🔄 Odstraňujem čierne pozadie (prah: {threshold})...")
-        result_image = remove_black_background(image, threshold=threshold)
-        
-        # Konvertuj späť na base64
-        buffer = io.BytesIO()
-        result_image.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        result_image = remove_black_background(image, threshold=threshold, soft_edge=soft_edge)
         
         print("✅ Pozadie odstránené!")
         
-        return jsonify({
-            'image': f'data:image/png;base64,{img_base64}'
-        })
+        return {'image': result_image}, 200
         
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"❌ Chyba pri odstraňovaní pozadia: {str(e)}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 @app.route('/adjust-hue', methods=['POST'])
 def adjust_hue_endpoint():
     """Zmení farebný odtieň obrázka bez straty kvality"""
+    return _run_job('/adjust-hue', parse_request(request))
+
+
+def _adjust_hue_job(data):
     try:
-        data = request.json
         image_data = data.get('image')
         hue_shift = data.get('hue_shift', 0)  # -180 až +180 stupňov
         
         if not image_data:
-            return jsonify({'error': 'Chýba obrázok'}), 400
+            return {'error': 'Chýba obrázok'}, 400
         
-        # Dekóduj base64 obrázok
-        if 'base64,' in image_data:
-            image_data = image_data.split('base64,')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
+        # Dekóduj obrázok (base64 alebo binárne telo požiadavky)
+        image = open_image(image_data)
         
         print(f"🎨 Mením farebný odtieň (posun: {hue_shift}°)...")
         
         # Zmeň odtieň
         result_image = shift_hue(image, hue_shift)
         
-        # Konvertuj späť na base64
-        buffer = io.BytesIO()
-        result_image.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
         print("✅ Odtieň zmenený!")
         
-        return jsonify({
-            'image': f'data:image/png;base64,{img_base64}'
-        })
+        return {'image': result_image}, 200
         
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"❌ Chyba pri zmene odtieňa: {str(e)}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+RECOLOR_MAX_VARIANTS = int(os.environ.get('RECOLOR_MAX_VARIANTS', '64'))
+
+
+def _recolor_specs(data):
+    """Zoznam variantov z `variants` (kombinované kroky) a skratiek hue_shifts / saturations / tints."""
+    intensity = float(data.get('tint_intensity', 0.6))
+    specs = []
+    for spec in data.get('variants') or []:
+        specs.append({
+            'hue_shift': spec.get('hue_shift'),
+            'saturation': spec.get('saturation'),
+            'tint': spec.get('tint'),
+            'intensity': float(spec.get('intensity', intensity)),
+        })
+    for hue_shift in data.get('hue_shifts') or []:
+        specs.append({'hue_shift': hue_shift})
+    for saturation in data.get('saturations') or []:
+        specs.append({'saturation': saturation})
+    for tint in data.get('tints') or []:
+        if isinstance(tint, dict):
+            specs.append({'tint': tint.get('color'), 'intensity': float(tint.get('intensity', intensity))})
+        else:
+            specs.append({'tint': tint, 'intensity': intensity})
+    return [{k: v for k, v in spec.items() if v is not None} for spec in specs]
+
+
+@app.route('/recolor-batch', methods=['POST'])
+def recolor_batch_endpoint():
+    """
+    Viac farebných variantov jedného obrázka naraz — HSV rozklad sa spraví raz,
+    každý variant je už len lacný prepočet späť do RGB.
+
+    Request:
+        image: obrázok (base64 / multipart / surové telo)
+        hue_shifts: [stupne, ...]            napr. [0, 60, 120]
+        saturations: [násobiteľ, ...]        napr. [0.5, 1.5]
+        tints: ['#RRGGBB' | {color, intensity}, ...]
+        tint_intensity: default intenzita tintu (0.6)
+        variants: [{hue_shift, saturation, tint, intensity}, ...]  kombinované kroky
+        atlas: true → jeden obrázok s variantmi v mriežke (atlas_columns, default všetky v riadku)
+
+    Response:
+        {'variants': [{...spec, 'image'}, ...]}
+        alebo {'atlas': image, 'layout': {columns, rows, tile_width, tile_height, variants}}
+    """
+    return _run_job('/recolor-batch', parse_request(request))
+
+
+def _recolor_batch_job(data):
+    try:
+        image_data = data.get('image')
+        if not image_data:
+            return {'error': 'Chýba obrázok'}, 400
+
+        specs = _recolor_specs(data)
+        if not specs:
+            return {'error': 'Zadajte hue_shifts, saturations, tints alebo variants'}, 400
+        if len(specs) > RECOLOR_MAX_VARIANTS:
+            return {'error': f'Príliš veľa variantov ({len(specs)}, max {RECOLOR_MAX_VARIANTS})'}, 400
+
+        image = open_image(image_data)
+        print(f"🎨 Recolor batch: {len(specs)} variantov ({image.size[0]}x{image.size[1]})...")
+        hsv = HsvImage(image)
+        images = [hsv.variant(**spec) for spec in specs]
+        print("✅ Varianty hotové!")
+
+        if data.get('atlas'):
+            atlas, layout = pack_atlas(images, data.get('atlas_columns'))
+            layout['variants'] = specs
+            return {'atlas': atlas, 'layout': layout}, 200
+        return {'variants': [dict(spec, image=img) for spec, img in zip(specs, images)]}, 200
+
+    except ValueError as e:
+        return {'error': f'Neplatný parameter: {e}'}, 400
+    except JobCancelled:
+        raise
+    except Exception as e:
+        print(f"❌ Chyba pri recolor batch: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return {'error': str(e)}, 500
+
+# ─── Character views ───
+#
+# All views of a character sheet share the model, negative prompt and
+# sampling settings, so they run as one batched pipeline call (chunks of
+# CHARACTER_BATCH_SIZE; halved on CUDA OOM) with one torch.Generator per
+# view — view i keeps seed + i. `views` in the request selects / orders the
+# directions (e.g. all eight) or gives custom ones as {"name", "facing"}.
+CHARACTER_BATCH_SIZE = int(os.environ.get('CHARACTER_BATCH_SIZE', '4'))
+CHARACTER_MAX_VIEWS = 16
+CHARACTER_VIEW_FACINGS = {
+    'south': 'facing down, south view',
+    'south-east': 'facing down-right, south-east view',
+    'east': 'facing right, east view',
+    'north-east': 'facing up-right, north-east view',
+    'north': 'facing up, north view',
+    'north-west': 'facing up-left, north-west view',
+    'west': 'facing left, west view',
+    'south-west': 'facing down-left, south-west view',
+}
+DEFAULT_CHARACTER_VIEWS = ('south', 'east', 'north', 'west')
+CHARACTER_PROMPT = (
+    "isometric pixel art game sprite, {base_prompt}, {facing}, top-down isometric angle, low poly style, "
+    "clean flat colors, game asset, transparent background, simple shading, 45 degree angle"
+)
+
+
+def _character_views(requested, base_prompt):
+    """Zoznam views ({name, prompt, seed_offset}) z `views` požiadavky (None = 4 základné)."""
+    if requested is None:
+        requested = DEFAULT_CHARACTER_VIEWS
+    if isinstance(requested, str) or not isinstance(requested, (list, tuple)):
+        raise ValueError("'views' musí byť zoznam")
+    if not 1 <= len(requested) <= CHARACTER_MAX_VIEWS:
+        raise ValueError(f"počet views musí byť 1-{CHARACTER_MAX_VIEWS}")
+    views = []
+    for offset, view in enumerate(requested):
+        if isinstance(view, dict):
+            name = str(view.get('name') or f'view_{offset}')
+            facing = view.get('facing') or CHARACTER_VIEW_FACINGS.get(name)
+        else:
+            name = str(view)
+            facing = CHARACTER_VIEW_FACINGS.get(name)
+        if not facing:
+            raise ValueError(f"neznámy view '{name}' (známe: {', '.join(CHARACTER_VIEW_FACINGS)})")
+        views.append({
+            'name': name,
+            'prompt': CHARACTER_PROMPT.format(base_prompt=base_prompt, facing=facing),
+            'seed_offset': offset,
+        })
+    return views
+
+
+def _character_chunk(pipe, fast_decode, prompts, negative_prompt, generators, init_image=None, width=512, height=512):
+    """Jedno batched volanie pipeline pre niekoľko views (img2img ak je `init_image`)."""
+    count = len(prompts)
+    with torch.inference_mode():
+        kwargs = dict(
+            **prompt_embed_kwargs(pipe, prompts, [negative_prompt] * count, 7.5),
+            **progress_kwargs(pipe),
+            num_inference_steps=40,
+            guidance_scale=7.5,
+            generator=generators,
+        )
+        if init_image is not None:
+            init = init_latents_cached(pipe, init_image, fast_decode)
+            kwargs['image'] = [init] * count if isinstance(init, Image.Image) else init.repeat(count, 1, 1, 1)
+            kwargs['strength'] = 0.65  # Menej strength pre zachovanie štýlu
+        else:
+            kwargs['width'] = width
+            kwargs['height'] = height
+        return pipe_images(pipe, fast_decode, **kwargs)
+
 
 @app.route('/generate-character', methods=['POST'])
 def generate_character():
     """
     Generuje sériu obrázkov postavy z rôznych uhlov pohľadu.
-    Vráti 4 obrázky: front, side, back, 3/4 view
+    Default 4 views (south, east, north, west); `views` vyberie iné / všetkých 8 smerov.
     """
+    return _run_job('/generate-character', parse_request(request, 'reference_image'))
+
+
+def _generate_character_job(data):
     try:
-        data = request.json
         base_prompt = data.get('prompt', '')
         negative_prompt = data.get('negative_prompt', 'blurry, low quality, distorted, ugly, deformed, disfigured, realistic photo, photorealistic, 3d render, modern, futuristic')
         reference_image = data.get('reference_image', '')  # Base64 obrázok (voliteľný)
         model_key = data.get('model', 'dreamshaper')  # Default: dreamshaper pre characters
         
         if not base_prompt:
-            return jsonify({'error': 'Prompt je povinný'}), 400
+            return {'error': 'Prompt je povinný'}, 400
         
         # Načítaj model
         try:
             model_entry = load_pipeline(model_key)
+        except JobCancelled:
+            raise
         except Exception as e:
-            return jsonify({'error': f'Nepodarilo sa načítať model: {e}'}), 500
+            return {'error': f'Nepodarilo sa načítať model: {e}'}, 500
+        
+        # LoRA je per-request — bez `lora` beží character bez LoRA
+        lora_error = _load_generate_lora(model_entry, model_key, data.get('lora', ''), data.get('lora_scale', 0.9))
+        if lora_error is not None:
+            return lora_error
         
         # Seed pre konzistentnosť naprieč všetkými views
         seed = data.get('seed', None)
@@ -1845,29 +2576,10 @@ def generate_character():
         width = int(width // 8 * 8)
         height = int(height // 8 * 8)
         
-        # Definuj views s izometrickými promptmi pre game sprites
-        views = [
-            {
-                'name': 'south',
-                'prompt': f"isometric pixel art game sprite, {base_prompt}, facing down, south view, top-down isometric angle, low poly style, clean flat colors, game asset, transparent background, simple shading, 45 degree angle",
-                'seed_offset': 0
-            },
-            {
-                'name': 'east',
-                'prompt': f"isometric pixel art game sprite, {base_prompt}, facing right, east view, top-down isometric angle, low poly style, clean flat colors, game asset, transparent background, simple shading, 45 degree angle",
-                'seed_offset': 1
-            },
-            {
-                'name': 'north',
-                'prompt': f"isometric pixel art game sprite, {base_prompt}, facing up, north view, top-down isometric angle, low poly style, clean flat colors, game asset, transparent background, simple shading, 45 degree angle",
-                'seed_offset': 2
-            },
-            {
-                'name': 'west',
-                'prompt': f"isometric pixel art game sprite, {base_prompt}, facing left, west view, top-down isometric angle, low poly style, clean flat colors, game asset, transparent background, simple shading, 45 degree angle",
-                'seed_offset': 3
-            }
-        ]
+        try:
+            views = _character_views(data.get('views'), base_prompt)
+        except ValueError as e:
+            return {'error': f'Neplatné views: {e}'}, 400
         
         generated_images = []
         
@@ -1878,12 +2590,8 @@ def generate_character():
         if use_img2img:
             print(f"🎭 Character Generation (img2img): {base_prompt[:50]}...")
             
-            # Dekóduj reference image
-            if ',' in reference_image:
-                reference_image = reference_image.split(',')[1]
-            
-            image_data = base64.b64decode(reference_image)
-            init_image = Image.open(io.BytesIO(image_data))
+            # Dekóduj reference image (base64 alebo binárne telo požiadavky)
+            init_image = open_image(reference_image)
             
             # Konvertuj na RGB
             if init_image.mode == 'RGBA':
@@ -1894,77 +2602,550 @@ def generate_character():
                 init_image = init_image.convert('RGB')
             
             init_image = init_image.resize((width, height))
-            img2img_pipe = model_entry.get('img2img')
+            pipe = model_entry.get('img2img')
         else:
             print(f"🎭 Character Generation (txt2img): {base_prompt[:50]}...")
             pipe = model_entry.get('pipe')
         
-        # Generuj každý view
-        for view in views:
-            view_seed = seed + view['seed_offset']
-            generator = torch.Generator(device=device).manual_seed(view_seed)
-            
-            print(f"   └─ Generujem {view['name']} view (seed={view_seed})...")
-            
-            with torch.inference_mode():
-                if use_img2img:
-                    image = img2img_pipe(
-                        prompt=view['prompt'],
-                        negative_prompt=negative_prompt,
-                        image=init_image,
-                        strength=0.65,  # Menej strength pre zachovanie štýlu
-                        num_inference_steps=40,
-                        guidance_scale=7.5,
-                        generator=generator,
-                    ).images[0]
-                else:
-                    image = pipe(
-                        prompt=view['prompt'],
-                        negative_prompt=negative_prompt,
-                        num_inference_steps=40,
-                        guidance_scale=7.5,
-                        width=width,
-                        height=height,
-                        generator=generator,
-                    ).images[0]
-            
-            # Konvertuj na base64
-            buffer = io.BytesIO()
-            image.save(buffer, format='PNG')
-            img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        fast_decode = fast_decode_enabled(model_key, data)
+
+        # Všetky views v jednom batchi (po CHARACTER_BATCH_SIZE) — každý view
+        # má vlastný generator, takže seed + offset dáva rovnaký šum ako predtým
+        batch_size = max(1, CHARACTER_BATCH_SIZE)
+        start = 0
+        while start < len(views):
+            chunk = views[start:start + batch_size]
+            view_seeds = [seed + view['seed_offset'] for view in chunk]
+            generators = [torch.Generator(device=device).manual_seed(s) for s in view_seeds]
+            print(f"   └─ Generujem {', '.join(view['name'] for view in chunk)} (seeds={view_seeds})...")
+            try:
+                images = _character_chunk(
+                    pipe,
+                    fast_decode,
+                    [view['prompt'] for view in chunk],
+                    negative_prompt,
+                    generators,
+                    init_image=init_image,
+                    width=width,
+                    height=height,
+                )
+            except torch.cuda.OutOfMemoryError:
+                if batch_size == 1:
+                    raise
+                batch_size = max(1, batch_size // 2)
+                print(f"⚠️  CUDA OOM pri batchi views — skúšam po {batch_size}")
+                torch.cuda.empty_cache()
+                continue
             
-            generated_images.append({
-                'view': view['name'],
-                'image': f'data:image/png;base64,{img_base64}',
-                'prompt': view['prompt'],
-                'seed': view_seed
-            })
+            for view, view_seed, image in zip(chunk, view_seeds, images):
+                generated_images.append({
+                    'view': view['name'],
+                    'image': image,
+                    'prompt': view['prompt'],
+                    'seed': view_seed
+                })
+            start += len(chunk)
         
         print("✅ Character views vygenerované!")
         
-        return jsonify({
+        return {
             'images': generated_images,
             'base_prompt': base_prompt,
             'base_seed': seed,
             'model': model_key
-        })
+        }, 200
         
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"❌ Chyba pri generovaní characteru: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+
+# ─── Result cache (seeded requests) ───
+#
+# With an explicit `seed`, /generate, /generate-with-controlnet and
+# /generate-with-adapter are deterministic — a repeated request is answered
+# from the cache, identical concurrent ones share one GPU run (result_cache.py).
+# The key covers the request fields + input image hashes and the server-side
+# state below; output encoding fields are not part of it.
+RESULT_CACHE_MB = float(os.environ.get('RESULT_CACHE_MB', '256'))
+RESULT_DISK_CACHE_MB = float(os.environ.get('RESULT_DISK_CACHE_MB', '2048'))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', './cache/results')
+
+result_cache = ResultCache(
+    max_bytes=int(RESULT_CACHE_MB * 1024 ** 2),
+    directory=RESULT_CACHE_DIR,
+    max_disk_bytes=int(RESULT_DISK_CACHE_MB * 1024 ** 2),
+)
+
+
+def _result_cache_context(endpoint: str, data: dict):
+    """Server-side inputs of a seeded request (None = don't cache it)."""
+    # noise_mask textúra sa generuje z nesedovaného np.random — nie je deterministická
+    if data.get('noise_mask') or data.get('noiseMask'):
+        return None
+    model_key = data.get('model', 'lite')
+    if model_key not in MODEL_REGISTRY:
+        return None
+    context = {
+        'model_id': MODEL_REGISTRY[model_key]['id'],
+        'fast_decode': fast_decode_enabled(model_key, data),
+    }
+    lora_name = data.get('lora')
+    if lora_name:
+        # Prepísaný LoRA súbor (iná veľkosť / mtime) = iný kľúč
+        info = lora_index.get(lora_name)
+        context['lora'] = [info.size_bytes, info.mtime_ns] if info else None
+    if endpoint == '/generate':
+        context['compiled'] = TURBO_COMPILE if data.get('compiled') is None else bool(data['compiled'])
+    if endpoint == '/generate-with-controlnet' and data.get('two_pass'):
+        explore_key = data.get('explore_model', 'sdxl')
+        context['explore_model_id'] = MODEL_REGISTRY.get(explore_key, {}).get('id', explore_key)
+    return context
+
+
+# =====================================================================
+# Job service + GPU job queue — async submit / status / result
+# =====================================================================
+# Every endpoint's work is a job function registered on `service` with its
+# typed request (service.py). Routes decode the HTTP body and encode the
+# result; rp_handler calls `service` directly, without the HTTP layer.
+# Everything that touches the pipelines runs through `gpu_queue`. The
+# blocking routes above submit and wait; the /jobs endpoints expose the same
+# jobs asynchronously so clients don't hold a connection open for the
+# whole diffusion run. /generate requests may be merged by the queue
+# (batcher = (batch_key_fn, batch_fn)). Seeded requests of the `cacheable`
+# endpoints go through `result_cache` first.
+service = GenerationService(gpu_queue, result_cache=result_cache, cache_context=_result_cache_context)
+service.register(GenerateRequest, _generate_job, batcher=(_generate_batch_key, _generate_batch_job),
+                 cacheable=True)
+service.register(ControlNetRequest, _generate_with_controlnet_job, cacheable=True)
+service.register(AdapterRequest, _generate_with_adapter_job, cacheable=True)
+service.register(CharacterRequest, _generate_character_job)
+service.register(ClearGpuRequest, _clear_gpu_job)
+service.register(RemoveBackgroundRequest, _remove_background_job, gpu=False)
+service.register(AdjustHueRequest, _adjust_hue_job, gpu=False)
+service.register(RecolorBatchRequest, _recolor_batch_job, gpu=False)
+
+# Upper bound for long-poll `?wait=` so proxies don't cut the connection.
+JOB_MAX_WAIT_S = 60.0
+
+
+def _submit_gpu_job(endpoint: str, data):
+    return service.submit(service.request(endpoint, data))
+
+
+def _run_job(endpoint: str, data):
+    """Run a registered job (GPU ones on the worker thread) and encode the result."""
+    return encode_response(*service.call(endpoint, data), data, request)
+
+
+# Field a raw image body (image/png, ...) is bound to, per endpoint.
+_MAIN_IMAGE_FIELD = {
+    '/generate': 'input_image',
+    '/generate-character': 'reference_image',
+}
+
+
+def _long_poll_wait() -> float:
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = 0.0
+    return max(0.0, min(wait, JOB_MAX_WAIT_S))
+
+
+def _job_submission():
+    """(endpoint, data) of a /jobs submission, JSON or binary transport."""
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        endpoint = body.get('endpoint') or '/generate'
+        data = body.get('data') or {}
+    else:
+        endpoint = '/' + (request.values.get('endpoint') or 'generate').lstrip('/')
+        data = parse_request(request, _MAIN_IMAGE_FIELD.get(endpoint, 'image'))
+        data.pop('endpoint', None)
+    if not endpoint.startswith('/'):
+        endpoint = '/' + endpoint
+    return endpoint, data
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a generation job and return its id immediately (HTTP 202).
+
+    Request JSON:
+      endpoint: str — a GPU endpoint, e.g. "/generate-with-controlnet"
+      data: dict — the body that route expects
+
+    Binary transport: multipart/form-data (or a raw image body) carrying the
+    route's own fields directly, with `endpoint` as a form field / query arg.
+
+    Poll `GET /jobs/<id>` for status and fetch `GET /jobs/<id>/result`.
+    Both accept `?wait=<seconds>` to long-poll until the job finishes.
+    `GET /jobs/<id>/stream` streams step progress, `POST /jobs/<id>/cancel`
+    aborts the job.
+    """
+    endpoint, data = _job_submission()
+    if endpoint not in service.endpoints(gpu=True):
+        return jsonify({'error': f"Unknown endpoint '{endpoint}'. Available: {service.endpoints(gpu=True)}"}), 400
+    try:
+        job = _submit_gpu_job(endpoint, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(job.describe(gpu_queue.position(job))), 202
+
+
+def _stream_format() -> str:
+    fmt = request.args.get('format')
+    if fmt in ('sse', 'ndjson'):
+        return fmt
+    return 'ndjson' if 'application/x-ndjson' in request.headers.get('Accept', '') else 'sse'
+
+
+def _stream_response(job, on_disconnect=None):
+    fmt = _stream_format()
+
+    def result(job):
+        # Final event carries the result JSON-encoded (data URLs), whatever the request asked for.
+        return encode_response(*job.result, dict(job.data, response_format='json'))
+
+    return Response(
+        stream_events(job, fmt, result, on_disconnect=on_disconnect),
+        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/jobs/stream', methods=['POST'])
+def submit_job_stream():
+    """Like POST /jobs, but the response streams the job's progress (SSE, or
+    NDJSON with `?format=ndjson` / `Accept: application/x-ndjson`):
+
+      event: progress  {"step": 12, "total": 40, "phase": 1, "preview": "data:image/jpeg;base64,..."}
+      event: result    {"status": "done", "http_status": 200, "result": {...}}
+
+    Previews (cheap latent → RGB approximation) come every
+    PROGRESS_PREVIEW_EVERY steps. Closing the connection cancels the job.
+    """
+    endpoint, data = _job_submission()
+    if endpoint not in service.endpoints(gpu=True):
+        return jsonify({'error': f"Unknown endpoint '{endpoint}'. Available: {service.endpoints(gpu=True)}"}), 400
+    try:
+        job = _submit_gpu_job(endpoint, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return _stream_response(job, on_disconnect=lambda: gpu_queue.cancel(job))
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = gpu_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+    wait = _long_poll_wait()
+    if wait > 0:
+        job.wait(wait)
+    return jsonify(job.describe(gpu_queue.position(job)))
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = gpu_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+    wait = _long_poll_wait()
+    if wait > 0:
+        job.wait(wait)
+    if not job.finished:
+        return jsonify(job.describe(gpu_queue.position(job))), 202
+    return encode_response(*job.result, job.data, request)
+
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    """Progress stream of an already submitted job (see POST /jobs/stream)."""
+    job = gpu_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+    return _stream_response(job)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Zruší job — čakajúci hneď, bežiaci pri najbližšom kroku difúzie."""
+    job = gpu_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+    if not gpu_queue.cancel(job):
+        return jsonify({**job.describe(), 'error': 'Job already finished'}), 409
+    return jsonify(job.describe(gpu_queue.position(job)))
+
+
+# =====================================================================
+# Warm start — preload + warm-up inference at worker boot
+# =====================================================================
+# A fresh worker used to pay the whole model load (plus cuDNN autotuning and
+# allocator growth on the first call) inside the first request. At boot,
+# `warm_start()` loads what PRELOAD_* lists — checkpoints, ControlNets and
+# preprocessors in parallel (entries sharing a checkpoint one after another,
+# so they share its components) — then runs a short txt2img per pipeline at
+# its warm-up shapes. It is queued as the first GPU job: nothing it loads is
+# evicted while it runs, requests that arrive meanwhile wait behind it, and
+# `/health` answers immediately (`ready` turns true once it has finished).
+#
+#   PRELOAD_MODELS         model keys, e.g. "sdxl,sdxl-lightning-4"
+#   PRELOAD_CONTROLNETS    "model:kind[:t2i]", e.g. "sdxl-lightning-4:depth_sd15"
+#   PRELOAD_PREPROCESSORS  e.g. "depth,lineart"
+#   PRELOAD_WORKERS        parallel loader threads (default 4)
+#   WARM_START             0 = no warm start at all (imports stay lazy)
+#   WARMUP                 0 = preload only
+#   WARMUP_SHAPES          "WxH,..." (default 512x512, SDXL 1024x1024)
+#   WARMUP_STEPS           denoising steps per warm-up call (default 1)
+# Turbo models with TURBO_COMPILE also warm the compiled img2img loop at
+# TURBO_COMPILE_SIZES; fast-decode models preload their tiny VAE.
+def _env_list(name: str, default: str = '') -> list:
+    return [item.strip() for item in os.environ.get(name, default).split(',') if item.strip()]
+
+
+WARM_START = os.environ.get('WARM_START', '1') == '1'
+PRELOAD_WORKERS = int(os.environ.get('PRELOAD_WORKERS', '4'))
+WARMUP = os.environ.get('WARMUP', '1') == '1'
+WARMUP_STEPS = int(os.environ.get('WARMUP_STEPS', '1'))
+WARMUP_SHAPES = _env_sizes('WARMUP_SHAPES')
+WARMUP_PROMPT = 'warm-up'
+
+warm_state = {'ready': False, 'phase': 'idle', 'loaded': [], 'warmed': [], 'errors': [], 'seconds': None}
+
+
+def _controlnet_spec(spec: str):
+    """"model:kind[:t2i]" → (model_key, kind, img2img)."""
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or parts[0] not in MODEL_REGISTRY:
+        raise ValueError(f"Neplatný PRELOAD_CONTROLNETS záznam '{spec}' (očakávam model:kind[:t2i])")
+    return parts[0], parts[1], not (len(parts) == 3 and parts[2] == 't2i')
+
+
+def _warm_task(label: str, fn):
+    try:
+        fn()
+        warm_state['loaded'].append(label)
+    except Exception as e:
+        print(f"⚠️  Warm start: {label} zlyhal: {e}")
+        warm_state['errors'].append(f"{label}: {e}")
+
+
+def _preload(models, controlnet_specs, preprocessor_kinds):
+    # Entries sharing a checkpoint load sequentially (the second reuses the
+    # first one's components); everything else is independent.
+    by_checkpoint = OrderedDict()
+    for key in models:
+        by_checkpoint.setdefault(MODEL_REGISTRY[key]['id'], []).append(key)
+
+    def load_group(keys):
+        for key in keys:
+            _warm_task(f"model {key}", lambda: load_pipeline(key))
+
+    families = {'xl' if _model_family(key) == 'xl' else 'sd' for key in models if fast_decode_enabled(key, {})}
+    # One load per ControlNet cache key — models of one family share the
+    # ControlNet weights, two parallel load_controlnet calls would both load.
+    controlnet_loads = {}
+    for model_key, kind, _ in controlnet_specs:
+        controlnet_loads.setdefault(f"{_model_family(model_key)}__{kind}", (model_key, kind))
+    with ThreadPoolExecutor(max_workers=max(1, PRELOAD_WORKERS), thread_name_prefix='preload') as pool:
+        futures = [pool.submit(load_group, keys) for keys in by_checkpoint.values()]
+        futures += [
+            pool.submit(_warm_task, f"controlnet {model_key}:{kind}", lambda m=model_key, k=kind: load_controlnet(k, m))
+            for model_key, kind in controlnet_loads.values()
+        ]
+        futures += [
+            pool.submit(_warm_task, f"preprocessor {kind}", lambda k=kind: get_preprocessor(k))
+            for kind in preprocessor_kinds
+        ]
+        futures += [
+            pool.submit(_warm_task, f"tiny VAE {family}", lambda f=family: load_tiny_vae(f))
+            for family in families
+        ]
+        for future in futures:
+            future.result()
+    # ControlNet pipelines only wrap already loaded parts — build them last.
+    for model_key, kind, img2img in controlnet_specs:
+        _warm_task(
+            f"controlnet pipeline {model_key}:{kind}:{'i2i' if img2img else 't2i'}",
+            lambda: load_controlnet_pipeline(model_key, kind, img2img=img2img),
+        )
+
+
+def _warmup_shapes(model_key: str) -> list:
+    if WARMUP_SHAPES:
+        return WARMUP_SHAPES
+    return [(1024, 1024) if _model_family(model_key) == 'xl' else (512, 512)]
+
+
+def _warmup_guidance(model_key: str) -> float:
+    cfg = MODEL_REGISTRY[model_key]
+    return 0.0 if cfg.get('turbo') or cfg.get('lightning') else 7.5
+
+
+def _warmup_model(model_key: str):
+    entry = load_pipeline(model_key)
+    apply_lora(entry, '')
+    pipe = entry['pipe']
+    guidance = _warmup_guidance(model_key)
+    fast_decode = fast_decode_enabled(model_key, {})
+    for width, height in _warmup_shapes(model_key):
+        with torch.inference_mode():
+            pipe_images(
+                pipe,
+                fast_decode,
+                **prompt_embed_kwargs(pipe, WARMUP_PROMPT, '', guidance),
+                num_inference_steps=WARMUP_STEPS,
+                guidance_scale=guidance,
+                width=width,
+                height=height,
+                generator=torch.Generator(device=pipe.device).manual_seed(0),
+            )
+    if MODEL_REGISTRY[model_key].get('turbo') and TURBO_COMPILE:
+        # Compile + autotune the turbo img2img UNet per shape bucket.
+        for width, height in sorted(TURBO_COMPILE_SIZES):
+            webgpu_compatible_img2img(
+                entry['img2img'],
+                prompt=WARMUP_PROMPT,
+                negative_prompt='',
+                init_image=Image.new('RGB', (width, height)),
+                strength=1.0,
+                num_steps=1,
+                width=width,
+                height=height,
+                generator=torch.Generator(device=pipe.device).manual_seed(0),
+                fast_decode=fast_decode,
+            )
+
+
+def _warmup_controlnet(model_key: str, kind: str, img2img: bool):
+    apply_lora(load_pipeline(model_key), '')
+    pipe = load_controlnet_pipeline(model_key, kind, img2img=img2img)
+    guidance = _warmup_guidance(model_key)
+    for width, height in _warmup_shapes(model_key):
+        blank = Image.new('RGB', (width, height))
+        kwargs = dict(
+            **prompt_embed_kwargs(pipe, WARMUP_PROMPT, None, guidance),
+            num_inference_steps=WARMUP_STEPS,
+            guidance_scale=guidance,
+            width=width,
+            height=height,
+            generator=torch.Generator(device=pipe.device).manual_seed(0),
+        )
+        if img2img:
+            kwargs.update(image=blank, control_image=blank, strength=1.0)
+        else:
+            kwargs.update(image=blank)
+        with torch.inference_mode():
+            pipe(**kwargs)
+
+
+def _warm_start_job(data):
+    try:
+        return _warm_start(data)
+    except Exception as e:
+        # Konečný stav: worker beží ďalej (modely sa načítajú na požiadanie),
+        # `ready` nesmie ostať navždy False.
+        warm_state.update(ready=True, phase='degraded')
+        warm_state['errors'].append(str(e))
+        raise
+
+
+def _warm_start(data):
+    t0 = time.perf_counter()
+    warm_state.update(ready=False, phase='importing', loaded=[], warmed=[], errors=[], seconds=None)
+    # Ťažké importy (torch, diffusers pipelines) + CUDA kontext zaplatí warm
+    # start, nie prvý request.
+    if torch.cuda.is_available():
+        torch.cuda.init()
+    for name in ('StableDiffusionPipeline', 'StableDiffusionXLPipeline'):
+        getattr(diffusers, name)
+    warm_state['phase'] = 'loading'
+    models = []
+    for key in _env_list('PRELOAD_MODELS', ','.join(data.get('default_models') or [])):
+        if key in MODEL_REGISTRY:
+            models.append(key)
+        else:
+            warm_state['errors'].append(f"model {key}: neznámy model")
+    controlnet_specs = []
+    for spec in _env_list('PRELOAD_CONTROLNETS'):
+        try:
+            parsed = _controlnet_spec(spec)
+        except ValueError as e:
+            warm_state['errors'].append(str(e))
+            continue
+        if parsed not in controlnet_specs:
+            controlnet_specs.append(parsed)
+    # ControlNet pipelines need their base model as well.
+    for model_key, _, _ in controlnet_specs:
+        if model_key not in models:
+            models.append(model_key)
+    preprocessor_kinds = _env_list('PRELOAD_PREPROCESSORS')
+
+    if models or preprocessor_kinds:
+        print(f"🔥 Warm start: models={models}, controlnets={[':'.join(map(str, s)) for s in controlnet_specs]}, "
+              f"preprocessors={preprocessor_kinds}")
+    _preload(models, controlnet_specs, preprocessor_kinds)
+
+    if WARMUP:
+        warm_state['phase'] = 'warmup'
+        for model_key in models:
+            t_model = time.perf_counter()
+            try:
+                _warmup_model(model_key)
+                warm_state['warmed'].append(model_key)
+                print(f"🔥 Warm-up {model_key}: {time.perf_counter() - t_model:.1f} s")
+            except Exception as e:
+                print(f"⚠️  Warm-up {model_key} zlyhal: {e}")
+                warm_state['errors'].append(f"warm-up {model_key}: {e}")
+        for model_key, kind, img2img in controlnet_specs:
+            label = f"{model_key}:{kind}:{'i2i' if img2img else 't2i'}"
+            try:
+                _warmup_controlnet(model_key, kind, img2img)
+                warm_state['warmed'].append(label)
+            except Exception as e:
+                print(f"⚠️  Warm-up {label} zlyhal: {e}")
+                warm_state['errors'].append(f"warm-up {label}: {e}")
+
+    warm_state.update(ready=True, phase='degraded' if warm_state['errors'] else 'ready',
+                      seconds=round(time.perf_counter() - t0, 1))
+    print(f"✅ Warm start hotový za {warm_state['seconds']} s "
+          f"(načítané: {len(warm_state['loaded'])}, warm-up: {len(warm_state['warmed'])}, "
+          f"chyby: {len(warm_state['errors'])})")
+    return dict(warm_state), 200
+
+
+def warm_start(default_models=(), wait: bool = False):
+    """Queue the preload + warm-up as the first GPU job. `default_models` apply
+    when PRELOAD_MODELS is not set. Returns the job (with `wait`, its result)
+    — requests submitted meanwhile queue behind it, /health answers at once."""
+    if not WARM_START:
+        warm_state.update(ready=True, phase='disabled')
+        return None
+    warm_state['phase'] = 'queued'
+    data = {'default_models': list(default_models)}
+    if wait:
+        return gpu_queue.run('warm-start', _warm_start_job, data)
+    return gpu_queue.submit('warm-start', _warm_start_job, data)
+
 
 if __name__ == '__main__':
     print("=" * 60)
     print("🚀 Stable Diffusion Backend (multi-model, on-demand)")
     print("=" * 60)
-    # Pokusíme sa prednačítať LITE model pre rýchlejší start (ak je to možné)
-    try:
-        load_pipeline('lite')
-        print("\n🌐 Prednačítaný LITE model (ak bol úspešne stiahnutý)")
-    except Exception as e:
-        print(f"\n⚠️  Nepodarilo sa prednačítať LITE model: {e}")
+    # Prednačítanie + warm-up na pozadí (PRELOAD_MODELS, default LITE model)
+    warm_start(default_models=('lite',))
 
     print("\n🌐 Server pripravený!")
     print("📍 URL: http://localhost:5000")
@@ -0,0 +1,121 @@
+"""
+Benchmark: vectorized HSV transforms (color_transform.py) vs. per-pixel colorsys.
+
+`/adjust-hue` and `/recolor-batch` used to loop over every pixel with
+colorsys on float32 numpy scalars. This script reports, per transform:
+
+  • whether the vectorized output is identical to colorsys on Python floats
+    (the exactness reference, also used by `tests/test_color_transform.py`),
+  • the max per-channel difference to the original float32 loop (float32
+    rounding made it NumPy-version dependent; expect ≤ 1),
+  • the original loop's and the vectorized wall time and the speedup.
+
+The slow paths run on a smaller image and their time is scaled to the
+benchmark size.
+
+Usage:
+  python bench_color.py                 # 512×512 RGBA, reference on 128×128
+  python bench_color.py --size 1024 --ref-size 256
+"""
+
+import argparse
+import colorsys
+import time
+
+import numpy as np
+from PIL import Image
+
+from color_transform import adjust_saturation, apply_color_tint, hex_to_hsv, shift_hue
+
+
+def colorsys_reference(image, pixel_fn):
+    """Original per-pixel path: `pixel_fn(r, g, b) -> (r, g, b)` on floats 0-1."""
+    has_alpha = image.mode == 'RGBA'
+    rgb = np.asarray(image.convert('RGB'))
+    out = np.zeros(rgb.shape, dtype=np.float64)
+    for i in range(rgb.shape[0]):
+        for j in range(rgb.shape[1]):
+            r, g, b = (int(c) / 255.0 for c in rgb[i, j])
+            out[i, j] = pixel_fn(r, g, b)
+    result = Image.fromarray((out * 255).astype(np.uint8), 'RGB')
+    if has_alpha:
+        result.putalpha(image.getchannel('A'))
+    return result
+
+
+def original_path(image, pixel_fn):
+    """The pre-vectorization loop: float32 array, colorsys per pixel, float32 result."""
+    has_alpha = image.mode == 'RGBA'
+    img_array = np.array(image.convert('RGB')).astype(np.float32) / 255.0
+    out = np.zeros_like(img_array)
+    for i in range(img_array.shape[0]):
+        for j in range(img_array.shape[1]):
+            r, g, b = img_array[i, j]
+            out[i, j] = pixel_fn(r, g, b)
+    result = Image.fromarray((out * 255).astype(np.uint8), 'RGB')
+    if has_alpha:
+        result.putalpha(image.getchannel('A'))
+    return result
+
+
+def ref_shift_hue(hue_shift):
+    def fn(r, g, b):
+        h, s, v = colorsys.rgb_to_hsv(r, g, b)
+        return colorsys.hsv_to_rgb((h + hue_shift / 360.0) % 1.0, s, v)
+    return fn
+
+
+def ref_saturation(factor):
+    def fn(r, g, b):
+        h, s, v = colorsys.rgb_to_hsv(r, g, b)
+        return colorsys.hsv_to_rgb(h, min(s * factor, 1.0), v)
+    return fn
+
+
+def ref_tint(target_hex, intensity):
+    th, ts, _ = hex_to_hsv(target_hex)
+
+    def fn(r, g, b):
+        h, s, v = colorsys.rgb_to_hsv(r, g, b)
+        return colorsys.hsv_to_rgb(h * (1 - intensity) + th * intensity,
+                                   min(s + (ts - s) * intensity, 1.0), v)
+    return fn
+
+
+CASES = [
+    ('shift_hue', lambda im: shift_hue(im, 37), ref_shift_hue(37)),
+    ('adjust_saturation', lambda im: adjust_saturation(im, 1.4), ref_saturation(1.4)),
+    ('apply_color_tint', lambda im: apply_color_tint(im, '#3366CC', 0.5), ref_tint('#3366CC', 0.5)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized HSV transforms vs. per-pixel colorsys")
+    parser.add_argument("--size", type=int, default=512, help="Benchmark image side (RGBA)")
+    parser.add_argument("--ref-size", type=int, default=128, help="Image side for the slow reference")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    small = Image.fromarray(rng.integers(0, 256, (args.ref_size, args.ref_size, 4), dtype=np.uint8), 'RGBA')
+    big = Image.fromarray(rng.integers(0, 256, (args.size, args.size, 4), dtype=np.uint8), 'RGBA')
+    scale = (args.size / args.ref_size) ** 2
+
+    for name, fast, ref in CASES:
+        t_fast = float('inf')
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            fast(big)
+            t_fast = min(t_fast, time.perf_counter() - t0)
+        result = np.asarray(fast(small)).astype(np.int16)
+        same = np.array_equal(result, np.asarray(colorsys_reference(small, ref)))
+        t0 = time.perf_counter()
+        old = original_path(small, ref)
+        t_old = (time.perf_counter() - t0) * scale
+        max_diff = int(np.abs(result - np.asarray(old)).max())
+        print(f"{name:18s} zhoda={same}  max_diff_old={max_diff}  pôvodne≈{t_old * 1000:7.0f} ms  "
+              f"numpy={t_fast * 1000:6.1f} ms  ({args.size}², {t_old / t_fast:.0f}×)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Import-time budget for the worker cold start.
+
+`import app` (and with it `rp_handler`) must stay cheap: torch, diffusers and
+scipy are imported lazily (lazy_imports.py) so a fresh serverless worker
+answers `/health` and warm-up pings right away. This script guards that:
+
+  • runs `python -X importtime -c "import <module>"` in a fresh interpreter
+    (warm start disabled, so only the import itself is measured),
+  • reports the wall time and the heaviest direct imports of the module,
+  • times the first `/health` request through the Flask test client,
+  • fails (exit code 1) when the import exceeds --budget-ms or one of the
+    heavy modules (torch, diffusers, transformers, scipy) was imported eagerly.
+
+Usage:
+  python bench_import.py                      # import app, 1000 ms budget
+  python bench_import.py --module rp_handler
+  python bench_import.py --budget-ms 600 --top 15
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('torch', 'diffusers', 'transformers', 'scipy', 'controlnet_aux')
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', '1000'))
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module} as target
+import_ms = (time.perf_counter() - t0) * 1000
+health_ms = health_status = None
+flask_app = getattr(target, 'app', None)
+if flask_app is not None and hasattr(flask_app, 'test_client'):
+    t0 = time.perf_counter()
+    health_status = flask_app.test_client().get('/health').status_code
+    health_ms = (time.perf_counter() - t0) * 1000
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{'import_ms': import_ms, 'health_ms': health_ms, 'health_status': health_status,
+                  'heavy': heavy}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """`-X importtime` lines → [(level, name, self_us, cumulative_us)] in output order."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        level = (len(name) - len(name.lstrip())) // 2 + 1
+        rows.append((level, name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def direct_imports(rows: list, module: str) -> list:
+    """Modules imported directly by `module` — its level-2 children (printed before it)."""
+    for index in range(len(rows) - 1, -1, -1):
+        level, name, _, _ = rows[index]
+        if level == 1 and name == module:
+            children = []
+            for child in reversed(rows[:index]):
+                if child[0] == 1:
+                    break
+                if child[0] == 2:
+                    children.append(child)
+            return children
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget for app.py / rp_handler.py")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                        help="Max import wall time (default: IMPORT_BUDGET_MS or 1000)")
+    parser.add_argument("--top", type=int, default=10, help="How many heaviest imports to list")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, WARM_START='0')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(module=args.module, heavy=HEAVY_MODULES)],
+        cwd=here, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-4000:], file=sys.stderr)
+        print(f"❌ import {args.module} zlyhal (exit {proc.returncode})")
+        sys.exit(1)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = parse_importtime(proc.stderr)
+
+    print(f"import {args.module}: {result['import_ms']:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    if result['health_ms'] is not None:
+        print(f"first GET /health: {result['health_ms']:.0f} ms (HTTP {result['health_status']})")
+    children = sorted(direct_imports(rows, args.module), key=lambda r: -r[3])[:args.top]
+    if children:
+        print(f"\nheaviest imports of {args.module}:")
+        for _, name, _, cumulative_us in children:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if result['heavy']:
+        print(f"\n❌ eagerly imported heavy modules: {', '.join(result['heavy'])}")
+        failed = True
+    if result['import_ms'] > args.budget_ms:
+        print(f"\n❌ import over budget by {result['import_ms'] - args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("\n✅ within budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: full VAE vs. tiny VAE (TAESD / TAESDXL) — latency and quality.
+
+The backend's `fast_decode` mode (see app.py, "Tiny VAE") swaps the VAE
+decode of the turbo / Lightning paths for a distilled tiny autoencoder.
+This script measures what that buys and costs on the current machine:
+
+  • encode / decode latency of both autoencoders (median of --runs),
+  • PSNR of each round trip against the source image, and of the tiny
+    decode against the full decode of the same latents.
+
+Usage:
+  python bench_vae.py                          # SD 1.x/2.x VAE, synthetic test image
+  python bench_vae.py --family xl --size 1024  # SDXL VAE vs TAESDXL
+  python bench_vae.py --images a.png b.png     # your own images
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+from diffusers import AutoencoderKL, AutoencoderTiny
+from PIL import Image, ImageDraw
+
+# Same checkpoints the backend uses (app.TINY_VAE_REGISTRY / MODEL_REGISTRY).
+FULL_VAE = {'sd': 'stabilityai/sd-turbo', 'xl': 'stabilityai/stable-diffusion-xl-base-1.0'}
+TINY_VAE = {'sd': 'madebyollin/taesd', 'xl': 'madebyollin/taesdxl'}
+
+
+def synthetic_image(size: int) -> Image.Image:
+    """Gradients, hard edges and fine lines — enough structure to show VAE blur."""
+    y, x = np.mgrid[0:size, 0:size] / size
+    arr = np.stack([x, y, 0.5 + 0.5 * np.sin(12 * np.pi * x * y)], axis=-1)
+    image = Image.fromarray((arr * 255).astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size, max(4, size // 32)):
+        draw.line([(i, 0), (size - i, size)], fill=(255, 255, 255), width=1)
+    draw.rectangle([size // 4, size // 4, size // 2, size // 2], fill=(200, 40, 40))
+    draw.ellipse([size // 2, size // 2, 7 * size // 8, 7 * size // 8], fill=(30, 30, 160))
+    return image
+
+
+def to_tensor(image: Image.Image, device, dtype):
+    arr = np.asarray(image.convert('RGB'), dtype=np.float32) / 255.0
+    return torch.from_numpy(arr * 2.0 - 1.0).permute(2, 0, 1).unsqueeze(0).to(device=device, dtype=dtype)
+
+
+def to_array(decoded) -> np.ndarray:
+    decoded = (decoded.clamp(-1, 1).float() + 1.0) / 2.0
+    return (decoded[0].permute(1, 2, 0).cpu().numpy() * 255.0).round().astype(np.uint8)
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def timed(fn, runs: int, device) -> tuple:
+    """(result, median ms) of `fn()` after one warm-up call."""
+    result = fn()
+    times = []
+    for _ in range(runs):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        result = fn()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        times.append((time.perf_counter() - t0) * 1000)
+    return result, statistics.median(times)
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser(description="Full VAE vs tiny VAE (TAESD) benchmark")
+    parser.add_argument("--family", choices=sorted(FULL_VAE), default="sd")
+    parser.add_argument("--size", type=int, default=512, help="Image side for the synthetic image / resize")
+    parser.add_argument("--images", nargs="*", default=[], help="Image files (default: synthetic test image)")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    dtype = torch.float16 if device == 'cuda' else torch.float32
+    # SDXL's VAE overflows in fp16 (the pipelines upcast it) — benchmark it in fp32.
+    full_dtype = torch.float32 if args.family == 'xl' else dtype
+
+    print(f"⬇️  Loading {FULL_VAE[args.family]} (vae) and {TINY_VAE[args.family]} on {device} ...")
+    full = AutoencoderKL.from_pretrained(FULL_VAE[args.family], subfolder='vae', torch_dtype=full_dtype).to(device)
+    tiny = AutoencoderTiny.from_pretrained(TINY_VAE[args.family], torch_dtype=dtype).to(device)
+    scaling = full.config.scaling_factor
+
+    images = [Image.open(p).convert('RGB').resize((args.size, args.size)) for p in args.images]
+    if not images:
+        images = [synthetic_image(args.size)]
+
+    rows = []
+    for index, image in enumerate(images):
+        source = np.asarray(image)
+        x_full = to_tensor(image, device, full_dtype)
+        x_tiny = to_tensor(image, device, dtype)
+
+        latents, full_enc_ms = timed(lambda: full.encode(x_full).latent_dist.mean * scaling, args.runs, device)
+        _, tiny_enc_ms = timed(lambda: tiny.encode(x_tiny).latents, args.runs, device)
+        full_img, full_dec_ms = timed(lambda: to_array(full.decode(latents / scaling).sample), args.runs, device)
+        tiny_img, tiny_dec_ms = timed(lambda: to_array(tiny.decode(latents.to(dtype)).sample), args.runs, device)
+
+        rows.append({
+            'image': args.images[index] if args.images else f'synthetic {args.size}²',
+            'full_enc_ms': full_enc_ms, 'tiny_enc_ms': tiny_enc_ms,
+            'full_dec_ms': full_dec_ms, 'tiny_dec_ms': tiny_dec_ms,
+            'psnr_full': psnr(full_img, source), 'psnr_tiny': psnr(tiny_img, source),
+            'psnr_tiny_vs_full': psnr(tiny_img, full_img),
+        })
+
+    print()
+    print(f"{'image':24s} {'enc full':>9s} {'enc tiny':>9s} {'dec full':>9s} {'dec tiny':>9s} "
+          f"{'speedup':>8s} {'PSNR full':>10s} {'PSNR tiny':>10s} {'tiny≈full':>10s}")
+    for r in rows:
+        print(f"{r['image'][:24]:24s} {r['full_enc_ms']:7.1f}ms {r['tiny_enc_ms']:7.1f}ms "
+              f"{r['full_dec_ms']:7.1f}ms {r['tiny_dec_ms']:7.1f}ms {r['full_dec_ms'] / r['tiny_dec_ms']:7.1f}× "
+              f"{r['psnr_full']:8.2f}dB {r['psnr_tiny']:8.2f}dB {r['psnr_tiny_vs_full']:8.2f}dB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Small, thread-safe caching primitives shared by the backend.
+
+`LRUCache` is an in-memory LRU bounded by total size in bytes and/or entry
+count. Sizes are estimated with `nbytes`, which understands torch tensors,
+numpy arrays, PIL images, bytes and containers of those.
+
+`SpillCache` puts a disk tier behind an `LRUCache`: entries pushed out of
+RAM are serialized into a directory (itself bounded, oldest files deleted
+first) and promoted back to RAM on the next hit.
+
+`content_hash` gives content-addressed keys for images / arrays / bytes.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def nbytes(obj) -> int:
+    """Best-effort memory footprint of `obj` in bytes."""
+    if obj is None:
+        return 0
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    if hasattr(obj, 'element_size') and hasattr(obj, 'numel'):  # torch.Tensor
+        return obj.element_size() * obj.numel()
+    if hasattr(obj, 'nbytes'):  # numpy.ndarray
+        return int(obj.nbytes)
+    if hasattr(obj, 'getbands') and hasattr(obj, 'size'):  # PIL.Image
+        w, h = obj.size
+        return w * h * len(obj.getbands())
+    return 0
+
+
+def content_hash(*parts) -> str:
+    """Hex digest over `parts` (PIL images, numpy arrays, bytes, str, numbers)."""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if hasattr(part, 'getbands') and hasattr(part, 'tobytes'):  # PIL.Image
+            h.update(f"{part.mode}{part.size}".encode())
+            h.update(part.tobytes())
+        elif hasattr(part, 'tobytes') and hasattr(part, 'dtype'):  # numpy.ndarray
+            h.update(f"{part.dtype}{part.shape}".encode())
+            h.update(part.tobytes())
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class LRUCache:
+    """LRU mapping bounded by `max_bytes` (via `sizeof`) and/or `max_items`.
+
+    Values larger than `max_bytes` on their own are not stored.
+    `on_evict(key, value)` is called (outside the lock) for entries pushed
+    out by the bounds — not for `pop` / `clear`.
+    """
+
+    def __init__(self, max_bytes=None, max_items=None, sizeof=nbytes, name='cache', on_evict=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.on_evict = on_evict
+        self._sizeof = sizeof
+        self._data = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = self._sizeof(value)
+        evicted = []
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                evicted.append((key, value))
+            else:
+                self._data[key] = (value, size)
+                self._bytes += size
+            while self._data and (
+                (self.max_bytes is not None and self._bytes > self.max_bytes)
+                or (self.max_items is not None and len(self._data) > self.max_items)
+            ):
+                old_key, (old_value, old_size) = self._data.popitem(last=False)
+                self._bytes -= old_size
+                evicted.append((old_key, old_value))
+        if self.on_evict is not None:
+            for old_key, old_value in evicted:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._pop(key)
+            return default if item is None else item[0]
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+        return item
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'items': len(self._data),
+                'mb': round(self._bytes / 1024 ** 2, 1),
+                'max_mb': round(self.max_bytes / 1024 ** 2, 1) if self.max_bytes is not None else None,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class SpillCache:
+    """`LRUCache` in RAM with a bounded on-disk tier behind it.
+
+    `dump(value, path)` / `load(path)` (de)serialize one value; file names
+    are derived from `repr(key)`, so keys must have a stable repr. With
+    `max_disk_bytes=0` (or no directory) it behaves like a plain LRUCache.
+    """
+
+    def __init__(self, max_bytes, directory, max_disk_bytes, dump, load, suffix='.bin', name='cache'):
+        self.name = name
+        self.memory = LRUCache(max_bytes=max_bytes, name=name, on_evict=self._spill)
+        self.directory = directory if directory and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self._dump = dump
+        self._load = load
+        self._suffix = suffix
+        self._disk_lock = threading.Lock()
+        self.disk_hits = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, content_hash(key) + self._suffix)
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None or self.directory is None:
+            return default if value is None else value
+        path = self._path(key)
+        with self._disk_lock:
+            if not os.path.exists(path):
+                return default
+            try:
+                value = self._load(path)
+                os.utime(path)  # LRU order on disk = mtime
+            except Exception as e:
+                print(f"⚠️  {self.name}: poškodený súbor v cache {path}: {e}")
+                os.remove(path)
+                return default
+        self.disk_hits += 1
+        self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+
+    def _spill(self, key, value):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        with self._disk_lock:
+            try:
+                if not os.path.exists(path):
+                    tmp = path + '.tmp'
+                    self._dump(value, tmp)
+                    os.replace(tmp, path)
+                os.utime(path)
+            except Exception as e:
+                print(f"⚠️  {self.name}: zápis do disk cache zlyhal: {e}")
+                return
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Caller holds self._disk_lock.
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self._suffix):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def clear(self, disk: bool = False):
+        self.memory.clear()
+        if disk and self.directory:
+            with self._disk_lock:
+                for entry in os.scandir(self.directory):
+                    if entry.name.endswith(self._suffix):
+                        os.remove(entry.path)
+
+    def stats(self) -> dict:
+        info = self.memory.stats()
+        info['disk_hits'] = self.disk_hits
+        info['disk_dir'] = self.directory
+        return info
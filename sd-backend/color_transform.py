@@ -2,113 +2,224 @@ from PIL import Image
 import numpy as np
 import colorsys
 
+# Vektorizovaná HSV konverzia (NumPy) — rovnaké operácie ako colorsys, celé
+# vo float64: výsledok je bit-identický s per-pixel colorsys nad Python
+# floatmi a nezávisí od pravidiel povyšovania typov v NumPy (1.x vs. 2.x).
+# Oproti pôvodnej verzii (float32 pixely, výsledky podľa verzie NumPy) sa
+# kanál môže líšiť najviac o ±1. Porovnanie + benchmark: bench_color.py,
+# zhoda s colorsys: tests/test_color_transform.py.
+#
+# Medzivýsledky, ktoré závisia len od dvoch 8-bitových hodnôt, sú v 256×256
+# tabuľkách spočítaných tými istými float64 operáciami (index = a << 8 | b).
+
+_UNIT = np.arange(256, dtype=np.float64) / 255.0          # x / 255.0
+_DIFF = (_UNIT[:, None] - _UNIT[None, :]).ravel()          # maxc - c
+_RANGE = _DIFF.reshape(256, 256).copy()                    # maxc - minc (sivá → 1.0)
+_RANGE[np.diag_indices(256)] = 1.0
+_RANGE = _RANGE.ravel()
+with np.errstate(divide='ignore', invalid='ignore'):
+    _SAT = (_UNIT[:, None] - _UNIT[None, :]) / _UNIT[:, None]  # rangec / maxc
+_SAT[np.diag_indices(256)] = 0.0
+_SAT = _SAT.ravel()
+
+
+def _select(masks, values):
+    """values[k] tam, kde masks[k] (uint8 0/1, masky sa neprekrývajú)."""
+    out = values[0] * masks[0]
+    for mask, value in zip(masks[1:], values[1:]):
+        out += value * mask
+    return out
+
+
+def rgb_to_hsv(rgb8):
+    """
+    Vektorizovaný colorsys.rgb_to_hsv nad poľom (..., 3) uint8.
+
+    Returns:
+        (h, s, v) — float64 polia tvaru (...)
+    """
+    r8, g8, b8 = (np.ascontiguousarray(rgb8[..., c]) for c in range(3))
+    # max / min / výber kanálov stačia v uint8 (x / 255 je monotónne)
+    max8 = np.maximum(np.maximum(r8, g8), b8)
+    min8 = np.minimum(np.minimum(r8, g8), b8)
+    r_max = r8 == max8
+    g_max = (g8 == max8) & ~r_max
+    b_max = ~(r_max | g_max)
+    masks = (r_max.view(np.uint8), g_max.view(np.uint8), b_max.view(np.uint8))
+    x8 = _select(masks, (b8, r8, g8))
+    y8 = _select(masks, (g8, b8, r8))
+
+    hi = max8.astype(np.uint16) << 8
+    index = hi | min8
+    s = _SAT.take(index)
+    rangec = _RANGE.take(index)
+    # Podľa kanála s maximom (r, g, inak b): h = (offset + X) - Y, offset 0 / 2 / 4
+    # a X, Y = bc, gc / rc, bc / gc, rc — teda (maxc - kanál) / rangec.
+    h = np.multiply(masks[1] + 2 * masks[2], 2.0, dtype=np.float64)
+    term = np.empty_like(h)
+    np.bitwise_or(hi, x8, out=index)
+    h += np.divide(_DIFF.take(index, out=term), rangec, out=term)
+    np.bitwise_or(hi, y8, out=index)
+    h -= np.divide(_DIFF.take(index, out=term), rangec, out=term)
+    h /= 6.0
+    h -= np.floor(h)  # (h / 6) % 1.0 — bit-identické s Python % pre deliteľ 1.0
+    np.putmask(h, max8 == min8, 0.0)  # sivé pixely: h = s = 0
+    return h, s, np.divide(max8, 255.0, dtype=np.float64)
+
+
+def _to_uint8(factor, v):
+    """int(v * factor * 255) ako uint8; `factor` sa prepíše."""
+    factor *= v
+    factor *= 255
+    return factor.astype(np.uint8)
+
+
+# Sektor (int(h * 6) % 6) → ktorá z hodnôt [v, p, q, t] ide do kanála r, g, b
+_SECTOR_CHANNELS = ((0, 3, 1), (2, 0, 1), (1, 0, 3), (1, 2, 0), (3, 1, 0), (0, 1, 2))
+
+
+def hsv_to_rgb8(h, s, v, v8=None):
+    """
+    Vektorizovaný colorsys.hsv_to_rgb, výsledok rovno ako 0-255 uint8
+    (`int(x * 255)` každého kanála). Returns: (r, g, b) uint8 polia.
+
+    v, p, q, t sa na uint8 prevedú pred výberom kanálov — rovnaké orezanie,
+    ale výber po sektoroch je potom lacná uint8 aritmetika. `v8` = už
+    prevedené v (HsvImage ho pre všetky varianty počíta raz).
+    """
+    h6 = np.multiply(h, 6.0, dtype=np.float64)
+    i = np.trunc(h6)  # int() — celé číslo ako float, f = h6 - i vyjde rovnako
+    f = np.subtract(h6, i, out=h6)
+    if i.size and (i.min() < 0 or i.max() > 5):
+        np.remainder(i, 6, out=i)
+    sector = i.astype(np.uint8)
+    v = np.asarray(v, dtype=np.float64)
+    # Pre s == 0 sú p == q == t == v, takže sivé pixely netreba riešiť zvlášť.
+    # p, q, t sa počítajú v jednom pracovnom poli (rovnaké operácie ako colorsys,
+    # len bez 2 MB dočasných polí na každý medzivýsledok).
+    tmp = i
+    planes = [(v * 255).astype(np.uint8) if v8 is None else v8]
+    np.subtract(1.0, s, out=tmp)                      # p = v * (1 - s)
+    planes.append(_to_uint8(tmp, v))
+    np.multiply(s, f, out=tmp)                        # q = v * (1 - s * f)
+    np.subtract(1.0, tmp, out=tmp)
+    planes.append(_to_uint8(tmp, v))
+    np.subtract(1.0, f, out=tmp)                      # t = v * (1 - s * (1 - f))
+    tmp *= s
+    np.subtract(1.0, tmp, out=tmp)
+    planes.append(_to_uint8(tmp, v))
+    in_sector = [(sector == k).view(np.uint8) for k in range(6)]
+    channels = []
+    for c in range(3):
+        masks, values = [], []
+        for k, plane in enumerate(planes):
+            sectors = [in_sector[sec] for sec in range(6) if _SECTOR_CHANNELS[sec][c] == k]
+            mask = sectors[0]
+            for other in sectors[1:]:
+                mask = mask | other
+            masks.append(mask)
+            values.append(plane)
+        channels.append(_select(masks, values))
+    return tuple(channels)
+
+
+class HsvImage:
+    """
+    Obrázok rozložený do HSV raz — z neho sa potom lacno robia varianty
+    (posun odtieňa, sýtosť, tint). Alpha kanál sa zachová.
+    """
+
+    def __init__(self, image):
+        self.alpha = image.split()[3] if image.mode == 'RGBA' else None
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        self.h, self.s, self.v = rgb_to_hsv(np.asarray(image))
+        self.v8 = (self.v * 255).astype(np.uint8)
+
+    @property
+    def size(self):
+        return self.v.shape[1], self.v.shape[0]
+
+    def _to_image(self, channels):
+        bands = [Image.fromarray(c, 'L') for c in channels]
+        if self.alpha is not None:
+            return Image.merge('RGBA', bands + [self.alpha])
+        return Image.merge('RGB', bands)
+
+    def variant(self, hue_shift=None, saturation=None, tint=None, intensity=0.6):
+        """
+        Jeden farebný variant: posun odtieňa → sýtosť → tint (každý krok len ak
+        nie je None). Samostatné kroky dávajú presne to isté ako shift_hue /
+        adjust_saturation / apply_color_tint.
+        """
+        h, s = self.h, self.s
+        if hue_shift is not None:
+            h = h + hue_shift / 360.0
+            h -= np.floor(h)  # % 1.0
+        if saturation is not None:
+            s = np.minimum(s * saturation, 1.0)
+        if tint:
+            target_h, target_s, _ = hex_to_hsv(tint)
+            h = h * (1 - intensity) + target_h * intensity
+            s = np.minimum(s + (target_s - s) * intensity, 1.0)
+        return self._to_image(hsv_to_rgb8(h, s, self.v, self.v8))
+
+    def shift_hue(self, hue_shift):
+        return self.variant(hue_shift=hue_shift)
+
+    def adjust_saturation(self, saturation_factor):
+        return self.variant(saturation=saturation_factor)
+
+    def tint(self, target_hex, intensity=0.6):
+        return self.variant(tint=target_hex, intensity=intensity)
+
+
+def hex_to_hsv(target_hex):
+    """'#RRGGBB' / 'RRGGBB' → (h, s, v) v rozsahu 0-1."""
+    hex_color = target_hex.lstrip('#')
+    target_r = int(hex_color[0:2], 16)
+    target_g = int(hex_color[2:4], 16)
+    target_b = int(hex_color[4:6], 16)
+    return colorsys.rgb_to_hsv(target_r / 255.0, target_g / 255.0, target_b / 255.0)
+
+
 def shift_hue(image, hue_shift):
     """
     Zmení farebný odtieň (hue) obrázka bez straty kvality.
     Zachováva sýtosť (saturation) a jas (value/brightness).
-    
+
     Args:
         image: PIL Image objekt (RGB alebo RGBA)
         hue_shift: Posun odtieňa v stupňoch (-180 až +180)
                    0 = bez zmeny
                    +60 = posun smerom k žltej/zelenej
                    -60 = posun smerom k modrej/fialovej
-    
+
     Returns:
         PIL Image objekt s posunutým odtieňom (rovnaký mode ako vstup)
     """
-    # Ulož alpha kanál ak existuje
-    has_alpha = image.mode == 'RGBA'
-    if has_alpha:
-        alpha_channel = image.split()[3]
-        image = image.convert('RGB')
-    
-    # Konvertuj na numpy array a normalizuj na 0-1
-    img_array = np.array(image).astype(np.float32) / 255.0
-    
-    # Konvertuj RGB na HSV
-    hsv_array = np.zeros_like(img_array)
-    for i in range(img_array.shape[0]):
-        for j in range(img_array.shape[1]):
-            r, g, b = img_array[i, j]
-            h, s, v = colorsys.rgb_to_hsv(r, g, b)
-            
-            # Posun hue (odtieň) - musí byť v rozsahu 0-1
-            h = (h + hue_shift / 360.0) % 1.0
-            
-            hsv_array[i, j] = [h, s, v]
-    
-    # Konvertuj HSV späť na RGB
-    rgb_array = np.zeros_like(img_array)
-    for i in range(hsv_array.shape[0]):
-        for j in range(hsv_array.shape[1]):
-            h, s, v = hsv_array[i, j]
-            r, g, b = colorsys.hsv_to_rgb(h, s, v)
-            rgb_array[i, j] = [r, g, b]
-    
-    # Konvertuj späť na 0-255 a vytvor PIL Image
-    rgb_array = (rgb_array * 255).astype(np.uint8)
-    result = Image.fromarray(rgb_array, 'RGB')
-    
-    # Obnoviť alpha kanál ak bol
-    if has_alpha:
-        r, g, b = result.split()
-        result = Image.merge('RGBA', (r, g, b, alpha_channel))
-    
-    return result
+    return HsvImage(image).shift_hue(hue_shift)
 
 def adjust_saturation(image, saturation_factor):
     """
     Upraví sýtosť farieb bez zmeny odtieňa a jasu.
-    
+
     Args:
         image: PIL Image objekt (RGB alebo RGBA)
         saturation_factor: Násobiteľ sýtosti (0.0 - 2.0)
                           0.0 = čiernobiely
                           1.0 = pôvodná sýtosť
                           2.0 = dvojnásobná sýtosť
-    
+
     Returns:
         PIL Image objekt s upravenou sýtosťou
     """
-    has_alpha = image.mode == 'RGBA'
-    if has_alpha:
-        alpha_channel = image.split()[3]
-        image = image.convert('RGB')
-    
-    img_array = np.array(image).astype(np.float32) / 255.0
-    
-    hsv_array = np.zeros_like(img_array)
-    for i in range(img_array.shape[0]):
-        for j in range(img_array.shape[1]):
-            r, g, b = img_array[i, j]
-            h, s, v = colorsys.rgb_to_hsv(r, g, b)
-            
-            # Upraviť saturation (sýtosť)
-            s = min(s * saturation_factor, 1.0)
-            
-            hsv_array[i, j] = [h, s, v]
-    
-    rgb_array = np.zeros_like(img_array)
-    for i in range(hsv_array.shape[0]):
-        for j in range(hsv_array.shape[1]):
-            h, s, v = hsv_array[i, j]
-            r, g, b = colorsys.hsv_to_rgb(h, s, v)
-            rgb_array[i, j] = [r, g, b]
-    
-    rgb_array = (rgb_array * 255).astype(np.uint8)
-    result = Image.fromarray(rgb_array, 'RGB')
-    
-    if has_alpha:
-        r, g, b = result.split()
-        result = Image.merge('RGBA', (r, g, b, alpha_channel))
-    
-    return result
+    return HsvImage(image).adjust_saturation(saturation_factor)
 
 def apply_color_tint(image, target_hex, intensity=0.6):
     """
     Aplikuje farebný tint na obrázok podľa hexadecimálnej farby.
-    
+
     Args:
         image: PIL Image objekt (RGB alebo RGBA)
         target_hex: Hexadecimálna farba (napr. '#FF0000' alebo 'FF0000')
@@ -116,62 +227,26 @@ def apply_color_tint(image, target_hex, intensity=0.6):
                    0.0 = žiadny efekt
                    1.0 = plný color overlay
                    0.6 = odporúčané (zachováva detaily)
-    
+
     Returns:
         PIL Image objekt s aplikovaným farebným tintom
     """
-    # Ulož alpha kanál ak existuje
-    has_alpha = image.mode == 'RGBA'
-    if has_alpha:
-        alpha_channel = image.split()[3]
-        image = image.convert('RGB')
-    
-    # Konvertuj hex farbu na RGB
-    hex_color = target_hex.lstrip('#')
-    target_r = int(hex_color[0:2], 16)
-    target_g = int(hex_color[2:4], 16)
-    target_b = int(hex_color[4:6], 16)
-    
-    # Konvertuj target RGB na HSV
-    target_h, target_s, target_v = colorsys.rgb_to_hsv(
-        target_r / 255.0,
-        target_g / 255.0,
-        target_b / 255.0
-    )
-    
-    # Konvertuj obrázok na numpy array
-    img_array = np.array(image).astype(np.float32) / 255.0
-    
-    # Aplikuj color tint - posun hue a zväčši saturation smerom k target farbe
-    result_array = np.zeros_like(img_array)
-    for i in range(img_array.shape[0]):
-        for j in range(img_array.shape[1]):
-            r, g, b = img_array[i, j]
-            h, s, v = colorsys.rgb_to_hsv(r, g, b)
-            
-            # Blend hue smerom k target hue
-            h = h * (1 - intensity) + target_h * intensity
-            
-            # Zväčši saturation aby farba bola výraznejšia
-            s = min(s + (target_s - s) * intensity, 1.0)
-            
-            # Konvertuj späť na RGB
-            r, g, b = colorsys.hsv_to_rgb(h, s, v)
-            result_array[i, j] = [r, g, b]
-    
-    # Konvertuj späť na 0-255
-    result_array = (result_array * 255).astype(np.uint8)
-    result = Image.fromarray(result_array, 'RGB')
-    
-    # Obnoviť alpha kanál
-    if has_alpha:
-        r, g, b = result.split()
-        result = Image.merge('RGBA', (r, g, b, alpha_channel))
-    
-    return result
-
-# Test
-if __name__ == "__main__":
-    test_img = Image.new('RGB', (100, 100), (255, 0, 0))  # Červená
-    result = shift_hue(test_img, 120)  # Posun o 120° -> zelená
-    print(f"✅ Test úspešný: {result.mode}, veľkosť {result.size}")
+    return HsvImage(image).tint(target_hex, intensity)
+
+
+def pack_atlas(images, columns=None):
+    """
+    Poskladá rovnako veľké obrázky do mriežky (po riadkoch, zľava doprava).
+
+    Returns:
+        (atlas, layout) — layout: columns, rows, tile_width, tile_height
+    """
+    tile_w, tile_h = images[0].size
+    columns = max(1, min(int(columns or len(images)), len(images)))
+    rows = -(-len(images) // columns)
+    mode = 'RGBA' if any(im.mode == 'RGBA' for im in images) else 'RGB'
+    atlas = Image.new(mode, (columns * tile_w, rows * tile_h), (0, 0, 0, 0) if mode == 'RGBA' else (0, 0, 0))
+    for index, im in enumerate(images):
+        atlas.paste(im.convert(mode), ((index % columns) * tile_w, (index // columns) * tile_h))
+    layout = {'columns': columns, 'rows': rows, 'tile_width': tile_w, 'tile_height': tile_h}
+    return atlas, layout
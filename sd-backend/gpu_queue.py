@@ -0,0 +1,406 @@
+"""Single-worker GPU job queue.
+
+Every diffusion call funnels through ONE background thread. Concurrent
+clients therefore never race on the shared pipeline caches / LoRA state in
+`app.py`, and slow SDXL jobs no longer pin an HTTP connection for minutes:
+callers submit a job, get an id back and poll (or long-poll) for the result.
+
+The blocking Flask routes use the same queue (`GpuJobQueue.run`) so the
+GPU only ever sees one job at a time regardless of how it was submitted.
+
+Job functions take the request body (dict) and return `(payload, status)`
+exactly like a Flask view would, so a finished job's result can be returned
+straight from a route.
+
+Micro-batching: a job submitted with a `batch_key` and `batch_fn` may be
+merged with other queued jobs carrying the same key. The worker waits up to
+`GPU_BATCH_WINDOW_MS` for companions (only while nothing else is queued) and
+then calls `batch_fn([data, ...])`, which returns one `(payload, status)` per
+job in order.
+
+`on_job_start` (optional) is called on the worker thread right before each
+job / batch runs — `app.py` uses it to open a new VRAM-cache protection epoch.
+
+Progress / cancellation: code running inside a job finds it through
+`running_jobs()` and publishes step updates with `Job.report`; streaming
+clients block on `Job.wait_progress`. `cancel` drops a queued job right away
+and flags a running one — the diffusion step callback then raises
+`JobCancelled` and the job finishes with status `cancelled` (HTTP 409).
+
+Shared jobs: `subscribe` gives each caller of a job that several identical
+requests share (result_cache.py) its own `JobHandle` — own id, request data
+(output encoding) and cancellation. The shared job itself is only cancelled
+once every handle on it has been.
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+
+GPU_QUEUE_MAX_PENDING = int(os.environ.get('GPU_QUEUE_MAX_PENDING', '32'))
+# Finished jobs are kept this long (seconds) so clients can fetch the result.
+GPU_JOB_RESULT_TTL = float(os.environ.get('GPU_JOB_RESULT_TTL', '600'))
+# How long the worker holds a batchable job waiting for compatible ones.
+GPU_BATCH_WINDOW_MS = float(os.environ.get('GPU_BATCH_WINDOW_MS', '15'))
+GPU_MAX_BATCH = int(os.environ.get('GPU_MAX_BATCH', '4'))
+
+
+class QueueFull(RuntimeError):
+    """Raised by `submit` when the pending queue is at capacity."""
+
+
+class JobCancelled(RuntimeError):
+    """Raised inside a running job once all of its jobs asked to be cancelled."""
+
+
+CANCELLED_RESULT = ({'error': 'Job cancelled'}, 409)
+
+
+class Job:
+    """One unit of GPU work plus its lifecycle bookkeeping."""
+
+    def __init__(self, kind: str, fn, data, batch_key=None, batch_fn=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.data = data
+        self.batch_key = batch_key if batch_fn is not None else None
+        self.batch_fn = batch_fn
+        self.status = 'queued'  # queued | running | done | error | cancelled
+        self.result = None      # (payload, http_status) once finished
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.progress = None    # latest `report`ed dict while running
+        self.progress_seq = 0
+        self.phase = 0          # diffusion calls started so far (multi-pass jobs)
+        self.watchers = 0       # open progress streams — previews only when > 0
+        self._done = threading.Event()
+        self._progress_cond = threading.Condition()
+        self._callbacks = []
+        self._handles = []      # JobHandles of the callers sharing this job
+
+    @property
+    def watched(self) -> bool:
+        """Someone streams this job's progress (directly or through a handle)."""
+        return self.watchers > 0 or any(handle.watchers > 0 for handle in self._handles)
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout=None) -> bool:
+        """Block until the job finished. Returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def report(self, progress: dict):
+        """Publish a progress update (called from the worker thread)."""
+        with self._progress_cond:
+            self.progress = progress
+            self.progress_seq += 1
+            self._progress_cond.notify_all()
+        for handle in list(self._handles):
+            handle.report(progress)
+
+    def wait_progress(self, seq: int, timeout=None) -> bool:
+        """Block until a report newer than `seq` arrives or the job finishes."""
+        with self._progress_cond:
+            return self._progress_cond.wait_for(
+                lambda: self.progress_seq > seq or self.finished, timeout
+            )
+
+    def add_done_callback(self, fn):
+        """Call `fn(job)` once the job finished (right away if it already has)."""
+        with self._progress_cond:
+            if not self.finished:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, payload, http_status: int):
+        self.result = (payload, http_status)
+        if self.cancel_requested:
+            self.status = 'cancelled'
+        else:
+            self.status = 'done' if http_status < 400 else 'error'
+        self.finished_at = time.time()
+        with self._progress_cond:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+            self._progress_cond.notify_all()
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as exc:
+                print(f"⚠️  Job {self.id} done callback failed: {exc}", file=sys.stderr, flush=True)
+
+    def describe(self, position=None) -> dict:
+        info = {
+            'job_id': self.id,
+            'endpoint': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if position is not None:
+            info['queue_position'] = position
+        if self.status == 'running' and self.progress is not None:
+            info['progress'] = {k: v for k, v in self.progress.items() if k != 'preview'}
+        if self.cancel_requested and not self.finished:
+            info['cancel_requested'] = True
+        if self.finished and self.status == 'error':
+            payload = self.result[0]
+            info['error'] = payload.get('error') if isinstance(payload, dict) else str(payload)
+        return info
+
+
+class JobHandle(Job):
+    """One caller's view of a `Job` shared by several identical requests.
+
+    Own id, `data` and cancellation; progress and the result follow the
+    shared job. Created by `GpuJobQueue.subscribe`.
+    """
+
+    def __init__(self, shared: Job, data):
+        super().__init__(shared.kind, None, data)
+        self.shared = shared
+        self._claimed = False
+
+    def _claim(self) -> bool:
+        # Cancel and the shared job finishing race for the one `_finish`.
+        with self._progress_cond:
+            if self._claimed:
+                return False
+            self._claimed = True
+            return True
+
+    def _follow(self, shared: Job):
+        if self._claim():
+            self.started_at = shared.started_at
+            self._finish(*shared.result)
+
+    def describe(self, position=None) -> dict:
+        if self.finished:
+            return super().describe(position)
+        info = self.shared.describe(position)
+        info.update(job_id=self.id, created_at=self.created_at)
+        return info
+
+
+class GpuJobQueue:
+    """Bounded FIFO of `Job`s drained by a single daemon worker thread."""
+
+    def __init__(
+        self,
+        max_pending: int = GPU_QUEUE_MAX_PENDING,
+        result_ttl: float = GPU_JOB_RESULT_TTL,
+        batch_window_ms: float = GPU_BATCH_WINDOW_MS,
+        max_batch: int = GPU_MAX_BATCH,
+        on_job_start=None,
+    ):
+        self.max_pending = max_pending
+        self.on_job_start = on_job_start
+        self.result_ttl = result_ttl
+        self.batch_window = max(0.0, batch_window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._pending = deque()
+        self._jobs = {}
+        self._running = []
+        self._cond = threading.Condition()
+        self._worker = None
+
+    # ── public API ─────────────────────────────────────────────────────────
+    def submit(self, kind: str, fn, data, batch_key=None, batch_fn=None) -> Job:
+        job = Job(kind, fn, data, batch_key=batch_key, batch_fn=batch_fn)
+        with self._cond:
+            self._purge_expired()
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(
+                    f"GPU queue is full ({self.max_pending} pending jobs) — try again later"
+                )
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._ensure_worker()
+            self._cond.notify_all()
+        return job
+
+    def add_finished(self, kind: str, data, payload, http_status: int = 200) -> Job:
+        """Register a job whose result is already known (e.g. a cache hit), so
+        it can be polled / fetched like any other job without touching the GPU."""
+        job = Job(kind, None, data)
+        job._finish(payload, http_status)
+        job.started_at = job.finished_at
+        with self._cond:
+            self._purge_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def subscribe(self, shared: Job, data):
+        """New `JobHandle` on `shared` for a caller with request `data`, or
+        None if `shared` is being cancelled (submit a new job instead)."""
+        handle = JobHandle(shared, data)
+        with self._cond:
+            if shared.cancel_requested:
+                return None
+            self._purge_expired()
+            shared._handles.append(handle)
+            self._jobs[handle.id] = handle
+        shared.add_done_callback(handle._follow)
+        return handle
+
+    def run(self, kind: str, fn, data):
+        """Submit and block until done. Returns the job's `(payload, status)`."""
+        job = self.submit(kind, fn, data)
+        job.wait()
+        return job.result
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job):
+        """0-based position in the pending queue, or None if not queued."""
+        job = getattr(job, 'shared', job)
+        with self._cond:
+            try:
+                return self._pending.index(job)
+            except ValueError:
+                return None
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel `job`. Returns False if it already finished.
+
+        A `JobHandle` finishes as cancelled right away; its shared job is
+        cancelled only when no other handle still wants the result.
+        """
+        # _finish runs outside the lock — done callbacks may take other locks.
+        if isinstance(job, JobHandle):
+            with self._cond:
+                if not job._claim():
+                    return False
+                job.cancel_requested = True
+                shared = job.shared
+                dropped = (all(h.cancel_requested for h in shared._handles)
+                           and self._request_cancel(shared))
+            job._finish(*CANCELLED_RESULT)
+        else:
+            with self._cond:
+                if job.finished:
+                    return False
+                shared, dropped = job, self._request_cancel(job)
+        if dropped:
+            shared._finish(*CANCELLED_RESULT)
+        return True
+
+    def _request_cancel(self, job: Job) -> bool:
+        # Caller holds self._cond. True if `job` was still queued (caller finishes it).
+        if job.finished or job.cancel_requested:
+            return False
+        job.cancel_requested = True
+        if job in self._pending:
+            self._pending.remove(job)
+            return True
+        return False
+
+    def running_jobs(self) -> list:
+        """Jobs currently executing (one, or several for a merged batch)."""
+        with self._cond:
+            return list(self._running)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'running': [job.kind for job in self._running],
+                'max_pending': self.max_pending,
+                'tracked_jobs': len(self._jobs),
+            }
+
+    # ── worker ─────────────────────────────────────────────────────────────
+    def _ensure_worker(self):
+        # Caller holds self._cond.
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._worker_loop, name='gpu-worker', daemon=True)
+            self._worker.start()
+
+    def _take_compatible(self, batch):
+        # Caller holds self._cond. Moves queued jobs sharing the batch key.
+        key = batch[0].batch_key
+        for job in list(self._pending):
+            if len(batch) >= self.max_batch:
+                break
+            if job.batch_key == key and job.kind == batch[0].kind:
+                self._pending.remove(job)
+                batch.append(job)
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            batch = [self._pending.popleft()]
+            if batch[0].batch_key is not None and self.max_batch > 1:
+                deadline = time.monotonic() + self.batch_window
+                while True:
+                    self._take_compatible(batch)
+                    remaining = deadline - time.monotonic()
+                    # Never hold up unrelated queued work for companions.
+                    if len(batch) >= self.max_batch or remaining <= 0 or self._pending:
+                        break
+                    self._cond.wait(remaining)
+            self._running = batch
+            return batch
+
+    def _execute(self, batch) -> list:
+        if self.on_job_start is not None:
+            self.on_job_start(batch)
+        if len(batch) == 1:
+            job = batch[0]
+            return [job.fn(job.data)]
+        print(f"📦 GPU batch: {len(batch)}× {batch[0].kind}", flush=True)
+        results = batch[0].batch_fn([job.data for job in batch])
+        if len(results) != len(batch):
+            raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} jobs")
+        return results
+
+    def _worker_loop(self):
+        while True:
+            batch = self._next_batch()
+            for job in batch:
+                job.status = 'running'
+                job.started_at = time.time()
+            try:
+                results = self._execute(batch)
+            except JobCancelled:
+                print(f"🛑 GPU job(s) {[job.id for job in batch]} cancelled", flush=True)
+                results = [CANCELLED_RESULT] * len(batch)
+            except Exception as exc:
+                kinds = ', '.join(job.kind for job in batch)
+                print(f"❌ GPU job(s) {[job.id for job in batch]} ({kinds}) failed: {exc}",
+                      file=sys.stderr, flush=True)
+                traceback.print_exc()
+                results = [({'error': str(exc)}, 500)] * len(batch)
+            for job, (payload, http_status) in zip(batch, results):
+                if job.cancel_requested:
+                    payload, http_status = CANCELLED_RESULT
+                job._finish(payload, http_status)
+            with self._cond:
+                self._running = []
+
+    def _purge_expired(self):
+        # Caller holds self._cond.
+        if self.result_ttl <= 0:
+            return
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,203 @@
+"""Image transport for the generation API.
+
+Historically every route took and returned images as base64 data URLs in
+JSON (+33 % size, encode/decode CPU on both sides). JSON stays the default,
+but both directions now also support binary transport.
+
+Requests (`parse_request`):
+  • application/json — unchanged; image fields hold base64 / data URLs.
+  • multipart/form-data — image fields as file parts. Other parameters go
+    either in one `json` form field (JSON-decoded) or as individual fields,
+    which stay strings — the typed request (service.py) converts them per
+    field, so `width=512` becomes an int but a prompt "1e3" stays "1e3".
+  • raw `image/png`, `image/webp` or `image/jpeg` body — the image becomes
+    the route's main image field and parameters come from the query string
+    (strings, as with individual form fields).
+  Image fields then hold either a base64 string or raw `bytes`; routes read
+  them with `image_bytes` / `open_image`, which accept both (`open_image` also
+  takes a PIL image from in-process callers, see service.py).
+
+Responses (`encode_response`): job functions return PIL images inside their
+payload and the transport encodes them per request:
+  • json (default) — `data:image/...;base64,...` strings, as before.
+  • image — the raw bytes of the single result image, with the remaining
+    payload as JSON in the `X-Result-Meta` header. Payloads with several
+    images fall back to multipart.
+  • multipart — multipart/form-data with a `json` part (each image replaced
+    by its part name, e.g. "images.0.image") plus one part per image.
+  The format comes from `response_format` in the request, or from the
+  `Accept` header (image/* → image, multipart/* → multipart).
+
+Output encoding (`output_options`): per request `output_format` png (default,
+`png_compress_level`, env `PNG_COMPRESS_LEVEL`), webp (lossless, or lossy
+with `output_quality`) or jpeg (`output_quality`, default 92; images with
+alpha stay PNG). Images are encoded on a small thread pool
+(`IMAGE_ENCODE_WORKERS`) from the request thread — the GPU worker is already
+on the next job while the previous result is being encoded.
+"""
+
+import base64
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Response
+from PIL import Image
+
+
+IMAGE_MIMETYPES = ('image/png', 'image/webp', 'image/jpeg')
+RESPONSE_FORMATS = ('json', 'image', 'multipart')
+OUTPUT_FORMATS = {'png': 'image/png', 'webp': 'image/webp', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg'}
+
+# Pillow's default is 6; 1–3 is several times faster for ~10 % bigger files.
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', '3'))
+IMAGE_ENCODE_WORKERS = int(os.environ.get('IMAGE_ENCODE_WORKERS', '2'))
+
+_encode_pool = ThreadPoolExecutor(max_workers=max(1, IMAGE_ENCODE_WORKERS), thread_name_prefix='image-encode')
+
+
+def parse_request(req, image_field: str = 'image') -> dict:
+    """Request body as a dict, whatever the transport (see module docstring)."""
+    mimetype = req.mimetype or ''
+    if mimetype == 'multipart/form-data':
+        if 'json' in req.form:
+            data = json.loads(req.form['json'])
+        else:
+            data = dict(req.form.items())
+        for name, storage in req.files.items():
+            data[name] = storage.read()
+        return data
+    if mimetype in IMAGE_MIMETYPES:
+        data = dict(req.args.items())
+        data[image_field] = req.get_data()
+        return data
+    return req.get_json(silent=True) or {}
+
+
+def image_bytes(value) -> bytes:
+    """Raw bytes of an image field: `bytes` as-is, base64 / data URL decoded."""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if ',' in value:
+        value = value.split(',', 1)[1]  # strip data URL prefix
+    return base64.b64decode(value)
+
+
+def open_image(value) -> Image.Image:
+    """Image field → PIL image (in-process callers may pass one directly)."""
+    if isinstance(value, Image.Image):
+        return value.copy()
+    return Image.open(io.BytesIO(image_bytes(value)))
+
+
+def output_options(data: dict) -> dict:
+    """Encoding options requested in `data` (output_format / output_quality / png_compress_level)."""
+    data = data or {}
+    fmt = str(data.get('output_format') or 'png').lower()
+    if fmt not in OUTPUT_FORMATS:
+        fmt = 'png'
+    opts = {'format': 'jpeg' if fmt == 'jpg' else fmt}
+    if data.get('output_quality') is not None:
+        opts['quality'] = max(1, min(100, int(data['output_quality'])))
+    opts['compress_level'] = max(0, min(9, int(data.get('png_compress_level', PNG_COMPRESS_LEVEL))))
+    return opts
+
+
+def encode_image(img: Image.Image, opts: dict = None):
+    """(bytes, mimetype) of `img` encoded per `output_options`."""
+    opts = opts or {'format': 'png', 'compress_level': PNG_COMPRESS_LEVEL}
+    fmt = opts['format']
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    if fmt == 'jpeg' and has_alpha:
+        fmt = 'png'  # JPEG can't carry the transparent background
+    buf = io.BytesIO()
+    if fmt == 'webp':
+        if 'quality' in opts:
+            img.save(buf, format='WEBP', quality=opts['quality'], method=4)
+        else:
+            img.save(buf, format='WEBP', lossless=True, quality=0, method=0)
+    elif fmt == 'jpeg':
+        img.convert('RGB').save(buf, format='JPEG', quality=opts.get('quality', 92))
+    else:
+        img.save(buf, format='PNG', compress_level=opts.get('compress_level', PNG_COMPRESS_LEVEL))
+    return buf.getvalue(), OUTPUT_FORMATS[fmt]
+
+
+def _encode_all(images, opts) -> list:
+    if len(images) == 1:
+        return [_encode_pool.submit(encode_image, images[0], opts).result()]
+    return list(_encode_pool.map(lambda img: encode_image(img, opts), images))
+
+
+def response_format(data: dict, req=None) -> str:
+    fmt = (data or {}).get('response_format')
+    if fmt in RESPONSE_FORMATS:
+        return fmt
+    if req is not None:
+        accept = req.headers.get('Accept', '')
+        if accept.startswith('image/'):
+            return 'image'
+        if accept.startswith('multipart/'):
+            return 'multipart'
+    return 'json'
+
+
+def _map_images(value, fn, path=''):
+    """Copy of `value` with each PIL image replaced by `fn(path, image)`."""
+    if isinstance(value, Image.Image):
+        return fn(path, value)
+    if isinstance(value, dict):
+        return {k: _map_images(v, fn, f"{path}.{k}" if path else str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_map_images(v, fn, f"{path}.{i}") for i, v in enumerate(value)]
+    return value
+
+
+def _multipart(meta: dict, parts, status: int) -> Response:
+    boundary = uuid.uuid4().hex
+    chunks = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="json"\r\n'
+        f'Content-Type: application/json\r\n\r\n'.encode(),
+        json.dumps(meta).encode(),
+        b'\r\n',
+    ]
+    for name, (body, mimetype) in parts:
+        ext = mimetype.split('/')[1]
+        chunks += [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.{ext}"\r\n'
+            f'Content-Type: {mimetype}\r\n\r\n'.encode(),
+            body,
+            b'\r\n',
+        ]
+    chunks.append(f'--{boundary}--\r\n'.encode())
+    return Response(b''.join(chunks), status=status, mimetype=f'multipart/form-data; boundary={boundary}')
+
+
+def encode_response(payload, status: int, data: dict = None, req=None):
+    """Turn a job's `(payload, status)` into what the Flask route returns.
+
+    `data` is the request body (response_format / output_* options), `req`
+    the Flask request (Accept header).
+    """
+    if status >= 400 or not isinstance(payload, dict):
+        return payload, status
+    fmt = response_format(data, req)
+    images = []
+    meta = _map_images(payload, lambda path, img: images.append((path, img)) or path)
+    if not images:
+        return payload, status
+    names = [name for name, _ in images]
+    encoded = dict(zip(names, _encode_all([img for _, img in images], output_options(data))))
+    if fmt == 'json':
+        def data_url(path, _img):
+            body, mimetype = encoded[path]
+            return f"data:{mimetype};base64,{base64.b64encode(body).decode()}"
+        return _map_images(payload, data_url), status
+    if fmt == 'image' and len(images) == 1:
+        meta.pop(names[0], None)
+        body, mimetype = encoded[names[0]]
+        return Response(body, status=status, mimetype=mimetype,
+                        headers={'X-Result-Meta': json.dumps(meta)})
+    return _multipart(meta, list(encoded.items()), status)
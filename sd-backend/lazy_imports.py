@@ -0,0 +1,82 @@
+"""Deferred imports for the heavy dependencies (torch, diffusers, ...).
+
+`import app` used to pull in torch, ~20 diffusers pipeline classes and scipy
+before the first route could answer — seconds of CPU on every serverless cold
+start, even for a `/health` ping. `lazy_import(name)` returns a module
+stand-in that imports the real module on first attribute access:
+
+    torch = lazy_import('torch')
+    ...
+    torch.cuda.is_available()   # ← torch is imported here
+
+The first access of every lazy module is timed; `import_report()` lists
+which have been loaded and how long each took (shown in `/health`).
+`bench_import.py` keeps the eager part of the import under a budget.
+"""
+
+import importlib
+import threading
+import time
+import types
+
+
+_lock = threading.Lock()
+_modules = {}  # name -> LazyModule
+
+
+class LazyModule(types.ModuleType):
+    """Module stand-in; attribute access imports and forwards to the real module."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__['_lazy_target'] = None
+        self.__dict__['_lazy_seconds'] = None
+
+    def _lazy_load(self):
+        module = self.__dict__['_lazy_target']
+        if module is None:
+            # importlib's per-module lock makes concurrent first accesses
+            # (warm-up thread + a request) wait for the same import.
+            t0 = time.perf_counter()
+            module = importlib.import_module(self.__name__)
+            if self.__dict__['_lazy_target'] is None:
+                self.__dict__['_lazy_seconds'] = time.perf_counter() - t0
+                self.__dict__['_lazy_target'] = module
+                print(f"📦 Lazy import {self.__name__}: {self.__dict__['_lazy_seconds']:.2f} s")
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_target'] is not None else 'not loaded'
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Shared stand-in for module `name` (imported on first attribute access)."""
+    with _lock:
+        module = _modules.get(name)
+        if module is None:
+            module = _modules[name] = LazyModule(name)
+        return module
+
+
+def is_loaded(module) -> bool:
+    """False for a lazy module that has not been imported yet."""
+    if isinstance(module, LazyModule):
+        return module.__dict__['_lazy_target'] is not None
+    return True
+
+
+def import_report() -> dict:
+    """{name: seconds the first import took, or None if not loaded yet}."""
+    with _lock:
+        modules = list(_modules.values())
+    return {
+        m.__name__: None if m.__dict__['_lazy_seconds'] is None else round(m.__dict__['_lazy_seconds'], 2)
+        for m in modules
+    }
@@ -0,0 +1,217 @@
+"""Indexed catalogue of the LoRA files under `lora_models/`.
+
+Replaces the `Path(LORA_DIR).rglob(...)` walks that used to run on every
+`/health` poll and every LoRA request:
+
+  • The index is built once and only rebuilt when the mtime of one of the
+    indexed directories changes (adding / removing / renaming a file bumps
+    its parent directory's mtime) — a handful of `stat` calls per lookup.
+  • For `.safetensors` files only the JSON header is read to record the
+    target architecture (sd15 / sd21 / xl), rank, targeted components and
+    size, so an incompatible LoRA is rejected BEFORE any weights touch the
+    pipeline instead of by matching 'size mismatch' error strings.
+  • Recently used LoRA state dicts stay in a bounded CPU-RAM cache
+    (`LORA_RAM_CACHE_MB`), so re-loading an adapter skips the disk read.
+"""
+
+import json
+import os
+import struct
+import threading
+from dataclasses import dataclass, field
+
+from caches import LRUCache
+
+
+LORA_EXTENSIONS = ('.safetensors', '.pt', '.bin')
+LORA_RAM_CACHE_MB = float(os.environ.get('LORA_RAM_CACHE_MB', '1024'))
+
+# Cross-attention context width (= text encoder hidden size) per family.
+_CONTEXT_DIM_FAMILY = {768: 'sd15', 1024: 'sd21', 2048: 'xl'}
+_FAMILY_LABEL = {'sd15': 'SD 1.5', 'sd21': 'SD 2.1 / Turbo', 'xl': 'SDXL'}
+
+
+class LoraIncompatible(ValueError):
+    """The LoRA was trained for a different base-model family."""
+
+
+@dataclass
+class LoraInfo:
+    name: str
+    path: str
+    size_bytes: int
+    mtime_ns: int
+    family: str | None = None          # 'sd15' | 'sd21' | 'xl' | None (unknown)
+    rank: int | None = None
+    targets: tuple = field(default_factory=tuple)  # 'unet', 'text_encoder', 'text_encoder_2'
+
+    def describe(self) -> dict:
+        return {
+            'name': self.name,
+            'family': self.family,
+            'rank': self.rank,
+            'targets': list(self.targets),
+            'size_mb': round(self.size_bytes / 1024 ** 2, 1),
+        }
+
+
+def read_safetensors_header(path: str) -> dict:
+    """Return the JSON header of a .safetensors file (tensor name -> dtype/shape)."""
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        return json.loads(f.read(length))
+
+
+def _is_down_weight(key: str) -> bool:
+    return key.endswith(('lora_down.weight', 'lora_A.weight', 'lora.down.weight'))
+
+
+def _inspect_header(header: dict):
+    """(family, rank, targets) derived from tensor names and shapes."""
+    unet_family, te_family, rank, targets = None, None, None, set()
+    for key, meta in header.items():
+        if key == '__metadata__' or not isinstance(meta, dict):
+            continue
+        shape = meta.get('shape') or []
+        if key.startswith(('lora_te2_', 'text_encoder_2.')):
+            targets.add('text_encoder_2')
+        elif key.startswith(('lora_te_', 'lora_te1_', 'text_encoder.')):
+            targets.add('text_encoder')
+        else:
+            targets.add('unet')
+        if not _is_down_weight(key) or len(shape) < 2:
+            continue
+        if rank is None:
+            rank = int(shape[0])
+        # UNet cross-attention K/V projections read the text-encoder context,
+        # so their input width identifies the base family.
+        if unet_family is None and 'attn2' in key and ('to_k' in key or 'to_v' in key):
+            unet_family = _CONTEXT_DIM_FAMILY.get(int(shape[1]))
+        # Text-encoder layers: hidden width 768 (SD1.x) vs 1024 (SD2.x). SDXL's
+        # first text encoder is 768 wide too, so this is only a fallback.
+        if te_family is None and key.startswith(('lora_te_', 'text_encoder.')) and 'proj' in key:
+            te_family = _CONTEXT_DIM_FAMILY.get(int(shape[1]))
+    # Header keys come sorted, text encoder first — decide after the whole scan:
+    # UNet attn2 width, else a second text encoder (SDXL only), else TE width.
+    if unet_family is None and 'text_encoder_2' in targets:
+        unet_family = 'xl'
+    return unet_family or te_family, rank, tuple(sorted(targets))
+
+
+class LoraIndex:
+    def __init__(self, root: str, ram_cache_mb: float = LORA_RAM_CACHE_MB):
+        self.root = root
+        self._lock = threading.Lock()
+        self._entries = {}       # name -> LoraInfo
+        self._dir_mtimes = None  # dir -> st_mtime_ns at index time
+        self._state_dicts = LRUCache(max_bytes=int(ram_cache_mb * 1024 ** 2), name='lora_ram')
+
+    # ── index maintenance ─────────────────────────────────────────────────
+    def _stale(self) -> bool:
+        if self._dir_mtimes is None:
+            return True
+        for d, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(d).st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    def _rebuild(self):
+        os.makedirs(self.root, exist_ok=True)
+        entries, dir_mtimes = {}, {}
+        for dirpath, _, filenames in os.walk(self.root):
+            dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            for filename in sorted(filenames):
+                stem, ext = os.path.splitext(filename)
+                if ext not in LORA_EXTENSIONS:
+                    continue
+                # Same lookup priority as before: first extension in LORA_EXTENSIONS wins.
+                previous = entries.get(stem)
+                if previous is not None and (
+                    LORA_EXTENSIONS.index(os.path.splitext(previous.path)[1]) <= LORA_EXTENSIONS.index(ext)
+                ):
+                    continue
+                entries[stem] = self._describe_file(stem, os.path.join(dirpath, filename))
+        self._entries = entries
+        self._dir_mtimes = dir_mtimes
+        print(f"📚 LoRA index: {len(entries)} súborov v {self.root}")
+
+    @staticmethod
+    def _describe_file(name: str, path: str) -> LoraInfo:
+        st = os.stat(path)
+        info = LoraInfo(name=name, path=path, size_bytes=st.st_size, mtime_ns=st.st_mtime_ns)
+        if path.endswith('.safetensors'):
+            try:
+                info.family, info.rank, info.targets = _inspect_header(read_safetensors_header(path))
+            except Exception as e:
+                print(f"⚠️  Nepodarilo sa prečítať hlavičku LoRA {path}: {e}")
+        return info
+
+    def _refresh(self):
+        # Caller holds self._lock.
+        if self._stale():
+            self._rebuild()
+
+    # ── lookups ───────────────────────────────────────────────────────────
+    def names(self) -> list:
+        with self._lock:
+            self._refresh()
+            return list(self._entries)
+
+    def get(self, name: str):
+        with self._lock:
+            self._refresh()
+            info = self._entries.get(name)
+            if info is None:
+                return None
+            # In-place overwrites don't bump the directory mtime — re-stat the file.
+            try:
+                st = os.stat(info.path)
+            except FileNotFoundError:
+                self._dir_mtimes = None
+                return None
+            if st.st_mtime_ns != info.mtime_ns or st.st_size != info.size_bytes:
+                info = self._entries[name] = self._describe_file(name, info.path)
+            return info
+
+    def describe(self) -> list:
+        with self._lock:
+            self._refresh()
+            return [info.describe() for info in self._entries.values()]
+
+    def check_compatible(self, name: str, family: str, model_key: str = None) -> LoraInfo:
+        """Raise FileNotFoundError / LoraIncompatible unless `name` fits `family`."""
+        info = self.get(name)
+        if info is None:
+            raise FileNotFoundError(f"LoRA súbor nenájdený: {name}")
+        if info.family is not None and info.family != family:
+            target = f'model "{model_key}"' if model_key else f'rodina {family}'
+            raise LoraIncompatible(
+                f'LoRA model "{name}" je pre {_FAMILY_LABEL[info.family]}, ale {target} '
+                f'používa {_FAMILY_LABEL.get(family, family)}. Zvoľte kompatibilný model alebo vypnite LoRA.'
+            )
+        return info
+
+    # ── weights ───────────────────────────────────────────────────────────
+    def load_state_dict(self, name: str) -> dict:
+        """State dict of LoRA `name` on CPU, served from the RAM cache when possible."""
+        info = self.get(name)
+        if info is None:
+            raise FileNotFoundError(f"LoRA súbor nenájdený: {name}")
+        cache_key = (info.path, info.mtime_ns, info.size_bytes)
+        state_dict = self._state_dicts.get(cache_key)
+        if state_dict is None:
+            if info.path.endswith('.safetensors'):
+                from safetensors.torch import load_file
+                state_dict = load_file(info.path, device='cpu')
+            else:
+                import torch
+                state_dict = torch.load(info.path, map_location='cpu', weights_only=True)
+            self._state_dicts.put(cache_key, state_dict)
+        # diffusers may pop / rename keys while converting — hand out a shallow copy.
+        return dict(state_dict)
+
+    def stats(self) -> dict:
+        return {'indexed': len(self._entries), 'ram_cache': self._state_dicts.stats()}
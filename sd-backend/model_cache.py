@@ -0,0 +1,554 @@
+"""VRAM-budgeted LRU bookkeeping for everything `app.py` keeps loaded.
+
+`app.py` caches base pipelines, ControlNet / T2I-Adapter models, the
+pipelines derived from them and controlnet_aux preprocessors in module-level
+dicts. Those dicts are now `ManagedCache` views over one shared `VramManager`
+which knows:
+
+  • the byte size of every cached entry (parameters + buffers of the
+    torch modules it holds, split into "on the GPU" and "elsewhere"),
+  • which modules are shared between entries — a ControlNet pipeline reuses
+    the UNet / VAE / text encoders of its base pipeline, so it only costs the
+    ControlNet itself,
+  • explicit dependencies — derived pipelines are evicted together with the
+    base pipeline / ControlNet they were built from, otherwise the shared
+    references would keep the weights alive.
+
+When the resident size exceeds the budget, least-recently-used entries are
+evicted. Entries touched by the job currently running on the GPU worker are
+never evicted from under it (see `begin_job`).
+
+Evicted entries are not dropped right away: their modules move to pinned
+host RAM (the "host tier") and the entry is parked there. The next lookup
+(`key in cache` / `cache[key]`) moves it back with one host-to-device copy
+instead of a `from_pretrained` from disk. The host tier is an LRU of its
+own; what falls out of it is dropped for good. Modules still used by a
+resident entry (shared UNet / VAE / text encoders) stay on the GPU.
+
+Budget: `VRAM_BUDGET_MB`, or (GPU total − `VRAM_HEADROOM_MB`) when unset.
+Without CUDA there is no budget unless `VRAM_BUDGET_MB` is set explicitly.
+Host tier: `HOST_RAM_BUDGET_MB`, or `HOST_RAM_FRACTION` (default 0.3) of
+physical RAM when unset; 0 disables it. CUDA only.
+"""
+
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+VRAM_HEADROOM_MB = float(os.environ.get('VRAM_HEADROOM_MB', '3072'))
+HOST_RAM_FRACTION = float(os.environ.get('HOST_RAM_FRACTION', '0.3'))
+
+
+def _cuda_available() -> bool:
+    import torch
+    return torch.cuda.is_available()
+
+
+def _default_budget_bytes():
+    env = os.environ.get('VRAM_BUDGET_MB')
+    if env:
+        return int(float(env) * 1024 ** 2)
+    if not _cuda_available():
+        return None
+    import torch
+    total = torch.cuda.get_device_properties(0).total_memory
+    return max(0, int(total - VRAM_HEADROOM_MB * 1024 ** 2))
+
+
+def _default_host_budget_bytes() -> int:
+    env = os.environ.get('HOST_RAM_BUDGET_MB')
+    if env:
+        return max(0, int(float(env) * 1024 ** 2))
+    if not _cuda_available():
+        return 0
+    try:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 0  # not available on this platform — set HOST_RAM_BUDGET_MB
+    return int(total * HOST_RAM_FRACTION)
+
+
+def _collect_modules(value, out=None):
+    """Return {id(module): module} for every torch module reachable from `value`.
+
+    Understands diffusers pipelines (`.components`), nn.Modules, the
+    `{'pipe': ..., 'img2img': ...}` entries of `pipelines`, and plain objects
+    that hold modules as attributes (controlnet_aux detectors).
+    """
+    import torch
+
+    if out is None:
+        out = {}
+    if value is None:
+        return out
+    if isinstance(value, torch.nn.Module):
+        out.setdefault(id(value), value)
+        return out
+    if isinstance(value, dict):
+        for v in value.values():
+            _collect_modules(v, out)
+        return out
+    components = getattr(value, 'components', None)
+    if isinstance(components, dict):
+        for v in components.values():
+            if isinstance(v, torch.nn.Module):
+                out.setdefault(id(v), v)
+        return out
+    for v in getattr(value, '__dict__', {}).values():
+        if isinstance(v, torch.nn.Module):
+            out.setdefault(id(v), v)
+    return out
+
+
+def module_bytes(module, device_type: str):
+    """(bytes on `device_type`, bytes elsewhere) of a module's parameters + buffers."""
+    on_device, elsewhere, seen = 0, 0, set()
+    for t in list(module.parameters()) + list(module.buffers()):
+        ptr = t.data_ptr()
+        if ptr in seen:
+            continue
+        seen.add(ptr)
+        n = t.numel() * t.element_size()
+        if t.device.type == device_type:
+            on_device += n
+        else:
+            elsewhere += n
+    return on_device, elsewhere
+
+
+def _to_host(module):
+    """Move a module's parameters / buffers from the GPU into pinned host RAM."""
+    import torch
+
+    def fn(t):
+        if t.device.type == 'cpu':
+            return t
+        host = torch.empty(t.size(), dtype=t.dtype, device='cpu', pin_memory=True)
+        host.copy_(t, non_blocking=True)
+        return host
+
+    module._apply(fn)
+
+
+def _to_device(module, device_type: str):
+    # Pinned source → asynchronous host-to-device copies; caller synchronizes.
+    module._apply(lambda t: t if t.device.type == device_type else t.to(device_type, non_blocking=True))
+
+
+def _synchronize():
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+class _Entry:
+    __slots__ = ('cache', 'key', 'value', 'depends_on', 'modules', 'sizes', 'epoch')
+
+    def __init__(self, cache, key, value, depends_on):
+        self.cache = cache
+        self.key = key
+        self.value = value
+        self.depends_on = tuple(depends_on)
+        self.modules = {}
+        self.sizes = {}  # id(module) -> (device_bytes, other_bytes)
+        self.epoch = 0
+
+
+class VramManager:
+    """Shared LRU + byte accounting across several `ManagedCache`s."""
+
+    def __init__(self, budget_bytes='auto', host_budget_bytes='auto'):
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # (cache_name, key) -> _Entry, LRU first
+        self._staged = OrderedDict()   # (cache_name, key) -> _Entry in host RAM, LRU first
+        self._caches = {}
+        self._epoch = 0
+        self._budget = budget_bytes
+        self._host_budget = host_budget_bytes
+        self._device_type = None
+        self._last_sizes = {}  # ref -> device bytes when last evicted
+
+    # ── configuration ─────────────────────────────────────────────────────
+    @property
+    def device_type(self) -> str:
+        if self._device_type is None:
+            self._device_type = 'cuda' if _cuda_available() else 'cpu'
+        return self._device_type
+
+    @property
+    def budget_bytes(self):
+        if self._budget == 'auto':
+            self._budget = _default_budget_bytes()
+        return self._budget
+
+    @property
+    def host_budget_bytes(self) -> int:
+        if self._host_budget == 'auto':
+            self._host_budget = _default_host_budget_bytes()
+        if self.device_type != 'cuda':
+            return 0  # without a GPU everything already lives in host RAM
+        return self._host_budget or 0
+
+    def cache(self, name: str, on_evict=None) -> 'ManagedCache':
+        c = ManagedCache(name, self, on_evict)
+        self._caches[name] = c
+        return c
+
+    def begin_job(self, *_):
+        """Start a new protection epoch — call before each GPU job runs."""
+        with self._lock:
+            self._epoch += 1
+
+    # ── accounting ────────────────────────────────────────────────────────
+    def _measure(self, entry: _Entry):
+        entry.modules = _collect_modules(entry.value)
+        entry.sizes = {mid: module_bytes(m, self.device_type) for mid, m in entry.modules.items()}
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            sizes = {}
+            for entry in self._entries.values():
+                sizes.update(entry.sizes)
+            return sum(s[0] for s in sizes.values())
+
+    def own_bytes(self, ref) -> int:
+        """Device bytes that would be freed by evicting `ref` (and its dependents)."""
+        with self._lock:
+            doomed = self._dependents_closure(ref)
+            kept = set()
+            for r, entry in self._entries.items():
+                if r not in doomed:
+                    kept.update(entry.sizes)
+            freed = {}
+            for r in doomed:
+                for mid, s in self._entries[r].sizes.items():
+                    if mid not in kept:
+                        freed[mid] = s[0]
+            return sum(freed.values())
+
+    def host_bytes(self) -> int:
+        """Host RAM held by the modules of staged entries."""
+        with self._lock:
+            modules = {}
+            for entry in self._staged.values():
+                modules.update(entry.modules)
+            return sum(module_bytes(m, 'cpu')[0] for m in modules.values())
+
+    def estimate(self, ref, default_bytes: int) -> int:
+        """Size to reserve before (re)loading `ref`: last measured, else `default_bytes`."""
+        with self._lock:
+            return self._last_sizes.get(ref, default_bytes)
+
+    def _dependents_closure(self, ref) -> list:
+        # Caller holds the lock. `ref` first, then everything depending on it.
+        order, stack = [], [ref]
+        while stack:
+            r = stack.pop()
+            if r in order or r not in self._entries:
+                continue
+            order.append(r)
+            stack.extend(o for o, e in self._entries.items() if r in e.depends_on)
+        return order
+
+    # ── entry lifecycle (called by ManagedCache) ──────────────────────────
+    def _add(self, cache: 'ManagedCache', key, value, depends_on=()):
+        ref = (cache.name, key)
+        with self._lock:
+            if ref in self._entries:
+                self._remove(ref, evicted=False)
+            if ref in self._staged:
+                self._drop_staged(ref)
+            entry = _Entry(cache, key, value, depends_on)
+            entry.epoch = self._epoch
+            self._measure(entry)
+            self._entries[ref] = entry
+            cache._data[key] = value
+            for dep in entry.depends_on:
+                self._touch(dep)
+            self.make_room(0)
+
+    def _touch(self, ref):
+        entry = self._entries.get(ref)
+        if entry is not None:
+            entry.epoch = self._epoch
+            self._entries.move_to_end(ref)
+
+    def _remove(self, ref, evicted: bool, stage: bool = False):
+        # Caller holds the lock. Removes `ref` + dependents; returns removed refs.
+        # With `stage`, they go to the host tier when it has room.
+        removed = []
+        for r in reversed(self._dependents_closure(ref)):
+            entry = self._entries.pop(r)
+            entry.cache._data.pop(entry.key, None)
+            removed.append(r)
+            self._last_sizes[r] = sum(s[0] for s in entry.sizes.values())
+            mb = self._last_sizes[r] / 1024 ** 2
+            if stage and self._can_stage(entry):
+                self._staged[r] = entry
+                print(f"📦 Staging {entry.cache.name}[{entry.key!r}] to host RAM (~{mb:.0f} MB incl. shared)")
+                continue
+            self._call_on_evict(r, entry)
+            # Staged entries built on it can't come back without it.
+            for other in [o for o, e in self._staged.items() if r in e.depends_on]:
+                self._drop_staged(other)
+            if evicted:
+                print(f"♻️  Evicted {entry.cache.name}[{entry.key!r}] (~{mb:.0f} MB incl. shared)")
+        if removed:
+            self._offload_staged()
+        return removed
+
+    def _call_on_evict(self, ref, entry: _Entry):
+        if entry.cache.on_evict is not None:
+            try:
+                entry.cache.on_evict(entry.key, entry.value)
+            except Exception as e:
+                print(f"⚠️  on_evict hook failed for {ref}: {e}")
+
+    def evict(self, ref, free_memory: bool = True, drop: bool = False) -> list:
+        """Evict `ref` + dependents — to the host tier, or for good with `drop`."""
+        with self._lock:
+            if ref in self._staged and drop:
+                self._drop_staged(ref)
+            if ref not in self._entries:
+                return []
+            removed = self._remove(ref, evicted=True, stage=not drop)
+        if free_memory:
+            free_cached_memory()
+        return removed
+
+    # ── host tier ─────────────────────────────────────────────────────────
+    def _can_stage(self, entry: _Entry) -> bool:
+        # Caller holds the lock.
+        if not self.host_budget_bytes:
+            return False
+        if any(hasattr(m, '_hf_hook') for m in entry.modules.values()):
+            return False  # accelerate CPU offload manages placement itself
+        return all(dep in self._entries or dep in self._staged for dep in entry.depends_on)
+
+    def _offload_staged(self):
+        # Caller holds the lock. Staged entries must not pin device memory:
+        # every module no resident entry uses goes to host RAM, or the staged
+        # entry holding it is dropped (host budget exceeded / copy failed).
+        kept = set()
+        for entry in self._entries.values():
+            kept.update(entry.modules)
+        budget = self.host_budget_bytes
+        for ref, entry in list(self._staged.items()):
+            if ref not in self._staged:
+                continue
+            moving = [m for mid, m in entry.modules.items()
+                      if mid not in kept and module_bytes(m, self.device_type)[0]]
+            if not moving:
+                continue
+            needed = sum(module_bytes(m, self.device_type)[0] for m in moving)
+            if needed <= budget:
+                self._trim_host(budget - needed)
+            if ref not in self._staged or needed > budget:
+                self._drop_staged(ref)
+                continue
+            try:
+                for module in moving:
+                    _to_host(module)
+                _synchronize()
+            except Exception as e:
+                print(f"⚠️  Host RAM staging failed for {ref}: {e}")
+                self._drop_staged(ref)
+
+    def _trim_host(self, limit: int):
+        # Caller holds the lock. Drop LRU staged entries until host use <= limit.
+        while self._staged and self.host_bytes() > limit:
+            self._drop_staged(next(iter(self._staged)))
+
+    def _drop_staged(self, ref):
+        # Caller holds the lock. Drops `ref` and staged entries built on it.
+        order, stack = [], [ref]
+        while stack:
+            r = stack.pop()
+            if r in order or r not in self._staged:
+                continue
+            order.append(r)
+            stack.extend(o for o, e in self._staged.items() if r in e.depends_on)
+        for r in reversed(order):
+            entry = self._staged.pop(r)
+            self._call_on_evict(r, entry)
+            print(f"♻️  Dropped {entry.cache.name}[{entry.key!r}] from host RAM")
+
+    def _restore(self, ref) -> bool:
+        # Caller holds the lock. Moves a staged entry (and the staged entries
+        # it depends on) back to the device; False if that failed.
+        entry = self._staged.get(ref)
+        if entry is None:
+            return False
+        for dep in entry.depends_on:
+            if dep in self._staged and not self._restore(dep):
+                self._drop_staged(ref)
+                return False
+        del self._staged[ref]
+        t0 = time.perf_counter()
+        # Only what is actually in host RAM comes in — shared modules may be resident.
+        self.make_room(sum(module_bytes(m, self.device_type)[1] for m in entry.modules.values()))
+        try:
+            try:
+                for module in entry.modules.values():
+                    _to_device(module, self.device_type)
+                _synchronize()
+            except Exception as e:
+                if 'out of memory' not in str(e).lower():
+                    raise
+                self.evict_unused()
+                for module in entry.modules.values():
+                    _to_device(module, self.device_type)
+                _synchronize()
+        except Exception as e:
+            print(f"⚠️  Restoring {ref} from host RAM failed, dropping it: {e}")
+            self._staged[ref] = entry
+            self._drop_staged(ref)
+            self._offload_staged()
+            return False
+        entry.epoch = self._epoch
+        self._measure(entry)
+        self._entries[ref] = entry
+        entry.cache._data[entry.key] = entry.value
+        mb = sum(s[0] for s in entry.sizes.values()) / 1024 ** 2
+        print(f"⚡ Restored {entry.cache.name}[{entry.key!r}] from host RAM "
+              f"(~{mb:.0f} MB, {(time.perf_counter() - t0) * 1000:.0f} ms)")
+        return True
+
+    def drop_host_tier(self) -> list:
+        """Drop every staged entry for good; returns their refs."""
+        with self._lock:
+            refs = list(self._staged)
+            for ref in refs:
+                self._drop_staged(ref)
+        gc.collect()
+        return refs
+
+    # ── budget enforcement ────────────────────────────────────────────────
+    def make_room(self, incoming_bytes: int = 0) -> bool:
+        """Evict LRU entries until `incoming_bytes` more would fit the budget.
+
+        Entries used by the current job are skipped. Returns False if the
+        budget still cannot be met (the caller may hit an OOM then).
+        """
+        budget = self.budget_bytes
+        if budget is None:
+            return True
+        evicted_any = False
+        with self._lock:
+            while self.resident_bytes() + incoming_bytes > budget:
+                victim = next(
+                    (r for r, e in self._entries.items() if e.epoch != self._epoch),
+                    None,
+                )
+                if victim is None:
+                    break
+                self._remove(victim, evicted=True, stage=True)
+                evicted_any = True
+            fits = self.resident_bytes() + incoming_bytes <= budget
+        if evicted_any:
+            free_cached_memory()
+        if not fits:
+            print(f"⚠️  VRAM budget {budget / 1024 ** 2:.0f} MB exceeded by entries in use "
+                  f"(resident {self.resident_bytes() / 1024 ** 2:.0f} MB + "
+                  f"{incoming_bytes / 1024 ** 2:.0f} MB incoming)")
+        return fits
+
+    def evict_unused(self) -> list:
+        """Evict every entry not used by the current job (OOM recovery)."""
+        removed = []
+        with self._lock:
+            for ref in [r for r, e in self._entries.items() if e.epoch != self._epoch]:
+                if ref in self._entries:
+                    removed.extend(self._remove(ref, evicted=True, stage=True))
+        free_cached_memory()
+        return removed
+
+    def report(self) -> dict:
+        with self._lock:
+            budget = self.budget_bytes
+            return {
+                'budget_mb': round(budget / 1024 ** 2, 1) if budget is not None else None,
+                'resident_mb': round(self.resident_bytes() / 1024 ** 2, 1),
+                'entries': [
+                    {
+                        'cache': e.cache.name,
+                        'key': e.key,
+                        'mb': round(sum(s[0] for s in e.sizes.values()) / 1024 ** 2, 1),
+                        'own_mb': round(self.own_bytes(r) / 1024 ** 2, 1),
+                    }
+                    for r, e in self._entries.items()
+                ],
+                'host_budget_mb': round(self.host_budget_bytes / 1024 ** 2, 1),
+                'host_mb': round(self.host_bytes() / 1024 ** 2, 1),
+                'staged': [{'cache': e.cache.name, 'key': e.key} for e in self._staged.values()],
+            }
+
+
+class ManagedCache(MutableMapping):
+    """dict-like view over one family of cached components.
+
+    Reads (`cache[key]`) count as use for the LRU order; `in` / iteration do
+    not. `put(key, value, depends_on=[(cache_name, key), ...])` records the
+    entries this one was built from.
+
+    Entries parked in the host tier are not iterated, but `key in cache` and
+    `cache[key]` move them back to the device first (`in` is False only if
+    that fails — the caller then loads the entry again).
+    """
+
+    def __init__(self, name: str, manager: VramManager, on_evict=None):
+        self.name = name
+        self.manager = manager
+        self.on_evict = on_evict
+        self._data = {}
+
+    def put(self, key, value, depends_on=()):
+        self.manager._add(self, key, value, depends_on)
+
+    def evict(self, key, free_memory: bool = True, drop: bool = False) -> list:
+        return self.manager.evict((self.name, key), free_memory=free_memory, drop=drop)
+
+    def _restore(self, key) -> bool:
+        # Caller holds the manager lock.
+        return key in self._data or self.manager._restore((self.name, key))
+
+    def __getitem__(self, key):
+        with self.manager._lock:
+            self._restore(key)
+            value = self._data[key]
+            self.manager._touch((self.name, key))
+            return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        # Resident entries go to the host tier; one already staged is dropped
+        # for good — otherwise the next `key in cache` would restore it.
+        with self.manager._lock:
+            resident = key in self._data
+            if not resident and (self.name, key) not in self.manager._staged:
+                raise KeyError(key)
+        self.evict(key, free_memory=False, drop=not resident)
+
+    def __contains__(self, key):
+        with self.manager._lock:
+            return self._restore(key)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+def free_cached_memory():
+    """Run the GC and hand cached CUDA blocks back to the driver."""
+    gc.collect()
+    import torch
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,167 @@
+"""Content-addressed cache of seeded generation results + single-flight.
+
+With an explicit `seed`, a /generate, /generate-with-controlnet or
+/generate-with-adapter request is fully determined by its parameters, its
+input images and the server-side state it resolves (checkpoint, LoRA file,
+fast decode, ...). `ResultCache.key` hashes all of that into one key:
+
+  • request fields as canonical JSON (sorted keys, defaults left out),
+    without the output encoding fields — a PNG and a WebP of the same
+    result share one entry,
+  • image fields by the hash of their decoded bytes (base64 string, data URL
+    and raw bytes of the same file give the same key; PIL images by pixels),
+  • the `context` dict from the caller (see `app._result_cache_context`),
+  • `RESULT_CACHE_VERSION` — bump it when a code change alters what a
+    request produces.
+
+Results (payload dicts with PIL images) live in a `SpillCache`: RAM tier
+plus a size-capped directory of pickles with the images stored as PNG.
+
+`single_flight` makes identical requests that are in flight at the same time
+share one queued job instead of computing the result twice. Each caller gets
+its own handle on it (`GpuJobQueue.subscribe`), so one caller cancelling or
+asking for a different output encoding doesn't affect the others.
+"""
+
+import io
+import json
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from caches import SpillCache, content_hash
+from image_transport import image_bytes
+
+RESULT_CACHE_VERSION = 1
+
+# Fields that only change how the result is encoded, not the result itself.
+OUTPUT_FIELDS = ('response_format', 'output_format', 'output_quality', 'png_compress_level')
+
+
+def _image_key(value) -> str:
+    if isinstance(value, Image.Image):
+        return 'pixels:' + content_hash(value)
+    try:
+        return 'bytes:' + content_hash(image_bytes(value))
+    except (TypeError, ValueError):
+        return 'value:' + content_hash(value)
+
+
+def _to_disk(value):
+    """Copy of a payload with PIL images replaced by PNG bytes (picklable, small)."""
+    if isinstance(value, Image.Image):
+        buf = io.BytesIO()
+        value.save(buf, format='PNG', compress_level=1)
+        return {'__png__': buf.getvalue()}
+    if isinstance(value, dict):
+        return {k: _to_disk(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_disk(v) for v in value]
+    return value
+
+
+def _from_disk(value):
+    if isinstance(value, dict):
+        if set(value) == {'__png__'}:
+            with Image.open(io.BytesIO(value['__png__'])) as img:
+                img.load()
+                return img
+        return {k: _from_disk(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_disk(v) for v in value]
+    return value
+
+
+def _dump(payload, path):
+    with open(path, 'wb') as f:
+        pickle.dump(_to_disk(payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return _from_disk(pickle.load(f))
+
+
+class ResultCache:
+    """Seeded results by content key (RAM + disk) and the jobs computing them.
+
+    With `max_bytes=0` and `max_disk_bytes=0` nothing is stored, but identical
+    in-flight requests are still coalesced.
+    """
+
+    def __init__(self, max_bytes: int, directory: str, max_disk_bytes: int):
+        self.enabled = max_bytes > 0 or max_disk_bytes > 0
+        self.store = SpillCache(
+            max_bytes=max_bytes,
+            directory=directory,
+            max_disk_bytes=max_disk_bytes,
+            dump=_dump,
+            load=_load,
+            suffix='.pkl',
+            name='result',
+        )
+        self._inflight = {}  # key -> Job
+        self._lock = threading.Lock()
+        # Stores (and the disk spills they trigger) run here, not on the GPU worker.
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='result-cache')
+        self.coalesced = 0
+
+    def key(self, endpoint: str, data: dict, image_fields, context: dict) -> str:
+        """Content key of a request (`image_fields` = names holding images)."""
+        fields = {}
+        for name, value in data.items():
+            if name in OUTPUT_FIELDS or value is None:
+                continue
+            fields[name] = _image_key(value) if name in image_fields else value
+        canonical = json.dumps(
+            {'version': RESULT_CACHE_VERSION, 'endpoint': endpoint, 'data': fields, 'context': context},
+            sort_keys=True, separators=(',', ':'), default=repr,
+        )
+        return content_hash(canonical)
+
+    def get(self, key):
+        """Cached payload of a successful run, or None."""
+        if not self.enabled:
+            return None
+        return self.store.get(key)
+
+    def single_flight(self, key: str, start, subscribe):
+        """Handle (`subscribe(job)`) on the job already computing `key`, else on
+        `start()` — a new job whose successful result is stored once it
+        finishes. A finished job stays registered until its result is in the
+        store, so no request slips through between the two."""
+        with self._lock:
+            job = self._inflight.get(key)
+            handle = subscribe(job) if job is not None else None
+            if handle is not None:
+                self.coalesced += 1
+                return handle
+            job = self._inflight[key] = start()
+            handle = subscribe(job)
+        job.add_done_callback(lambda done: self._finished(key, done))
+        return handle
+
+    def _finished(self, key: str, job):
+        payload, status = job.result
+        if self.enabled and status == 200 and job.status == 'done':
+            self._writer.submit(self._store, key, job, payload)
+        else:
+            self._forget(key, job)
+
+    def _store(self, key: str, job, payload):
+        try:
+            self.store.put(key, payload)
+        finally:
+            self._forget(key, job)
+
+    def _forget(self, key: str, job):
+        with self._lock:
+            if self._inflight.get(key) is job:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            inflight = len(self._inflight)
+        return {**self.store.stats(), 'enabled': self.enabled, 'inflight': inflight, 'coalesced': self.coalesced}
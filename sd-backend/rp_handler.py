@@ -1,9 +1,11 @@
 """RunPod Serverless handler for the Stable Diffusion backend.
 
-Strategy: keep the Flask app (`app.py`) untouched and dispatch incoming
-serverless jobs to its routes via Flask's built-in test client. That way both
-deployment modes (local Flask, RunPod Serverless) run the exact same code
-paths — no logic duplication, no risk of drift.
+Strategy: generation endpoints are called in-process through `app.service`
+(service.py) — the same typed requests and job functions the Flask routes
+use, minus the HTTP layer: no WSGI environ, no JSON re-parse of the response,
+images encoded once. Both deployment modes (local Flask, RunPod Serverless)
+still run the exact same job code. Anything not registered on the service
+(`/health`, `/list-*`, ...) goes through Flask's test client as before.
 
 Input format (what the frontend POSTs to /v2/{endpoint_id}/runsync):
 
@@ -14,35 +16,65 @@ Input format (what the frontend POSTs to /v2/{endpoint_id}/runsync):
       }
     }
 
+Several jobs in one input (max RUNPOD_MAX_JOBS):
+
+    { "input": { "jobs": [ { "endpoint": "/generate", "data": {...} }, ... ] } }
+
 Output format:
 
-    On success → whatever JSON the Flask route returned (passes through).
+    On success → the same JSON the Flask route returns (images as data URLs).
     On error   → {"error": "<message>", "status": <http_status>}.
+    Job list   → {"results": [<one of the above per job, in order>]}.
+
+Concurrency: the handler is async and `concurrency_modifier` lets one worker
+take up to RUNPOD_CONCURRENCY jobs at once. The GPU still runs one job at a
+time — concurrent jobs (and the jobs of a list, all queued before any is
+awaited) meet in the GPU queue, which merges compatible txt2img /generate
+requests into one pipeline call. While the local queue is backed up the
+worker asks for one job at a time, so RunPod routes the rest elsewhere.
 
 Health check pattern (RunPod cold-start ping): if `input.endpoint == "/health"`
 or `input` is empty/missing the handler returns immediately without touching
 the model code.
 """
 
+import asyncio
 import os
 import sys
 import traceback
 
 import runpod
-
-# Importing app.py loads diffusers / torch / etc. eagerly. We do it at module
-# scope so the FIRST request after a worker cold-start absorbs the import time
-# (~5–10 s) instead of the user's request. RunPod will hold the worker warm
-# for `idleTimeout` seconds after that, so subsequent requests are fast.
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+
+# Importing app.py is cheap: torch / diffusers are imported lazily on first
+# use (see lazy_imports.py, budget checked by bench_import.py).
+#
+# Warm start — when something is preloaded, "ready only after warm-up" wins
+# over "ping answers in milliseconds": the worker runs the preload + warm-up
+# BEFORE runpod.serverless.start (see __main__), so RunPod hands it no job
+# (pings included) until the models are warm. Without PRELOAD_* the only
+# warm-up is the heavy imports; that job is queued here in the background and
+# pings answer right after start — requests arriving meanwhile wait behind it.
 print("[rp_handler] importing Flask app...", flush=True)
-from app import app  # noqa: E402
+from app import app, gpu_queue, service, warm_start, warm_state  # noqa: E402
+from image_transport import encode_response  # noqa: E402
+
+PRELOAD = any(os.environ.get(name, "").strip()
+              for name in ("PRELOAD_MODELS", "PRELOAD_CONTROLNETS", "PRELOAD_PREPROCESSORS"))
+if not PRELOAD:
+    warm_start()
 
-# Flask test client lets us call routes in-process without spinning up a
-# real HTTP server. Faster, simpler, and avoids port-binding concerns inside
-# the serverless container.
+# Flask test client for the routes that are not service endpoints (GET
+# introspection routes) — in-process, no port binding inside the container.
 _client = app.test_client()
+_routes = app.url_map.bind("localhost")
 print("[rp_handler] Flask app ready.", flush=True)
 
+# Jobs one worker takes at once (see concurrency_modifier) and the longest
+# job list accepted in one input.
+RUNPOD_CONCURRENCY = int(os.environ.get("RUNPOD_CONCURRENCY", "4"))
+RUNPOD_MAX_JOBS = int(os.environ.get("RUNPOD_MAX_JOBS", "16"))
+
 
 def _normalise_endpoint(ep: str) -> str:
     """Accept both "/generate-with-controlnet" and "generate-with-controlnet"."""
@@ -51,45 +83,96 @@ def _normalise_endpoint(ep: str) -> str:
     return ep if ep.startswith("/") else "/" + ep
 
 
-def handler(event):
-    """Entry point invoked by runpod.serverless for every job."""
-    inp = (event or {}).get("input") or {}
+def _error(body, status: int) -> dict:
+    # Surface as an error object — RunPod treats non-200 returns from
+    # the handler as worker failures, which we don't want for client
+    # errors like missing prompt.
+    return {
+        "error": body.get("error") if isinstance(body, dict) else body,
+        "status": status,
+    }
 
-    # Empty input → treat as warm-up ping.
-    if not inp:
-        return {"status": "ok", "message": "warm"}
 
-    endpoint = _normalise_endpoint(inp.get("endpoint", "/generate"))
-    data = inp.get("data") or {}
+def _service_output(payload, status: int, data: dict) -> dict:
+    """Service result → handler output; images come back as data URLs."""
+    if status >= 400:
+        return _error(payload, status)
+    body, _ = encode_response(payload, status, dict(data, response_format="json"))
+    return body
+
 
+def _route_method(endpoint: str) -> str:
+    """POST, or GET for routes that don't accept POST."""
     try:
-        # Flask test client mirrors a real request. Methods other than POST
-        # are not used by our routes, so we hard-code POST except for /health.
-        if endpoint == "/health":
-            response = _client.get(endpoint)
-        else:
-            response = _client.post(endpoint, json=data)
-
-        status = response.status_code
-        # All our generate routes return JSON. If somehow they didn't, fall
-        # back to raw text so the user sees what the server actually said.
-        try:
-            body = response.get_json(force=False, silent=True)
-            if body is None:
-                body = {"raw": response.data.decode("utf-8", errors="replace")}
-        except Exception:
+        _routes.match(endpoint, method="POST")
+    except MethodNotAllowed:
+        return "GET"
+    except NotFound:
+        pass
+    return "POST"
+
+
+def _call_route(endpoint: str, data: dict) -> dict:
+    """Routes that are not service endpoints, through the Flask test client."""
+    # Flask test client mirrors a real request. GET-only routes (/health,
+    # /list-*) get a GET, everything else a POST with `data` as JSON body.
+    if _route_method(endpoint) == "GET":
+        response = _client.get(endpoint)
+    else:
+        response = _client.post(endpoint, json=data)
+
+    status = response.status_code
+    # All our generate routes return JSON. If somehow they didn't, fall
+    # back to raw text so the user sees what the server actually said.
+    try:
+        body = response.get_json(force=False, silent=True)
+        if body is None:
             body = {"raw": response.data.decode("utf-8", errors="replace")}
+    except Exception:
+        body = {"raw": response.data.decode("utf-8", errors="replace")}
+
+    if status >= 400:
+        return _error(body, status)
+
+    return body
+
+
+def _run_jobs(jobs) -> dict:
+    """A list of {endpoint, data} jobs; service jobs are queued together."""
+    if not isinstance(jobs, list) or not jobs:
+        return _error({"error": "'jobs' must be a non-empty list"}, 400)
+    if len(jobs) > RUNPOD_MAX_JOBS:
+        return _error({"error": f"Too many jobs ({len(jobs)}, max {RUNPOD_MAX_JOBS})"}, 400)
+    if not all(isinstance(job, dict) for job in jobs):
+        return _error({"error": "each job must be an object {endpoint, data}"}, 400)
+    items = [(_normalise_endpoint(job.get("endpoint", "/generate")), job.get("data") or {}) for job in jobs]
+    direct = [(i, item) for i, item in enumerate(items) if item[0] in service]
+    results = [None] * len(items)
+    for (index, (_, data)), (payload, status) in zip(direct, service.call_all([item for _, item in direct])):
+        results[index] = _service_output(payload, status, data)
+    for index, (endpoint, data) in enumerate(items):
+        if results[index] is None:
+            results[index] = _call_route(endpoint, data)
+    return {"results": results}
+
+
+def _handle(event) -> dict:
+    inp = (event or {}).get("input") or {}
+
+    # Empty input → treat as warm-up ping.
+    if not inp:
+        return {"status": "ok", "message": "warm", "ready": warm_state["ready"],
+                "warm_start": warm_state}
 
-        if status >= 400:
-            # Surface as an error object — RunPod treats non-200 returns from
-            # the handler as worker failures, which we don't want for client
-            # errors like missing prompt.
-            return {
-                "error": body.get("error") if isinstance(body, dict) else body,
-                "status": status,
-            }
+    try:
+        if "jobs" in inp:
+            return _run_jobs(inp["jobs"])
 
-        return body
+        endpoint = _normalise_endpoint(inp.get("endpoint", "/generate"))
+        data = inp.get("data") or {}
+        if endpoint in service:
+            return _service_output(*service.call(endpoint, data), data)
+        return _call_route(endpoint, data)
 
     except Exception as exc:
         # Any uncaught exception from the route — log full traceback so we
@@ -99,10 +182,29 @@ def handler(event):
         return {"error": str(exc), "status": 500}
 
 
+async def handler(event):
+    """Entry point invoked by runpod.serverless for every job.
+
+    Async so the worker can hold several jobs at once; the blocking work runs
+    in a thread and waits on the GPU queue.
+    """
+    return await asyncio.to_thread(_handle, event)
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """How many jobs this worker takes at once (polled by the RunPod SDK)."""
+    if gpu_queue.stats()["pending"] >= gpu_queue.max_pending // 2:
+        return 1  # backed up locally — let other workers take new jobs
+    return max(1, RUNPOD_CONCURRENCY)
+
+
 if __name__ == "__main__":
     print(
         f"[rp_handler] starting RunPod serverless worker "
         f"(HF_HOME={os.environ.get('HF_HOME', '<unset>')})",
         flush=True,
     )
-    runpod.serverless.start({"handler": handler})
+    if PRELOAD:
+        print("[rp_handler] warm start (PRELOAD_*) before taking jobs...", flush=True)
+        warm_start(wait=True)
+    runpod.serverless.start({"handler": handler, "concurrency_modifier": concurrency_modifier})
@@ -0,0 +1,410 @@
+"""In-process generation API shared by the Flask routes and the RunPod handler.
+
+Each endpoint is a typed request dataclass plus the job function that
+serves it (registered by `app.py`). Callers build a request — from a decoded
+body with `GenerationService.request(endpoint, data)`, or directly:
+
+    payload, status = service.run(GenerateRequest(prompt='a red car', model='sdxl'))
+
+GPU endpoints run on the `GpuJobQueue` worker (micro-batching, progress and
+cancellation as before), CPU endpoints in the calling thread. Results are
+`(payload, status)` with PIL images still inside the payload — encoding is
+up to the caller (`image_transport.encode_response` for HTTP, one JSON
+encode in `rp_handler`), so serverless jobs skip the WSGI round trip.
+
+Request fields left at None take the endpoint's own default (several depend
+on the model). Unknown fields of a decoded body are kept in `extra` and
+passed through to the job unchanged.
+
+Endpoints registered with `cacheable=True` go through the `ResultCache`
+(result_cache.py) when the request carries an explicit `seed`: a repeated
+request is answered from the cache as an already finished job, and an
+identical one still in flight is shared instead of queued again (each caller
+holds its own `JobHandle`, with its own output encoding and cancellation).
+"""
+
+import dataclasses
+import json
+import typing
+from dataclasses import dataclass, field
+from typing import Any, ClassVar, Optional, Union
+
+from PIL import Image
+
+from gpu_queue import QueueFull
+
+# base64 / data URL string, raw bytes, or an already decoded image
+ImageInput = Union[str, bytes, Image.Image]
+
+
+def _field_type(annotation):
+    """Type a field is coerced to (None = leave the value as is)."""
+    if typing.get_origin(annotation) is Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        annotation = args[0] if len(args) == 1 else None
+    return annotation if annotation in (bool, int, float, str, list, dict) else None
+
+
+def _image_fields(request_cls) -> frozenset:
+    """Names of the fields of `request_cls` that hold images."""
+    return frozenset(f.name for f in dataclasses.fields(request_cls) if f.type == Optional[ImageInput])
+
+
+def _coerce(name: str, value, kind):
+    if value is None or kind is None:
+        return value
+    try:
+        if kind is bool:
+            if isinstance(value, str):
+                lowered = value.strip().lower()
+                if lowered in ('1', 'true', 'yes', 'on'):
+                    return True
+                if lowered in ('0', 'false', 'no', 'off', ''):
+                    return False
+                raise ValueError(value)
+            return bool(value)
+        if kind is int:
+            if isinstance(value, bool):
+                raise ValueError(value)
+            return int(float(value)) if isinstance(value, str) else int(value)
+        if kind is float:
+            return float(value)
+        if kind in (list, dict):
+            # Multipart / query fields arrive as strings — JSON for lists and objects.
+            if not isinstance(value, str):
+                return value
+            decoded = json.loads(value)
+            if not isinstance(decoded, kind):
+                raise ValueError(value)
+            return decoded
+        return str(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be {kind.__name__}, got {value!r}") from None
+
+
+@dataclass
+class JobRequest:
+    """Fields every endpoint accepts: output encoding and TAESD fast decode."""
+
+    ENDPOINT: ClassVar[str] = ''
+
+    fast_decode: Optional[bool] = None
+    response_format: Optional[str] = None
+    output_format: Optional[str] = None
+    output_quality: Optional[int] = None
+    png_compress_level: Optional[int] = None
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'JobRequest':
+        """Request from a decoded body; raises ValueError for mistyped fields."""
+        if not isinstance(data, dict):
+            raise ValueError('request body must be a JSON object')
+        values, extra = {}, {}
+        fields = {f.name: f for f in dataclasses.fields(cls) if f.name != 'extra'}
+        for name, value in data.items():
+            if name in fields:
+                values[name] = _coerce(name, value, _field_type(fields[name].type))
+            else:
+                extra[name] = value
+        return cls(**values, extra=extra)
+
+    def as_data(self) -> dict:
+        """Body dict for the job function (fields left at None are omitted)."""
+        data = dict(self.extra)
+        for f in dataclasses.fields(self):
+            value = getattr(self, f.name)
+            if f.name != 'extra' and value is not None:
+                data[f.name] = value
+        return data
+
+
+@dataclass
+class GenerateRequest(JobRequest):
+    """/generate — txt2img, or img2img with `input_image`."""
+
+    ENDPOINT: ClassVar[str] = '/generate'
+
+    prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    model: Optional[str] = None
+    input_image: Optional[ImageInput] = None
+    strength: Optional[float] = None
+    num_inference_steps: Optional[int] = None
+    guidance_scale: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    seed: Optional[int] = None
+    lora: Optional[str] = None
+    lora_scale: Optional[float] = None
+    noise_mask: Optional[ImageInput] = None
+    noise_mask_strength: Optional[float] = None
+    soft_edge: Optional[int] = None
+    target_color: Optional[str] = None
+    compiled: Optional[bool] = None
+
+
+@dataclass
+class AdapterRequest(JobRequest):
+    """/generate-with-adapter — T2I-Adapter conditioned on `image`."""
+
+    ENDPOINT: ClassVar[str] = '/generate-with-adapter'
+
+    prompt: Optional[str] = None
+    image: Optional[ImageInput] = None
+    adapter_image: Optional[ImageInput] = None
+    negative_prompt: Optional[str] = None
+    model: Optional[str] = None
+    adapter: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    steps: Optional[int] = None
+    guidance_scale: Optional[float] = None
+    adapter_conditioning_scale: Optional[float] = None
+    adapter_conditioning_factor: Optional[float] = None
+    seed: Optional[int] = None
+    lora: Optional[str] = None
+    lora_scale: Optional[float] = None
+    return_control_image: Optional[bool] = None
+
+
+@dataclass
+class ControlNetRequest(JobRequest):
+    """/generate-with-controlnet — ControlNet (optionally two-pass / IP-Adapter style)."""
+
+    ENDPOINT: ClassVar[str] = '/generate-with-controlnet'
+
+    prompt: Optional[str] = None
+    image: Optional[ImageInput] = None
+    control_image: Optional[ImageInput] = None
+    style_image: Optional[ImageInput] = None
+    negative_prompt: Optional[str] = None
+    model: Optional[str] = None
+    controlnet: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    steps: Optional[int] = None
+    guidance_scale: Optional[float] = None
+    controlnet_conditioning_scale: Optional[float] = None
+    controlnet_guidance_start: Optional[float] = None
+    controlnet_guidance_end: Optional[float] = None
+    use_img2img: Optional[bool] = None
+    strength: Optional[float] = None
+    seed: Optional[int] = None
+    lora: Optional[str] = None
+    lora_scale: Optional[float] = None
+    noise_mask: Optional[ImageInput] = None
+    noise_mask_strength: Optional[float] = None
+    noise_mask_control_weaken: Optional[float] = None
+    style_scale: Optional[float] = None
+    transparent_background: Optional[bool] = None
+    two_pass: Optional[bool] = None
+    explore_model: Optional[str] = None
+    explore_steps: Optional[int] = None
+    explore_guidance: Optional[float] = None
+    explore_cn_end: Optional[float] = None
+    refine_strength: Optional[float] = None
+    refine_cn_scale: Optional[float] = None
+    refine_cn_end: Optional[float] = None
+    return_control_image: Optional[bool] = None
+
+
+@dataclass
+class CharacterRequest(JobRequest):
+    """/generate-character — batched views of one character."""
+
+    ENDPOINT: ClassVar[str] = '/generate-character'
+
+    prompt: Optional[str] = None
+    reference_image: Optional[ImageInput] = None
+    negative_prompt: Optional[str] = None
+    model: Optional[str] = None
+    views: Optional[list] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    seed: Optional[int] = None
+    lora: Optional[str] = None
+    lora_scale: Optional[float] = None
+
+
+@dataclass
+class ClearGpuRequest(JobRequest):
+    """/clear-gpu — drop cached pipelines (`keep` = model keys to keep)."""
+
+    ENDPOINT: ClassVar[str] = '/clear-gpu'
+
+    keep: Optional[list] = None
+    host: Optional[bool] = None
+
+
+@dataclass
+class RemoveBackgroundRequest(JobRequest):
+    """/remove-background — transparent black background."""
+
+    ENDPOINT: ClassVar[str] = '/remove-background'
+
+    image: Optional[ImageInput] = None
+    threshold: Optional[int] = None
+    soft_edge: Optional[int] = None
+
+
+@dataclass
+class AdjustHueRequest(JobRequest):
+    """/adjust-hue — hue shift in degrees."""
+
+    ENDPOINT: ClassVar[str] = '/adjust-hue'
+
+    image: Optional[ImageInput] = None
+    hue_shift: Optional[float] = None
+
+
+@dataclass
+class RecolorBatchRequest(JobRequest):
+    """/recolor-batch — several colour variants of one image."""
+
+    ENDPOINT: ClassVar[str] = '/recolor-batch'
+
+    image: Optional[ImageInput] = None
+    hue_shifts: Optional[list] = None
+    saturations: Optional[list] = None
+    tints: Optional[list] = None
+    tint_intensity: Optional[float] = None
+    variants: Optional[list] = None
+    atlas: Optional[bool] = None
+    atlas_columns: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class _Endpoint:
+    request_cls: type
+    fn: Any
+    gpu: bool
+    batcher: Any  # (batch_key_fn, batch_fn) | None
+    cacheable: bool = False
+    image_fields: frozenset = frozenset()
+
+
+class GenerationService:
+    """Registry of endpoints → job functions, run in-process.
+
+    `result_cache` (optional `ResultCache`) serves seeded requests of cacheable
+    endpoints; `cache_context(endpoint, data)` returns the server-side inputs
+    of such a request as a JSON-able dict, or None when it must not be cached.
+    """
+
+    def __init__(self, queue, result_cache=None, cache_context=None):
+        self.queue = queue
+        self.result_cache = result_cache
+        self.cache_context = cache_context or (lambda endpoint, data: {})
+        self._endpoints = {}
+
+    def register(self, request_cls, fn, gpu: bool = True, batcher=None, cacheable: bool = False):
+        """`fn(data) -> (payload, status)` serves `request_cls.ENDPOINT`.
+        `batcher` = (batch_key_fn, batch_fn) lets the queue merge requests;
+        `cacheable` = the result is determined by the request once it has a seed."""
+        self._endpoints[request_cls.ENDPOINT] = _Endpoint(
+            request_cls, fn, gpu, batcher, cacheable and gpu, _image_fields(request_cls),
+        )
+
+    def __contains__(self, endpoint) -> bool:
+        return endpoint in self._endpoints
+
+    def endpoints(self, gpu=None) -> list:
+        return sorted(name for name, ep in self._endpoints.items() if gpu is None or ep.gpu == gpu)
+
+    def request(self, endpoint: str, data) -> JobRequest:
+        """Typed request for `endpoint` from a body dict (ValueError if invalid)."""
+        if endpoint not in self._endpoints:
+            raise KeyError(f"Unknown endpoint '{endpoint}'. Available: {self.endpoints()}")
+        request_cls = self._endpoints[endpoint].request_cls
+        if isinstance(data, request_cls):
+            return data
+        return request_cls.from_dict(data or {})
+
+    def submit(self, request: JobRequest):
+        """Queue a GPU request; returns the `Job` (raises QueueFull)."""
+        ep = self._endpoints[request.ENDPOINT]
+        if not ep.gpu:
+            raise ValueError(f"'{request.ENDPOINT}' does not run on the GPU queue")
+        data = request.as_data()
+        batch_key, batch_fn = None, None
+        if ep.batcher is not None:
+            key_fn, batch_fn = ep.batcher
+            batch_key = key_fn(data)
+
+        def start():
+            return self.queue.submit(request.ENDPOINT, ep.fn, data, batch_key=batch_key, batch_fn=batch_fn)
+
+        key = self._result_key(ep, request.ENDPOINT, data)
+        if key is None:
+            return start()
+        payload = self.result_cache.get(key)
+        if payload is not None:
+            return self.queue.add_finished(request.ENDPOINT, data, payload, 200)
+        return self.result_cache.single_flight(key, start, lambda job: self.queue.subscribe(job, data))
+
+    def _result_key(self, ep: _Endpoint, endpoint: str, data: dict):
+        """Result cache key of a request, or None if it isn't served from the cache."""
+        if self.result_cache is None or not ep.cacheable or data.get('seed') is None:
+            return None
+        context = self.cache_context(endpoint, data)
+        if context is None:
+            return None
+        return self.result_cache.key(endpoint, data, ep.image_fields, context)
+
+    def run(self, request: JobRequest):
+        """Run `request` to completion; returns `(payload, status)`."""
+        ep = self._endpoints[request.ENDPOINT]
+        if not ep.gpu:
+            return ep.fn(request.as_data())
+        job = self.submit(request)
+        job.wait()
+        return job.result
+
+    def _unknown(self, endpoint: str):
+        return {'error': f"Unknown endpoint '{endpoint}'. Available: {self.endpoints()}"}, 404
+
+    def call(self, endpoint: str, data):
+        """`run` for a body dict, with request errors as (payload, status)."""
+        if endpoint not in self._endpoints:
+            return self._unknown(endpoint)
+        try:
+            request = self.request(endpoint, data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        try:
+            return self.run(request)
+        except QueueFull as e:
+            return {'error': str(e)}, 503
+
+    def call_all(self, items) -> list:
+        """`call` for several (endpoint, data) pairs; results in the same order.
+
+        Every GPU request is queued before waiting on any, so compatible ones
+        (e.g. txt2img /generate with the same model and size) are merged by
+        the queue into one pipeline call. CPU requests run meanwhile.
+        """
+        results = [None] * len(items)
+        cpu, jobs = [], []
+        for index, (endpoint, data) in enumerate(items):
+            if endpoint not in self._endpoints:
+                results[index] = self._unknown(endpoint)
+                continue
+            try:
+                request = self.request(endpoint, data)
+            except ValueError as e:
+                results[index] = {'error': str(e)}, 400
+                continue
+            if not self._endpoints[endpoint].gpu:
+                cpu.append((index, request))
+                continue
+            try:
+                jobs.append((index, self.submit(request)))
+            except QueueFull as e:
+                results[index] = {'error': str(e)}, 503
+        for index, request in cpu:
+            results[index] = self.run(request)
+        for index, job in jobs:
+            job.wait()
+            results[index] = job.result
+        return results
@@ -0,0 +1,126 @@
+"""LRUCache / SpillCache bounds and disk-tier pruning."""
+
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from caches import LRUCache, SpillCache, content_hash, nbytes
+
+
+def _dump(value, path):
+    with open(path, 'wb') as f:
+        f.write(value)
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _spill_cache(tmp_path, max_disk_bytes=16):
+    # RAM holds one 8-byte value — every put spills the previous one to disk.
+    return SpillCache(max_bytes=10, directory=str(tmp_path), max_disk_bytes=max_disk_bytes,
+                      dump=_dump, load=_load, name='test')
+
+
+def _age(cache, key, seconds):
+    t = time.time() - seconds
+    os.utime(cache._path(key), (t, t))
+
+
+def _on_disk(cache, key) -> bool:
+    return os.path.exists(cache._path(key))
+
+
+def test_lru_bounds_and_on_evict():
+    evicted = []
+    cache = LRUCache(max_bytes=20, on_evict=lambda k, v: evicted.append(k))
+    cache.put('a', b'x' * 8)
+    cache.put('b', b'x' * 8)
+    cache.get('a')
+    cache.put('c', b'x' * 8)
+    assert evicted == ['b']
+    cache.put('big', b'x' * 21)  # larger than the whole budget: not stored
+    assert 'big' not in cache and evicted == ['b', 'big']
+    items = LRUCache(max_items=2)
+    for key in 'abc':
+        items.put(key, 1)
+    assert 'a' not in items and len(items) == 2
+
+
+def test_spilled_entry_is_promoted_back(tmp_path):
+    cache = _spill_cache(tmp_path)
+    cache.put('a', b'A' * 8)
+    cache.put('b', b'B' * 8)
+    assert 'a' not in cache.memory and _on_disk(cache, 'a')
+    assert cache.get('a') == b'A' * 8
+    assert cache.disk_hits == 1
+    assert 'a' in cache.memory
+
+
+def test_disk_tier_prunes_oldest_first(tmp_path):
+    cache = _spill_cache(tmp_path, max_disk_bytes=16)
+    cache.put('a', b'A' * 8)
+    cache.put('b', b'B' * 8)     # a → disk
+    _age(cache, 'a', 300)
+    cache.put('c', b'C' * 8)     # b → disk (16 bytes, within the limit)
+    _age(cache, 'b', 200)
+    cache.put('d', b'D' * 8)     # c → disk, 24 bytes → the oldest (a) goes
+    assert not _on_disk(cache, 'a')
+    assert _on_disk(cache, 'b') and _on_disk(cache, 'c')
+    assert sum(e.stat().st_size for e in os.scandir(tmp_path)) <= 16
+    assert cache.get('a') is None
+
+
+def test_disk_hit_refreshes_the_file(tmp_path):
+    cache = _spill_cache(tmp_path, max_disk_bytes=16)
+    for key in 'abc':
+        cache.put(key, key.encode() * 8)  # a, b on disk; c in RAM
+    _age(cache, 'a', 300)
+    _age(cache, 'b', 200)
+    assert cache.get('a') == b'a' * 8  # a is the newest file now; c spills
+    assert _on_disk(cache, 'a') and _on_disk(cache, 'c')
+    assert not _on_disk(cache, 'b')
+
+
+def test_corrupt_file_is_dropped(tmp_path):
+    def broken_load(path):
+        raise ValueError('truncated')
+
+    cache = SpillCache(max_bytes=10, directory=str(tmp_path), max_disk_bytes=100,
+                       dump=_dump, load=broken_load, name='test')
+    cache.put('a', b'A' * 8)
+    cache.put('b', b'B' * 8)
+    assert _on_disk(cache, 'a')
+    assert cache.get('a', 'missing') == 'missing'
+    assert not _on_disk(cache, 'a')
+
+
+def test_without_disk_tier(tmp_path):
+    cache = SpillCache(max_bytes=10, directory=str(tmp_path / 'off'), max_disk_bytes=0,
+                       dump=_dump, load=_load, name='test')
+    cache.put('a', b'A' * 8)
+    cache.put('b', b'B' * 8)
+    assert cache.get('a') is None
+    assert not (tmp_path / 'off').exists()
+
+
+def test_clear_disk(tmp_path):
+    cache = _spill_cache(tmp_path, max_disk_bytes=100)
+    for key in 'abc':
+        cache.put(key, key.encode() * 8)
+    cache.clear(disk=True)
+    assert list(os.scandir(tmp_path)) == []
+    assert all(cache.get(key) is None for key in 'abc')
+
+
+def test_content_hash_and_nbytes():
+    image = Image.new('RGB', (4, 4), (1, 2, 3))
+    assert content_hash(image) == content_hash(image.copy())
+    assert content_hash(image) != content_hash(image.convert('RGBA'))
+    array = np.zeros((2, 8), dtype=np.uint8)
+    assert content_hash(array) != content_hash(array.reshape(4, 4))
+    assert content_hash('depth', 512) != content_hash('depth', '512')
+    assert nbytes({'a': array, 'b': [b'xy', image]}) == 16 + 2 + 48
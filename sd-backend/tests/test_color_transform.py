@@ -0,0 +1,78 @@
+"""Vectorized HSV transforms vs. per-pixel colorsys on Python floats."""
+
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bench_color import (colorsys_reference, original_path, ref_saturation,
+                         ref_shift_hue, ref_tint)
+from color_transform import HsvImage, adjust_saturation, apply_color_tint, shift_hue
+
+# Sivé, primárne, sekundárne a takmer sivé farby + hrany 0/255.
+SPECIAL = [
+    (0, 0, 0), (255, 255, 255), (1, 1, 1), (128, 128, 128), (254, 254, 254),
+    (255, 0, 0), (0, 255, 0), (0, 0, 255),
+    (0, 255, 255), (255, 0, 255), (255, 255, 0),
+    (128, 128, 129), (129, 128, 128), (128, 129, 128), (255, 255, 254), (0, 0, 1),
+    (255, 254, 253), (10, 200, 200), (200, 10, 200), (200, 200, 10),
+]
+
+CASES = [
+    ('shift_hue', lambda im: shift_hue(im, 37), ref_shift_hue(37)),
+    ('shift_hue_negative', lambda im: shift_hue(im, -150), ref_shift_hue(-150)),
+    ('shift_hue_full_turn', lambda im: shift_hue(im, 360), ref_shift_hue(360)),
+    ('saturation', lambda im: adjust_saturation(im, 1.4), ref_saturation(1.4)),
+    ('desaturate', lambda im: adjust_saturation(im, 0.0), ref_saturation(0.0)),
+    ('tint', lambda im: apply_color_tint(im, '#3366CC', 0.5), ref_tint('#3366CC', 0.5)),
+    ('tint_full', lambda im: apply_color_tint(im, 'FF0000', 1.0), ref_tint('FF0000', 1.0)),
+]
+
+
+def _image(mode):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (24, 24, 3), dtype=np.uint8).reshape(-1, 3)
+    pixels[:len(SPECIAL)] = SPECIAL
+    rgb = pixels.reshape(24, 24, 3)
+    if mode == 'RGB':
+        return Image.fromarray(rgb, 'RGB')
+    alpha = rng.integers(0, 256, (24, 24, 1), dtype=np.uint8)
+    return Image.fromarray(np.concatenate([rgb, alpha], axis=2), 'RGBA')
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('name,fast,ref', CASES, ids=[c[0] for c in CASES])
+def test_matches_colorsys(mode, name, fast, ref):
+    image = _image(mode)
+    result = fast(image)
+    assert result.mode == mode
+    assert np.array_equal(np.asarray(result), np.asarray(colorsys_reference(image, ref)))
+    if mode == 'RGBA':
+        assert np.array_equal(np.asarray(result.getchannel('A')), np.asarray(image.getchannel('A')))
+
+
+@pytest.mark.parametrize('name,fast,ref', CASES, ids=[c[0] for c in CASES])
+def test_within_one_of_original_float32_path(name, fast, ref):
+    image = _image('RGB')
+    diff = np.asarray(fast(image)).astype(np.int16) - np.asarray(original_path(image, ref))
+    assert np.abs(diff).max() <= 1
+
+
+def test_every_channel_order():
+    # Všetky poradia kanálov (r/g/b ako max, min aj zhody) pre každý sektor hue.
+    values = (0, 51, 128, 255)
+    pixels = np.array(list(itertools.product(values, repeat=3)), dtype=np.uint8)
+    image = Image.fromarray(pixels.reshape(1, -1, 3), 'RGB')
+    for shift in (0, 60, 120, 180, 240, 300, 359):
+        assert np.array_equal(np.asarray(shift_hue(image, shift)),
+                              np.asarray(colorsys_reference(image, ref_shift_hue(shift))))
+
+
+def test_variant_chain_matches_single_steps():
+    image = _image('RGBA')
+    hsv = HsvImage(image)
+    assert np.array_equal(np.asarray(hsv.variant(hue_shift=90)), np.asarray(shift_hue(image, 90)))
+    assert np.array_equal(np.asarray(hsv.variant(saturation=0.5)), np.asarray(adjust_saturation(image, 0.5)))
+    assert np.array_equal(np.asarray(hsv.variant(tint='#00FF00', intensity=0.3)),
+                          np.asarray(apply_color_tint(image, '#00FF00', 0.3)))
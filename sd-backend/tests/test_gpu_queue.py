@@ -0,0 +1,141 @@
+"""Micro-batching in GpuJobQueue (no GPU needed)."""
+
+import threading
+import time
+
+from gpu_queue import CANCELLED_RESULT, GpuJobQueue
+
+
+class Recorder:
+    """Job / batch functions that record what ran together."""
+
+    def __init__(self):
+        self.calls = []
+
+    def single(self, data):
+        self.calls.append([data['n']])
+        return {'n': data['n']}, 200
+
+    def batch(self, batch):
+        self.calls.append([data['n'] for data in batch])
+        return [({'n': data['n']}, 200) for data in batch]
+
+
+def _blocked_queue(**kwargs):
+    """Queue whose worker is busy until the returned event is set."""
+    queue = GpuJobQueue(**kwargs)
+    release, started = threading.Event(), threading.Event()
+
+    def block(_):
+        started.set()
+        release.wait(5)
+        return {}, 200
+
+    queue.submit('block', block, {})
+    assert started.wait(5)
+    return queue, release
+
+
+def _submit(queue, rec, n, key='512x512', kind='/generate'):
+    return queue.submit(kind, rec.single, {'n': n}, batch_key=key, batch_fn=rec.batch)
+
+
+def test_queued_compatible_jobs_run_as_one_batch():
+    queue, release = _blocked_queue(batch_window_ms=0, max_batch=4)
+    rec = Recorder()
+    jobs = [_submit(queue, rec, n) for n in range(3)]
+    release.set()
+    assert all(job.wait(5) for job in jobs)
+    assert rec.calls == [[0, 1, 2]]
+    assert [job.result for job in jobs] == [({'n': n}, 200) for n in range(3)]
+
+
+def test_max_batch_splits_the_queue():
+    queue, release = _blocked_queue(batch_window_ms=0, max_batch=2)
+    rec = Recorder()
+    jobs = [_submit(queue, rec, n) for n in range(5)]
+    release.set()
+    assert all(job.wait(5) for job in jobs)
+    assert rec.calls == [[0, 1], [2, 3], [4]]
+
+
+def test_only_same_key_and_kind_merge():
+    queue, release = _blocked_queue(batch_window_ms=0, max_batch=4)
+    rec = Recorder()
+    jobs = [
+        _submit(queue, rec, 0),
+        _submit(queue, rec, 1, key='768x768'),
+        _submit(queue, rec, 2),
+        _submit(queue, rec, 3, kind='/other'),
+        queue.submit('/generate', rec.single, {'n': 4}),  # no batch_fn → never merged
+    ]
+    release.set()
+    assert all(job.wait(5) for job in jobs)
+    assert rec.calls == [[0, 2], [1], [3], [4]]
+
+
+def test_window_waits_for_companions_on_an_idle_worker():
+    queue = GpuJobQueue(batch_window_ms=2000, max_batch=2)
+    rec = Recorder()
+    t0 = time.monotonic()
+    first = _submit(queue, rec, 0)
+    time.sleep(0.05)
+    second = _submit(queue, rec, 1)
+    assert first.wait(5) and second.wait(5)
+    assert rec.calls == [[0, 1]]
+    # A full batch starts at once — it does not sit out the rest of the window.
+    assert time.monotonic() - t0 < 1.5
+
+
+def test_window_expires_with_a_partial_batch():
+    queue = GpuJobQueue(batch_window_ms=50, max_batch=4)
+    rec = Recorder()
+    t0 = time.monotonic()
+    job = _submit(queue, rec, 0)
+    assert job.wait(5)
+    assert time.monotonic() - t0 >= 0.045
+    assert rec.calls == [[0]]
+
+
+def test_window_does_not_hold_up_unrelated_work():
+    queue = GpuJobQueue(batch_window_ms=5000, max_batch=4)
+    rec = Recorder()
+    with queue._cond:  # both queued before the worker looks at the first one
+        first = _submit(queue, rec, 0)
+        other = queue.submit('/remove-background', rec.single, {'n': 1})
+    t0 = time.monotonic()
+    assert first.wait(5) and other.wait(5)
+    assert time.monotonic() - t0 < 1.0
+    assert rec.calls == [[0], [1]]
+
+
+def test_zero_window_does_not_wait():
+    queue = GpuJobQueue(batch_window_ms=0, max_batch=4)
+    rec = Recorder()
+    t0 = time.monotonic()
+    assert _submit(queue, rec, 0).wait(5)
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_cancelled_member_of_a_batch():
+    queue, release = _blocked_queue(batch_window_ms=0, max_batch=4)
+    rec = Recorder()
+    jobs = [_submit(queue, rec, n) for n in range(3)]
+    assert queue.cancel(jobs[1])
+    assert jobs[1].result == CANCELLED_RESULT
+    release.set()
+    assert jobs[0].wait(5) and jobs[2].wait(5)
+    assert rec.calls == [[0, 2]]
+    assert jobs[0].status == jobs[2].status == 'done'
+
+
+def test_batch_fn_result_count_mismatch_fails_every_job():
+    queue, release = _blocked_queue(batch_window_ms=0, max_batch=4)
+    jobs = [
+        queue.submit('/generate', None, {'n': n}, batch_key='k', batch_fn=lambda batch: [({}, 200)])
+        for n in range(2)
+    ]
+    release.set()
+    assert all(job.wait(5) for job in jobs)
+    assert [job.status for job in jobs] == ['error', 'error']
+    assert all(job.result[1] == 500 for job in jobs)
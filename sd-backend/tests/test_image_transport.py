@@ -0,0 +1,177 @@
+"""Binary image transport: request parsing and response / output encoding."""
+
+import io
+import json
+
+import numpy as np
+import pytest
+from flask import Flask, request
+from PIL import Image
+
+from image_transport import (PNG_COMPRESS_LEVEL, encode_image, encode_response, open_image, output_options,
+                             parse_request, response_format)
+from service import GenerateRequest, RecolorBatchRequest
+
+app = Flask(__name__)
+
+
+def _png(color=(255, 0, 0)):
+    buf = io.BytesIO()
+    Image.new('RGB', (4, 4), color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _parse(image_field='image', **kwargs):
+    with app.test_request_context('/', method='POST', **kwargs):
+        return parse_request(request, image_field)
+
+
+def test_json_body_unchanged():
+    data = _parse(json={'prompt': 'cat', 'width': 512, 'image': 'data:image/png;base64,AAAA'})
+    assert data == {'prompt': 'cat', 'width': 512, 'image': 'data:image/png;base64,AAAA'}
+
+
+def test_multipart_fields_stay_strings():
+    data = _parse(data={
+        'prompt': '1e3', 'negative_prompt': 'null', 'lora': 'NaN', 'width': '512',
+        'image': (io.BytesIO(_png()), 'in.png'),
+    })
+    assert data['prompt'] == '1e3'
+    assert data['negative_prompt'] == 'null'
+    assert data['lora'] == 'NaN'
+    assert data['width'] == '512'
+    assert open_image(data['image']).getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_multipart_json_field_is_decoded():
+    data = _parse(data={
+        'json': json.dumps({'prompt': 'cat', 'width': 768, 'hue_shifts': [30, 60]}),
+        'image': (io.BytesIO(_png()), 'in.png'),
+    })
+    assert data['width'] == 768
+    assert data['hue_shifts'] == [30, 60]
+    assert isinstance(data['image'], bytes)
+
+
+def test_raw_image_body_with_query_params():
+    data = _parse('input_image', data=_png((0, 0, 255)), content_type='image/png',
+                  query_string={'prompt': 'true', 'strength': '0.5'})
+    assert data['prompt'] == 'true'
+    assert data['strength'] == '0.5'
+    assert open_image(data['input_image']).getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_typed_request_converts_form_strings_per_field():
+    data = _parse(data={'prompt': '1e3', 'negative_prompt': 'null', 'width': '512',
+                        'guidance_scale': '7.5', 'fast_decode': 'true'},
+                  content_type='multipart/form-data')
+    req = GenerateRequest.from_dict(data)
+    assert req.prompt == '1e3'
+    assert req.negative_prompt == 'null'
+    assert req.width == 512
+    assert req.guidance_scale == 7.5
+    assert req.fast_decode is True
+
+
+def test_typed_request_decodes_list_fields():
+    data = _parse(data={'hue_shifts': '[30, 60]', 'atlas': '1', 'image': (io.BytesIO(_png()), 'in.png')})
+    req = RecolorBatchRequest.from_dict(data)
+    assert req.hue_shifts == [30, 60]
+    assert req.atlas is True
+    with pytest.raises(ValueError):
+        RecolorBatchRequest.from_dict({'hue_shifts': '30'})
+
+
+# ── output encoding ────────────────────────────────────────────────────────
+
+def _noise(mode='RGB', size=(32, 24)):
+    bands = len(mode)
+    pixels = np.random.default_rng(0).integers(0, 256, (size[1], size[0], bands), dtype=np.uint8)
+    return Image.fromarray(pixels if bands > 1 else pixels[..., 0], mode)
+
+
+def test_output_options():
+    assert output_options({}) == {'format': 'png', 'compress_level': PNG_COMPRESS_LEVEL}
+    assert output_options({'output_format': 'JPG', 'output_quality': 500})['format'] == 'jpeg'
+    assert output_options({'output_format': 'jpeg', 'output_quality': 500})['quality'] == 100
+    assert output_options({'output_format': 'webp', 'output_quality': '0'})['quality'] == 1
+    assert output_options({'output_format': 'gif'})['format'] == 'png'
+    assert output_options({'png_compress_level': 42})['compress_level'] == 9
+
+
+@pytest.mark.parametrize('data', [{}, {'output_format': 'png', 'png_compress_level': 0},
+                                  {'output_format': 'webp'}])
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+def test_lossless_formats_round_trip(data, mode):
+    image = _noise(mode)
+    body, mimetype = encode_image(image, output_options(data))
+    assert mimetype == ('image/webp' if data.get('output_format') == 'webp' else 'image/png')
+    decoded = Image.open(io.BytesIO(body))
+    assert decoded.mode == mode
+    got, expected = np.asarray(decoded), np.asarray(image)
+    if mode == 'RGBA' and mimetype == 'image/webp':
+        # Lossless WebP may rewrite the (invisible) RGB of fully transparent pixels.
+        visible = expected[..., 3] > 0
+        assert np.array_equal(got[..., 3], expected[..., 3])
+        assert np.array_equal(got[visible], expected[visible])
+    else:
+        assert np.array_equal(got, expected)
+
+
+def test_lossy_formats():
+    image = _noise()
+    jpeg, mimetype = encode_image(image, output_options({'output_format': 'jpeg', 'output_quality': 50}))
+    assert mimetype == 'image/jpeg' and Image.open(io.BytesIO(jpeg)).size == image.size
+    webp, mimetype = encode_image(image, output_options({'output_format': 'webp', 'output_quality': 50}))
+    assert mimetype == 'image/webp'
+    lossless, _ = encode_image(image, output_options({'output_format': 'webp'}))
+    assert len(webp) < len(lossless)
+
+
+def test_jpeg_keeps_alpha_as_png():
+    for image in (_noise('RGBA'), _noise('LA')):
+        body, mimetype = encode_image(image, output_options({'output_format': 'jpeg'}))
+        assert mimetype == 'image/png'
+        assert np.array_equal(np.asarray(Image.open(io.BytesIO(body))), np.asarray(image))
+
+
+def test_json_response_has_data_urls():
+    payload = {'image': _noise(), 'variants': [{'hue': 30, 'image': _noise('RGBA')}], 'seed': 1}
+    body, status = encode_response(payload, 200, {'output_format': 'webp'})
+    assert status == 200 and body['seed'] == 1 and body['variants'][0]['hue'] == 30
+    assert body['image'].startswith('data:image/webp;base64,')
+    assert open_image(body['variants'][0]['image']).mode == 'RGBA'
+
+
+def test_image_response_for_a_single_image():
+    response = encode_response({'image': _noise(), 'seed': 7}, 200, {'response_format': 'image'})
+    assert response.mimetype == 'image/png'
+    assert json.loads(response.headers['X-Result-Meta']) == {'seed': 7}
+    assert Image.open(io.BytesIO(response.data)).size == (32, 24)
+
+
+@pytest.mark.parametrize('fmt', ['image', 'multipart'])
+def test_multipart_response_round_trips(fmt):
+    payload = {'images': [{'image': _noise()}, {'image': _noise('RGBA')}], 'seed': 3}
+    response = encode_response(payload, 200, {'response_format': fmt, 'output_format': 'webp'})
+    assert response.mimetype == 'multipart/form-data'
+    with app.test_request_context('/', method='POST', data=response.data,
+                                  content_type=response.headers['Content-Type']):
+        meta = json.loads(request.form['json'])
+        files = {name: storage.read() for name, storage in request.files.items()}
+    assert meta == {'images': [{'image': 'images.0.image'}, {'image': 'images.1.image'}], 'seed': 3}
+    assert Image.open(io.BytesIO(files['images.1.image'])).mode == 'RGBA'
+
+
+def test_errors_and_image_free_payloads_pass_through():
+    assert encode_response({'error': 'x'}, 500, {'response_format': 'image'}) == ({'error': 'x'}, 500)
+    assert encode_response({'seed': 1}, 200, {'response_format': 'multipart'}) == ({'seed': 1}, 200)
+
+
+def test_response_format_from_accept_header():
+    with app.test_request_context('/', headers={'Accept': 'image/png'}):
+        assert response_format({}, request) == 'image'
+        assert response_format({'response_format': 'json'}, request) == 'json'
+    with app.test_request_context('/', headers={'Accept': 'multipart/form-data'}):
+        assert response_format(None, request) == 'multipart'
+    assert response_format({}) == 'json'
@@ -0,0 +1,117 @@
+"""LoRA family detection from .safetensors headers only (no weights needed)."""
+
+import json
+import struct
+
+import pytest
+
+from lora_index import LoraIncompatible, LoraIndex, _inspect_header
+
+# family -> (UNet cross-attention context width, text encoder widths)
+WIDTHS = {
+    'sd15': (768, {'te': 768}),
+    'sd21': (1024, {'te': 1024}),
+    'xl': (2048, {'te1': 768, 'te2': 1280}),
+}
+RANK = 8
+
+
+def _kohya_keys(family):
+    context, te = WIDTHS[family]
+    block = 'lora_unet_down_blocks_0_attentions_0_transformer_blocks_0_'
+    keys = {
+        block + 'attn1_to_q.lora_down.weight': [RANK, 320],
+        block + 'attn1_to_q.lora_up.weight': [320, RANK],
+        block + 'attn2_to_q.lora_down.weight': [RANK, 320],
+        block + 'attn2_to_k.lora_down.weight': [RANK, context],
+        block + 'attn2_to_v.lora_down.weight': [RANK, context],
+        block + 'attn2_to_k.alpha': [],
+    }
+    prefixes = {'te': 'lora_te_', 'te1': 'lora_te1_', 'te2': 'lora_te2_'}
+    for name, width in te.items():
+        layer = prefixes[name] + 'text_model_encoder_layers_0_'
+        keys[layer + 'self_attn_q_proj.lora_down.weight'] = [RANK, width]
+        keys[layer + 'mlp_fc1.lora_down.weight'] = [RANK, width]
+    return keys
+
+
+def _diffusers_keys(family):
+    context, te = WIDTHS[family]
+    block = 'unet.down_blocks.0.attentions.0.transformer_blocks.0.'
+    keys = {
+        block + 'attn1.to_q.lora_A.weight': [RANK, 320],
+        block + 'attn1.to_q.lora_B.weight': [320, RANK],
+        block + 'attn2.to_q.lora_A.weight': [RANK, 320],
+        block + 'attn2.to_k.lora_A.weight': [RANK, context],
+        block + 'attn2.to_v.lora_A.weight': [RANK, context],
+    }
+    prefixes = {'te': 'text_encoder.', 'te1': 'text_encoder.', 'te2': 'text_encoder_2.'}
+    for name, width in te.items():
+        layer = prefixes[name] + 'text_model.encoder.layers.0.'
+        keys[layer + 'self_attn.q_proj.lora_A.weight'] = [RANK, width]
+    return keys
+
+
+FORMATS = {'kohya': _kohya_keys, 'diffusers': _diffusers_keys}
+
+
+def _header(keys):
+    # safetensors writers sort tensor names — text encoder keys come before UNet ones.
+    header = {'__metadata__': {'format': 'pt'}}
+    for key in sorted(keys):
+        header[key] = {'dtype': 'F16', 'shape': keys[key], 'data_offsets': [0, 0]}
+    return header
+
+
+def _write(path, keys):
+    data = json.dumps(_header(keys)).encode()
+    path.write_bytes(struct.pack('<Q', len(data)) + data)
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('family', WIDTHS)
+def test_family_from_header(tmp_path, fmt, family):
+    _write(tmp_path / 'style.safetensors', FORMATS[fmt](family))
+    info = LoraIndex(str(tmp_path)).get('style')
+    assert info.family == family
+    assert info.rank == RANK
+    expected_targets = {'unet', 'text_encoder'} | ({'text_encoder_2'} if family == 'xl' else set())
+    assert set(info.targets) == expected_targets
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('family', WIDTHS)
+def test_unet_only(fmt, family):
+    keys = {k: v for k, v in FORMATS[fmt](family).items() if 'unet' in k}
+    assert _inspect_header(_header(keys))[0] == family
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_xl_without_second_text_encoder(fmt):
+    # SDXL LoRA trained on UNet + first text encoder only: the 768-wide TE keys
+    # sort first, but the UNet attn2 width (2048) decides.
+    keys = {k: v for k, v in FORMATS[fmt]('xl').items() if 'te2' not in k and 'text_encoder_2' not in k}
+    keys = {k.replace('lora_te1_', 'lora_te_'): v for k, v in keys.items()}
+    assert _inspect_header(_header(keys))[0] == 'xl'
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('family', ['sd15', 'sd21'])
+def test_text_encoder_width_is_the_fallback(fmt, family):
+    keys = {k: v for k, v in FORMATS[fmt](family).items() if 'unet' not in k}
+    assert _inspect_header(_header(keys))[0] == family
+
+
+def test_unknown_family_allows_any_model(tmp_path):
+    _write(tmp_path / 'odd.safetensors', {'lora_unet_mid_block_attn1_to_q.lora_down.weight': [4, 1280]})
+    index = LoraIndex(str(tmp_path))
+    assert index.get('odd').family is None
+    assert index.check_compatible('odd', 'xl').name == 'odd'
+
+
+def test_incompatible_family_rejected(tmp_path):
+    _write(tmp_path / 'xl_style.safetensors', _kohya_keys('xl'))
+    index = LoraIndex(str(tmp_path))
+    with pytest.raises(LoraIncompatible):
+        index.check_compatible('xl_style', 'sd15')
+    assert index.check_compatible('xl_style', 'xl').family == 'xl'
@@ -0,0 +1,217 @@
+"""VramManager / ManagedCache bookkeeping on small CPU modules."""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from model_cache import VramManager  # noqa: E402
+
+MB = 1024 ** 2
+
+
+def _module(mb: float):
+    """Module holding `mb` MB of float32 buffers."""
+    module = torch.nn.Module()
+    module.register_buffer('weight', torch.zeros(int(mb * MB) // 4, dtype=torch.float32))
+    return module
+
+
+def _manager(budget_mb=None):
+    manager = VramManager(budget_bytes=None if budget_mb is None else int(budget_mb * MB), host_budget_bytes=0)
+    manager._device_type = 'cpu'  # byte accounting on CPU tensors
+    return manager
+
+
+def test_lru_eviction_over_budget():
+    manager = _manager(budget_mb=3)
+    pipes = manager.cache('pipelines')
+    for key in ('a', 'b', 'c'):
+        manager.begin_job()
+        pipes[key] = _module(1)
+    manager.begin_job()
+    pipes['a']  # a becomes most recently used
+    manager.begin_job()
+    pipes['d'] = _module(1)
+    assert sorted(pipes) == ['a', 'c', 'd']
+    assert manager.resident_bytes() == 3 * MB
+
+
+def test_entries_of_the_running_job_are_protected():
+    manager = _manager(budget_mb=2)
+    pipes = manager.cache('pipelines')
+    manager.begin_job()
+    pipes['a'] = _module(1)
+    pipes['b'] = _module(1)
+    assert manager.make_room(1 * MB) is False  # both in use by this job
+    assert sorted(pipes) == ['a', 'b']
+    manager.begin_job()
+    assert manager.make_room(1 * MB) is True
+    assert list(pipes) == ['b']
+
+
+def test_shared_modules_are_counted_once():
+    manager = _manager()
+    pipes = manager.cache('pipelines')
+    derived = manager.cache('controlnet_pipelines')
+    unet, controlnet = _module(2), _module(1)
+    pipes['base'] = {'pipe': unet}
+    derived.put('base__depth', {'unet': unet, 'controlnet': controlnet}, depends_on=[('pipelines', 'base')])
+    assert manager.resident_bytes() == 3 * MB
+    assert manager.own_bytes(('controlnet_pipelines', 'base__depth')) == 1 * MB
+    # Evicting the base also takes everything built on it.
+    assert manager.own_bytes(('pipelines', 'base')) == 3 * MB
+
+
+def test_dependents_are_evicted_with_their_base():
+    manager = _manager()
+    evicted = []
+    pipes = manager.cache('pipelines', on_evict=lambda key, value: evicted.append(key))
+    derived = manager.cache('controlnet_pipelines', on_evict=lambda key, value: evicted.append(key))
+    pipes['base'] = {'pipe': _module(1)}
+    derived.put('base__depth', {'controlnet': _module(1)}, depends_on=[('pipelines', 'base')])
+    removed = pipes.evict('base')
+    assert set(removed) == {('pipelines', 'base'), ('controlnet_pipelines', 'base__depth')}
+    assert evicted == ['base__depth', 'base']  # dependents first
+    assert 'base' not in pipes and 'base__depth' not in derived
+    assert manager.resident_bytes() == 0
+
+
+def test_estimate_remembers_the_last_measured_size():
+    manager = _manager()
+    pipes = manager.cache('pipelines')
+    assert manager.estimate(('pipelines', 'a'), 123) == 123
+    pipes['a'] = _module(2)
+    del pipes['a']
+    assert manager.estimate(('pipelines', 'a'), 123) == 2 * MB
+
+
+def test_replacing_an_entry_keeps_one_copy():
+    manager = _manager()
+    pipes = manager.cache('pipelines')
+    pipes['a'] = _module(1)
+    pipes['a'] = _module(2)
+    assert len(pipes) == 1
+    assert manager.resident_bytes() == 2 * MB
+
+
+def test_no_budget_never_evicts():
+    manager = _manager(budget_mb=None)
+    pipes = manager.cache('pipelines')
+    for key in range(5):
+        manager.begin_job()
+        pipes[key] = _module(1)
+    assert len(pipes) == 5
+    report = manager.report()
+    assert report['budget_mb'] is None and report['resident_mb'] == 5.0
+
+
+# ── host RAM tier ──────────────────────────────────────────────────────────
+
+class _Pipe:
+    """Cached value without torch modules — staging is pure bookkeeping."""
+
+
+def _staging_manager():
+    manager = VramManager(budget_bytes=None, host_budget_bytes=64 * MB)
+    manager._device_type = 'cuda'  # the host tier only exists next to a GPU
+    return manager
+
+
+def _staging_caches():
+    manager = _staging_manager()
+    dropped = []
+    pipes = manager.cache('pipelines', on_evict=lambda key, value: dropped.append(key))
+    derived = manager.cache('controlnet_pipelines', on_evict=lambda key, value: dropped.append(key))
+    return manager, pipes, derived, dropped
+
+
+def test_evicted_entry_is_staged_and_restored_by_contains():
+    manager, pipes, _, dropped = _staging_caches()
+    value = _Pipe()
+    pipes['a'] = value
+    pipes.evict('a')
+    assert list(pipes) == [] and len(pipes) == 0
+    assert [s['key'] for s in manager.report()['staged']] == ['a']
+    assert 'a' in pipes  # moves it back
+    assert list(pipes) == ['a'] and pipes['a'] is value
+    assert manager.report()['staged'] == []
+    assert dropped == []
+
+
+def test_getitem_restores_a_staged_entry():
+    _, pipes, _, _ = _staging_caches()
+    value = _Pipe()
+    pipes['a'] = value
+    pipes.evict('a')
+    assert pipes['a'] is value
+    assert pipes.get('missing') is None
+
+
+def test_del_stages_then_drops():
+    manager, pipes, _, dropped = _staging_caches()
+    pipes['a'] = _Pipe()
+    del pipes['a']          # resident → host tier
+    assert dropped == []
+    del pipes['a']          # staged → dropped for good
+    assert dropped == ['a']
+    assert 'a' not in pipes
+    assert manager.report()['staged'] == []
+    with pytest.raises(KeyError):
+        del pipes['a']
+
+
+def test_drop_evict_skips_the_host_tier():
+    _, pipes, _, dropped = _staging_caches()
+    pipes['a'] = _Pipe()
+    pipes.evict('a', drop=True)
+    assert dropped == ['a'] and 'a' not in pipes
+
+
+def test_dependents_are_staged_and_restored_with_their_base():
+    _, pipes, derived, dropped = _staging_caches()
+    pipes['base'] = _Pipe()
+    derived.put('base__depth', _Pipe(), depends_on=[('pipelines', 'base')])
+    pipes.evict('base')
+    assert list(derived) == [] and dropped == []
+    assert 'base__depth' in derived  # restores its base first
+    assert list(pipes) == ['base']
+
+
+def test_dropping_a_staged_base_drops_its_dependents():
+    _, pipes, derived, dropped = _staging_caches()
+    pipes['base'] = _Pipe()
+    derived.put('base__depth', _Pipe(), depends_on=[('pipelines', 'base')])
+    pipes.evict('base')
+    del pipes['base']
+    assert dropped == ['base__depth', 'base']
+    assert 'base__depth' not in derived
+
+
+def test_putting_a_staged_key_replaces_it():
+    _, pipes, _, dropped = _staging_caches()
+    pipes['a'] = _Pipe()
+    pipes.evict('a')
+    fresh = _Pipe()
+    pipes['a'] = fresh
+    assert dropped == ['a']
+    assert pipes['a'] is fresh
+
+
+def test_drop_host_tier():
+    manager, pipes, _, dropped = _staging_caches()
+    for key in 'ab':
+        pipes[key] = _Pipe()
+        pipes.evict(key)
+    assert sorted(manager.drop_host_tier()) == [('pipelines', 'a'), ('pipelines', 'b')]
+    assert sorted(dropped) == ['a', 'b']
+    assert 'a' not in pipes and 'b' not in pipes
+
+
+def test_no_host_tier_without_budget():
+    manager = VramManager(budget_bytes=None, host_budget_bytes=0)
+    manager._device_type = 'cuda'
+    dropped = []
+    pipes = manager.cache('pipelines', on_evict=lambda key, value: dropped.append(key))
+    pipes['a'] = _Pipe()
+    pipes.evict('a')
+    assert dropped == ['a'] and 'a' not in pipes
@@ -0,0 +1,102 @@
+"""remove_black_background vs. the original iterative-dilation flood fill."""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('scipy')
+from scipy import ndimage  # noqa: E402
+
+from remove_background import remove_black_background  # noqa: E402
+
+
+def _iterative_dilation(image, threshold=30):
+    """The pre-rewrite implementation: dilate border seeds 1 px per iteration."""
+    img_array = np.array(image)
+    dark_mask = img_array.mean(axis=2) <= threshold
+    h, w = dark_mask.shape
+    seed_mask = np.zeros_like(dark_mask, dtype=bool)
+    seed_mask[0, :] = dark_mask[0, :]
+    seed_mask[-1, :] = dark_mask[-1, :]
+    seed_mask[:, 0] = dark_mask[:, 0]
+    seed_mask[:, -1] = dark_mask[:, -1]
+    structure = np.ones((3, 3), dtype=bool)
+    background_mask = prev_mask = seed_mask.copy()
+    for _ in range(max(h, w)):
+        background_mask = ndimage.binary_dilation(prev_mask, structure=structure) & dark_mask
+        if np.array_equal(background_mask, prev_mask):
+            break
+        prev_mask = background_mask.copy()
+    alpha = np.where(background_mask, 0, 255).astype(np.uint8)
+    return Image.fromarray(np.dstack((img_array, alpha)), 'RGBA')
+
+
+def _ring(size=32):
+    """Black canvas, white ring, black hole inside the ring."""
+    yy, xx = np.mgrid[:size, :size]
+    r = np.hypot(yy - size / 2, xx - size / 2)
+    gray = np.where((r > size / 6) & (r < size / 3), 255, 0).astype(np.uint8)
+    return Image.fromarray(np.dstack([gray] * 3), 'RGB')
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    yield 'ring', _ring()
+    # Tmavý šum okolo prahu — veľa malých komponentov, diagonálne spojenia, dlhé „chodby“.
+    yield 'noise', Image.fromarray(rng.integers(0, 70, (48, 64, 3), dtype=np.uint8), 'RGB')
+    yield 'blobs', Image.fromarray(np.repeat(
+        (ndimage.gaussian_filter(rng.random((40, 40)), 2) > 0.5).astype(np.uint8)[..., None] * 200, 3, axis=2), 'RGB')
+    # Špirála: pozadie sa do stredu dostane len cez dlhú cestu (veľa iterácií dilatácie).
+    spiral = np.full((31, 31), 255, dtype=np.uint8)
+    for k in range(0, 15, 2):
+        spiral[k, k:31 - k] = spiral[k:31 - k, 30 - k] = spiral[30 - k, k:31 - k] = 0
+        spiral[k + 2:31 - k, k] = 0
+    yield 'spiral', Image.fromarray(np.dstack([spiral] * 3), 'RGB')
+    # Čierny pixel spojený s okrajom len diagonálne (8-susednosť).
+    diagonal = np.full((5, 5, 3), 255, dtype=np.uint8)
+    diagonal[0, 0] = diagonal[1, 1] = diagonal[2, 2] = 0
+    yield 'diagonal', Image.fromarray(diagonal, 'RGB')
+    yield 'all_black', Image.new('RGB', (16, 16), (0, 0, 0))
+    yield 'all_white', Image.new('RGB', (16, 16), (255, 255, 255))
+    yield 'mixed_channels', Image.fromarray(
+        np.stack([rng.integers(0, 91, (24, 24)), np.zeros((24, 24)), np.zeros((24, 24))], axis=2).astype(np.uint8), 'RGB')
+
+
+@pytest.mark.parametrize('threshold', [0, 30, 60])
+@pytest.mark.parametrize('name,image', list(_images()), ids=[name for name, _ in _images()])
+def test_matches_iterative_dilation(name, image, threshold):
+    result = remove_black_background(image, threshold=threshold)
+    expected = _iterative_dilation(image, threshold=threshold)
+    assert result.mode == 'RGBA'
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+
+def test_enclosed_black_stays_opaque():
+    alpha = np.asarray(remove_black_background(_ring()))[..., 3]
+    assert alpha[0, 0] == 0
+    assert alpha[16, 16] == 255  # hole inside the ring
+
+
+@pytest.mark.parametrize('soft_edge', [1, 2, 4])
+def test_soft_edge_alpha_ramp(soft_edge):
+    # Biely štvorec 12x12 na čiernom pozadí 20x20.
+    gray = np.zeros((20, 20), dtype=np.uint8)
+    gray[4:16, 4:16] = 255
+    image = Image.fromarray(np.dstack([gray] * 3), 'RGB')
+    alpha = np.asarray(remove_black_background(image, soft_edge=soft_edge))[..., 3].astype(int)
+    hard = np.asarray(remove_black_background(image))[..., 3]
+
+    assert (alpha[hard == 0] == 0).all()
+    # Alfa rastie po (soft_edge + 1) krokoch od okraja objektu (chessboard vzdialenosť).
+    for depth in range(6):
+        distance = depth + 1
+        expected = min(255, int(distance / (soft_edge + 1) * 255))
+        assert alpha[4 + depth, 10] == expected
+        assert alpha[4 + depth, 4 + depth] == expected  # diagonal ring
+    assert alpha[9, 9] == 255
+
+
+def test_soft_edge_without_background_is_opaque():
+    image = Image.new('RGB', (8, 8), (200, 200, 200))
+    alpha = np.asarray(remove_black_background(image, soft_edge=3))[..., 3]
+    assert (alpha == 255).all()
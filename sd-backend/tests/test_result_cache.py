@@ -0,0 +1,89 @@
+"""Result cache + single-flight on the real GpuJobQueue (no GPU needed)."""
+
+import threading
+import time
+
+from PIL import Image
+
+from gpu_queue import CANCELLED_RESULT, GpuJobQueue
+from result_cache import ResultCache
+from service import GenerateRequest, GenerationService
+
+
+def _service(tmp_path, release):
+    calls = []
+
+    def generate(data):
+        calls.append(data)
+        release.wait(5)
+        return {'image': Image.new('RGB', (8, 8), (data['seed'], 0, 0)), 'seed': data['seed']}, 200
+
+    queue = GpuJobQueue(batch_window_ms=0)
+    cache = ResultCache(max_bytes=1024 ** 2, directory=str(tmp_path), max_disk_bytes=1024 ** 2)
+    service = GenerationService(queue, result_cache=cache)
+    service.register(GenerateRequest, generate, cacheable=True)
+    return service, queue, calls
+
+
+def test_identical_requests_share_one_run(tmp_path):
+    release = threading.Event()
+    service, queue, calls = _service(tmp_path, release)
+    first = service.submit(GenerateRequest(prompt='x', seed=1))
+    second = service.submit(GenerateRequest(prompt='x', seed=1, output_format='webp'))
+    assert first is not second
+    assert first.shared is second.shared
+    release.set()
+    assert first.wait(5) and second.wait(5)
+    assert len(calls) == 1
+    assert first.result[1] == second.result[1] == 200
+    # Each caller keeps its own output encoding.
+    assert first.data.get('output_format') is None
+    assert second.data['output_format'] == 'webp'
+
+
+def test_cancel_by_one_caller_keeps_the_others(tmp_path):
+    release = threading.Event()
+    service, queue, calls = _service(tmp_path, release)
+    first = service.submit(GenerateRequest(prompt='x', seed=1))
+    second = service.submit(GenerateRequest(prompt='x', seed=1))
+    assert queue.cancel(first)
+    assert first.result == CANCELLED_RESULT
+    assert not first.shared.cancel_requested
+    release.set()
+    assert second.wait(5)
+    assert second.result[1] == 200
+    assert second.status == 'done'
+
+
+def test_last_cancel_cancels_the_shared_job(tmp_path):
+    release = threading.Event()
+    service, queue, calls = _service(tmp_path, release)
+    running = service.submit(GenerateRequest(prompt='busy', seed=2))  # occupies the worker
+    first = service.submit(GenerateRequest(prompt='x', seed=1))
+    second = service.submit(GenerateRequest(prompt='x', seed=1))
+    shared = first.shared
+    assert queue.cancel(first) and queue.cancel(second)
+    assert shared.finished and shared.status == 'cancelled'
+    # A new identical request starts a fresh job instead of joining the cancelled one.
+    third = service.submit(GenerateRequest(prompt='x', seed=1))
+    assert third.shared is not shared
+    release.set()
+    assert running.wait(5) and third.wait(5)
+    assert third.result[1] == 200
+
+
+def test_repeat_is_served_from_cache(tmp_path):
+    release = threading.Event()
+    release.set()
+    service, queue, calls = _service(tmp_path, release)
+    payload, status = service.run(GenerateRequest(prompt='x', seed=3))
+    assert status == 200
+    cache = service.result_cache
+    for _ in range(50):  # the store runs on the cache's writer thread
+        if cache.stats()['inflight'] == 0:
+            break
+        time.sleep(0.02)
+    payload, status = service.run(GenerateRequest(prompt='x', seed=3, output_format='jpeg'))
+    assert status == 200
+    assert payload['image'].getpixel((0, 0)) == (3, 0, 0)
+    assert len(calls) == 1
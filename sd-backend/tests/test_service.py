@@ -0,0 +1,123 @@
+"""Typed requests and the in-process GenerationService (no GPU needed)."""
+
+import threading
+
+import pytest
+from PIL import Image
+
+from gpu_queue import GpuJobQueue
+from service import (AdjustHueRequest, ClearGpuRequest, ControlNetRequest, GenerateRequest,
+                     GenerationService, RecolorBatchRequest)
+
+
+@pytest.mark.parametrize('raw,expected', [
+    ('1', True), ('true', True), ('Yes', True), ('on', True),
+    ('0', False), ('false', False), ('no', False), ('off', False), ('', False),
+    (True, True), (0, False), (1, True),
+])
+def test_bool_fields(raw, expected):
+    assert GenerateRequest.from_dict({'compiled': raw}).compiled is expected
+
+
+@pytest.mark.parametrize('raw,expected', [('512', 512), ('512.0', 512), (512.7, 512), (768, 768)])
+def test_int_fields(raw, expected):
+    assert GenerateRequest.from_dict({'width': raw}).width == expected
+
+
+@pytest.mark.parametrize('field,raw', [
+    ('width', True), ('width', 'wide'), ('width', [512]),
+    ('compiled', 'maybe'), ('strength', 'strong'), ('hue_shifts', '{"a": 1}'),
+])
+def test_mistyped_fields_are_rejected(field, raw):
+    request_cls = RecolorBatchRequest if field == 'hue_shifts' else GenerateRequest
+    with pytest.raises(ValueError, match=f"'{field}'"):
+        request_cls.from_dict({field: raw})
+
+
+def test_float_str_and_list_fields():
+    req = GenerateRequest.from_dict({'strength': '0.75', 'guidance_scale': 7, 'prompt': 123, 'seed': None})
+    assert req.strength == 0.75 and isinstance(req.guidance_scale, float)
+    assert req.prompt == '123'
+    assert req.seed is None
+    assert RecolorBatchRequest.from_dict({'tints': ['#FF0000']}).tints == ['#FF0000']
+
+
+def test_image_fields_and_extras_pass_through():
+    image = Image.new('RGB', (4, 4))
+    req = ControlNetRequest.from_dict({'image': image, 'styleImage': 'data:...', 'prompt': 'x'})
+    assert req.image is image
+    assert req.extra == {'styleImage': 'data:...'}
+    assert req.as_data() == {'image': image, 'styleImage': 'data:...', 'prompt': 'x'}
+
+
+def test_as_data_omits_unset_fields():
+    assert AdjustHueRequest(hue_shift=30.0).as_data() == {'hue_shift': 30.0}
+    with pytest.raises(ValueError):
+        AdjustHueRequest.from_dict(['not', 'a', 'dict'])
+
+
+def _service(max_pending=32):
+    calls = []
+
+    def hue(data):
+        calls.append(('hue', data))
+        return {'hue_shift': data['hue_shift']}, 200
+
+    def clear(data):
+        calls.append(('clear', data))
+        return {'cleared': True}, 200
+
+    queue = GpuJobQueue(max_pending=max_pending, batch_window_ms=0)
+    service = GenerationService(queue)
+    service.register(AdjustHueRequest, hue)
+    service.register(ClearGpuRequest, clear, gpu=False)
+    return service, queue, calls
+
+
+def test_call_coerces_and_runs():
+    service, _, calls = _service()
+    assert service.call('/adjust-hue', {'hue_shift': '45', 'image': b'png'}) == ({'hue_shift': 45.0}, 200)
+    assert calls == [('hue', {'hue_shift': 45.0, 'image': b'png'})]
+    assert service.call('/clear-gpu', {}) == ({'cleared': True}, 200)
+    assert service.endpoints(gpu=True) == ['/adjust-hue']
+    assert '/clear-gpu' in service and '/nope' not in service
+
+
+def test_call_errors():
+    service, _, calls = _service()
+    payload, status = service.call('/nope', {})
+    assert status == 404 and '/adjust-hue' in payload['error']
+    payload, status = service.call('/adjust-hue', {'hue_shift': 'left'})
+    assert status == 400 and 'hue_shift' in payload['error']
+    assert calls == []
+    with pytest.raises(KeyError):
+        service.request('/nope', {})
+
+
+def test_call_all_keeps_order_and_reports_each_error():
+    service, _, _ = _service()
+    results = service.call_all([
+        ('/adjust-hue', {'hue_shift': 10}),
+        ('/nope', {}),
+        ('/clear-gpu', {}),
+        ('/adjust-hue', {'hue_shift': 'x'}),
+        ('/adjust-hue', {'hue_shift': 20}),
+    ])
+    assert [status for _, status in results] == [200, 404, 200, 400, 200]
+    assert results[0][0] == {'hue_shift': 10.0} and results[4][0] == {'hue_shift': 20.0}
+
+
+def test_queue_full_is_503():
+    service, queue, _ = _service(max_pending=1)
+    release, started = threading.Event(), threading.Event()
+
+    def block(_):
+        started.set()
+        release.wait(5)
+        return {}, 200
+
+    queue.submit('block', block, {})
+    assert started.wait(5)
+    queue.submit('block', block, {})  # fills the pending slot
+    assert service.call('/adjust-hue', {'hue_shift': 1})[1] == 503
+    release.set()